@@ -1,26 +1,40 @@
 import json
 import random
-import re
 import string
 import numpy
 import openvr
 import sys
 import os
 import time
+import glob
 import traceback
 import ctypes
 import argparse
 import zeroconf
 import logging
-import read_registry
 from logging.handlers import RotatingFileHandler
-from pythonosc import udp_client, dispatcher, osc_server
+from pythonosc import osc_server
 from tinyoscquery.queryservice import OSCQueryService
 from tinyoscquery.utility import get_open_tcp_port, get_open_udp_port
-from tinyoscquery.query import OSCQueryBrowser, OSCQueryClient
+from tinyoscquery.query import OSCQueryClient
+from vrchat_discovery import VRChatDiscovery
+from avatar_schema import device_serials, load_avatar_schema
+from tracking_reference import TrackingReferenceEstimator
 from psutil import process_iter
 from threading import Thread
-from scipy.spatial.transform import Rotation
+from tracker_encoder import AXES, TrackerEncoder
+from osc_client import BundledUDPClient
+from pose_source import FLAGS_OK, OpenVRPoseSource, PoseFrame, PoseRecorder, PoseReplayer
+from metrics import Metrics, StageTimer
+from frame_scheduler import FrameScheduler
+from pose_prediction import PosePredictor
+from send_scheduler import SendScheduler
+from state_store import StateStore
+from osc_router import OSCRouter
+from osc_receiver import create_osc_server
+from async_logging import setup_logging
+from traffic_recorder import DIRECTION_IN, DIRECTION_OUT, TrafficRecorder
+from pose_math import euler_yxz, matrices_to_osc_array, yaw_rotation
 
 #TODO VERIFY THIS FUCKING PARAMETER EXPRESSION CONFIG
 
@@ -57,130 +71,284 @@ def is_vrchat_running() -> bool:
     return _proc_name in (p.name() for p in process_iter())
 
 
-def find_service_by_regex(browser: OSCQueryBrowser, regex) -> zeroconf.ServiceInfo | None:
-    for svc in browser.get_discovered_oscquery():
-        client = OSCQueryClient(svc)
-        host_info = client.get_host_info()
-        if host_info is None:
-            continue
-        if re.match(regex, host_info.name):
-            logger.debug(f"Found service by regex: {host_info.name}")
-            return svc
-    logger.debug(f"Service not found by regex: {regex}")
-    return None
-
-
 def wait_get_oscquery_client() -> OSCQueryClient:
     """
     Waits for VRChat to be discovered and ready and returns the OSCQueryClient.
+    The discovery keeps running, so calling this again after VRChat restarted finds the new instance.
     Returns:
         OSCQueryClient: OSCQueryClient for VRChat
     """
+    global vrchat_discovery
+    if vrchat_discovery is None:
+        vrchat_discovery = VRChatDiscovery()
+    start = time.perf_counter()
     logger.info("Waiting for VRChat Client to be discovered ...")
-    service_info = None
-    while service_info is None:
-        browser = OSCQueryBrowser()
-        time.sleep(2)  # Wait for discovery
-        # TODO: check if multiple VRChat clients are found
-        service_info = find_service_by_regex(browser, r"VRChat-Client-[A-F0-9]{6}")
-    logger.info(f"Connecting to VRChat Client ({service_info.name}) ...")
-    client = OSCQueryClient(service_info)
-    logger.info("Waiting for VRChat Client to be ready ...")
-    while client.query_node("/avatar/change") is None:
-        time.sleep(1)
-    logger.info("VRChat Client is ready!")
+    while True:
+        client = vrchat_discovery.wait(timeout=10)
+        if client is None:
+            logger.info("Still waiting for VRChat Client to be discovered ...")
+            continue
+        discovered = time.perf_counter()
+        logger.info(f"Connecting to VRChat Client ({client.get_host_info().name}) after {discovered - start:.3f}s ...")
+        if vrchat_discovery.wait_ready(client, timeout=30):
+            break
+        logger.info("VRChat Client didn't get ready, waiting for it to be discovered again ...")
+    metrics.connect_seconds = time.perf_counter() - start
+    logger.info(f"VRChat Client is ready after {metrics.connect_seconds:.3f}s ({time.perf_counter() - discovered:.3f}s after discovery)!")
     return client
 
 
-def wait_get_oscquery_server() -> osc_server.ThreadingOSCUDPServer:
+def keep_oscquery_client() -> None:
+    """
+    Keeps oscQueryClient connected to VRChat, runs on a background thread.
+    After VRChat is gone (e.g. restarted) oscQueryClient is None until VRChat is discovered again.
+    Returns:
+        None
+    """
+    global oscQueryClient
+    while True:
+        client = oscQueryClient = wait_get_oscquery_client()
+        subscription = client.subscribe(["/avatar/change"], on_oscquery_avatar_change)
+        logger.info(f"Subscribed to avatar changes of VRChat Client ({'polling' if subscription.polling else 'LISTEN'})")
+        vrchat_discovery.wait_gone(client)
+        subscription.close()
+        oscQueryClient = None
+        logger.info("VRChat Client is gone")
+
+
+def on_oscquery_avatar_change(address: str, values: list) -> None:
+    """
+    Receives the avatar id from VRChat's OSCQuery service on the subscription thread, it's applied at the next frame boundary.
+    Parameters:
+        address (str): /avatar/change
+        values (list): Avatar id
+    Returns:
+        None
+    """
+    if values:
+        state.publish(OSCQUERY_AVATAR_CHANGE_ADDRESS, values[0])
+
+
+def wait_get_oscquery_server() -> osc_server.OSCUDPServer:
     logger.info("Starting OSCquery Server ...")
-    disp = dispatcher.Dispatcher()
-    disp.set_default_handler(osc_message_handler)
-    oscQueryServer = osc_server.ThreadingOSCUDPServer((IP, SERVER_PORT), disp)
+    oscQueryServer = create_osc_server(OSC_RECEIVER, (IP, SERVER_PORT), create_osc_router())
     Thread(target=oscQueryServer.serve_forever, daemon=True).start()
     # Announce Server
     oscServiceName = "ObjectTracking-" + ''.join(random.choices(string.ascii_lowercase + string.digits, k=4))
     logger.info(f"Announcing Server as {oscServiceName} ...")
+    global oscQueryService
     oscQueryService = OSCQueryService(oscServiceName, HTTP_PORT, SERVER_PORT)
-    oscQueryService.advertise_endpoint("/avatar/change")
-    # TODO: add all endpoints
+    advertise_endpoints()
+    oscQueryService.add_route("/metrics", lambda: ("text/plain; version=0.0.4", metrics.to_prometheus().encode("utf-8")))
+    oscQueryService.add_route("/metrics.json", lambda: ("application/json", metrics.to_json().encode("utf-8")))
+    oscQueryService.add_route("/traffic", lambda: ("application/octet-stream", traffic.to_bytes()))
+    logger.info(f"Metrics available at http://127.0.0.1:{HTTP_PORT}/metrics and /metrics.json")
     
     return oscQueryServer
-    
 
-def send_parameter(parameter: str, value) -> None:
+
+def advertise_endpoints() -> None:
+    """
+    Advertises the OSC addresses ObjectTracking listens to, so VRChat only sends those.
+    Device specific addresses are added by advertise_devices(), before the config is requested.
+    Returns:
+        None
+    """
+    oscQueryService.advertise_endpoint("/avatar/change", type_=str)
+    for parameter, type_ in ADVERTISED_PARAMETERS.items():
+        oscQueryService.advertise_endpoint(AVATAR_PARAMETERS_PREFIX + parameter, type_=type_)
+    advertise_device("PlaySpace")
+
+
+def advertise_device(serial: str) -> None:
+    """
+    Advertises the OSC addresses of a tracker.
+    Parameters:
+        serial (str): Serial number of the device
+    Returns:
+        None
+    """
+    advertised_devices.add(serial)
+    oscQueryService.advertise_endpoint(f"{AVATAR_PARAMETERS_PREFIX}ObjectTracking/tracker/{serial}/enabled", type_=bool)
+    oscQueryService.advertise_endpoint(f"{AVATAR_PARAMETERS_PREFIX}ObjectTracking/config/{serial}", type_=int)
+
+
+def advertise_devices(serials) -> bool:
+    """
+    Advertises the OSC addresses of devices that weren't seen before.
+    Parameters:
+        serials (Iterable[str]): Serial numbers of the devices
+    Returns:
+        bool: True if a device was new, its config has to be requested again, see request_config()
+    """
+    new = False
+    for serial in serials:
+        if serial not in advertised_devices:
+            logger.debug("Advertising endpoints of %s", serial)
+            advertise_device(serial)
+            new = True
+    return new
+
+
+def request_config() -> None:
+    """
+    Asks the avatar to send the config of all trackers again, like at startup.
+    The request is sent by send_config_request() until the avatar answers.
+    Returns:
+        None
+    """
+    global config_requested_at
+    # the avatar resets it when it sent the config
+    set_parameter("ObjectTracking/config/global", True)
+    config_requested_at = None
+
+
+def send_config_request() -> None:
+    """
+    Sends a pending config request, at most once per CONFIG_REQUEST_INTERVAL.
+    Returns:
+        None
+    """
+    global config_requested_at
+    if not get_parameter("ObjectTracking/config/global", False):
+        return
+    now = time.monotonic()
+    if config_requested_at is not None and now - config_requested_at < CONFIG_REQUEST_INTERVAL:
+        return
+    if config_requested_at is None:
+        logger.info("Requesting the tracker config from the avatar")
+    config_requested_at = now
+    send_parameter("ObjectTracking/config/global", True, force=True)
+
+
+def send_parameter(parameter: str, value, tracker: str = "", force: bool = False) -> None:
     """
     Sends a parameter to VRChat via OSC if parameter got updated.
     Parameters:
         parameter (str): Name of the parameter
         value (any): Value of the parameter
+        tracker (str): Name of the tracker the parameter belongs to, used for metrics
+        force (bool): Send even if the value didn't change
     Returns:
-        None
+        int: Size of the sent message, 0 if the parameter didn't change
     """
-    if get_parameter(parameter, None) != value:
-        logger.debug(f"<  > {AVATAR_PARAMETERS_PREFIX + parameter} = {value} ({type(value)})")
+    size = 0
+    if force or not state.is_sent(parameter, value):
+        logger.debug("<  > %s%s = %s (%s)", AVATAR_PARAMETERS_PREFIX, parameter, value, type(value))
         oscClient.send_message(AVATAR_PARAMETERS_PREFIX + parameter, value)
+        traffic.record(DIRECTION_OUT, AVATAR_PARAMETERS_PREFIX + parameter, value)
+        state.sent[parameter] = value
+        size = oscClient.last_message_size
+        metrics.count_sent(tracker, size)
     else:
-        logger.debug(f"<\\\\> {AVATAR_PARAMETERS_PREFIX + parameter} = {value} ({type(value)})")
+        logger.debug("<\\\\> %s%s = %s (%s)", AVATAR_PARAMETERS_PREFIX, parameter, value, type(value))
     
     if 'oscClientUnity' in globals():
         oscClientUnity.send_message(AVATAR_PARAMETERS_PREFIX + parameter, value)
+    return size
 
-def send_default_position(tracker_name: str, tracker_config) -> None:
-    offset = 0
-    for key in ["PX", "PY", "PZ", "RX", "RY", "RZ"]:
-        #local
-        send_parameter(f"ObjectTracking/{tracker_name}/L{key}", 0.0)
-        
-        #remote
-        accuracy_bytes, accuracy_bits = divmod(tracker_config[1 + offset], 8)
-        for i in range(accuracy_bytes):
-            send_parameter(f"ObjectTracking/{tracker_name}/R{key}-Byte{i}", 0)
-        for i in range(accuracy_bits):
-            send_parameter(f"ObjectTracking/{tracker_name}/R{key}-Bit{i}", 0)
-        
-        offset += 1
+def dump_traffic(reason: str, background: bool = True) -> None:
+    """
+    Writes the recorded OSC traffic to the data folder, at most once per TRAFFIC_DUMP_INTERVAL, only the latest TRAFFIC_DUMP_COUNT dumps are kept.
+    Only the snapshot is taken on the calling thread, the file is written on a background thread unless background is False.
+    Parameters:
+        reason (str): Reason of the dump, part of the file name
+        background (bool): False to write the file before returning, e.g. before exiting
+    Returns:
+        None
+    """
+    global last_traffic_dump
+    now = time.monotonic()
+    if last_traffic_dump is not None and now - last_traffic_dump < TRAFFIC_DUMP_INTERVAL:
+        return
+    last_traffic_dump = now
+    path = get_absolute_data_path(f"traffic-{time.strftime('%Y%m%d-%H%M%S')}-{reason}.bin")
+    data = traffic.to_bytes()
+    if background:
+        Thread(target=write_traffic_dump, args=(path, data, reason), name="TrafficDump", daemon=True).start()
+    else:
+        write_traffic_dump(path, data, reason)
 
-def send_position(tracker_name: str, matrix, tracker_config) -> None:
-    px, py, pz, rx, ry, rz = convert_matrix_to_osc_tuple(matrix)
-    
-    offset = 0
-    for key, value in {
-        "PX": px,     # 0
-        "PY": py,     # 1
-        "PZ": pz,     # 2
-        "RX": rx*180, # 3
-        "RY": ry*180, # 4
-        "RZ": rz*180  # 5
-    }.items():
-        logger.debug(f"Sending {tracker_name}/{key} = {value}")
-
-        # local
-        value_local = numpy.interp(
-            value,
-            [tracker_config[7 + offset], tracker_config[19 + offset]],
-            [0, 1]
-        )
-        value_local = numpy.clip(value_local, 0, 1)
-        send_parameter(f"ObjectTracking/{tracker_name}/L{key}", value_local)
-
-        # remote
-        value_remote = numpy.interp(
-            value,
-            [tracker_config[13 + offset], tracker_config[25 + offset]],
-            [0, 1]
-        )
-        value_remote = numpy.clip(value_remote, 0, 1)
-        value_bin = round(value_remote * (2**tracker_config[1 + offset] - 1))
-        accuracy_bytes, accuracy_bits = divmod(tracker_config[1 + offset], 8)
-        for i in range(accuracy_bytes):
-            value_bin, byte = divmod(value_bin, 2**8)
-            send_parameter(f"ObjectTracking/{tracker_name}/R{key}-Byte{i}", byte)
-        for i in range(accuracy_bits):
-            value_bin, bit = divmod(value_bin, 2)
-            send_parameter(f"ObjectTracking/{tracker_name}/R{key}-Bit{i}", bit)
-
-        offset += 1
+
+def write_traffic_dump(path: str, data: bytes, reason: str) -> None:
+    """
+    Writes a traffic dump and deletes all but the latest TRAFFIC_DUMP_COUNT dumps.
+    Parameters:
+        path (str): Path of the dump file
+        data (bytes): Dump file content, see TrafficRecorder.to_bytes()
+        reason (str): Reason of the dump
+    Returns:
+        None
+    """
+    try:
+        with open(path, "wb") as f:
+            f.write(data)
+        for old in sorted(glob.glob(get_absolute_data_path("traffic-*.bin")))[:-TRAFFIC_DUMP_COUNT]:
+            os.remove(old)
+    except OSError as e:
+        logger.info(f"Error writing traffic dump: {e}")
+        return
+    logger.info(f"OSC traffic ({reason}) written to {path}")
+
+
+def flush_parameters() -> None:
+    """
+    Sends all parameters collected in bundle mode.
+    Returns:
+        None
+    """
+    oscClient.flush()
+    if 'oscClientUnity' in globals():
+        oscClientUnity.flush()
+
+
+def send_positions(tracking_objects: dict, pill: numpy.ndarray, now: float) -> None:
+    """
+    Sends the position of all configured trackers relative to the pill, trackers without pose are sent as default position.
+    Parameters:
+        tracking_objects (dict): Pose matrices by tracker name
+        pill (numpy.ndarray): Pose matrix of the pill
+        now (float): Time of the frame in seconds, for the send scheduler
+    Returns:
+        None
+    """
+    tracker_encoder.update(state.trackers)
+    names = tracker_encoder.names
+    values = numpy.zeros((len(names), 6))
+    valid = numpy.array([name in tracking_objects for name in names], dtype=bool)
+    if valid.any():
+        poses = numpy.stack([tracking_objects[name] for name in names if name in tracking_objects])
+        poses = rotate_matrix_xz(relative_matrix(pill, poses), pill)
+        frame_stages.mark("rotate")
+        # rotation in degrees
+        values[valid] = matrices_to_osc_array(poses) * [1, 1, 1, 180, 180, 180]
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Sending %s = %s", [name for name in names if name in tracking_objects], values[valid])
+    encoded = tracker_encoder.parameters(values, valid)
+    metrics.count_suppressed(tracker_encoder.suppressed)
+    frame_stages.mark("encode")
+    encoded = list(zip(encoded, tracker_encoder.parameter_trackers))
+    costs = dict.fromkeys(names, 0)
+    counts = dict.fromkeys(names, 0)
+    for (parameter, value), tracker_name in encoded:
+        counts[tracker_name] += 1
+        if not state.is_sent(parameter, value):
+            costs[tracker_name] += 1
+    deferred = send_scheduler.deferred
+    selected = send_scheduler.select(names, values, [costs[name] for name in names], now, [counts[name] for name in names])
+    metrics.count_deferred(send_scheduler.deferred - deferred)
+    forced = send_scheduler.forced
+    messages = 0
+    size = 0
+    for (parameter, value), tracker_name in encoded:
+        if tracker_name in selected:
+            # refreshes resend unchanged values, in case a UDP message got lost
+            sent = send_parameter(parameter, value, tracker_name, force=tracker_name in forced)
+            messages += sent > 0
+            size += sent
+    if send_scheduler.limited:
+        send_scheduler.charge(messages, size)
+    frame_stages.mark("send")
 
 
 def set_parameter(parameter: str, value) -> None:
@@ -192,8 +360,7 @@ def set_parameter(parameter: str, value) -> None:
     Returns:
         None
     """
-    global parameters
-    parameters[parameter] = value
+    state.parameters[parameter] = value
 
 
 def get_parameter(parameter: str, fallback):
@@ -205,8 +372,7 @@ def get_parameter(parameter: str, fallback):
     Returns:
         Any
     """
-    global parameters
-    return parameters.get(parameter, fallback)
+    return state.parameters.get(parameter, fallback)
 
 def add_hash_to_key_name(key: str) -> str:
     """
@@ -238,14 +404,105 @@ def on_avatar_change(addr, value) -> None:
         None
     """
     logger.info(f"Avatar changed to {value}")
-    global parameters, trackers, tracking_references_raw
-    parameters = {}
-    trackers = {}
-    tracking_references_raw = {}
-    tracking_reference_vector = None
+    state.reset()
+    tracker_encoder.set_schema(None)
+    if AVATAR_SCHEMA:
+        Thread(target=load_avatar_parameters, args=(value, oscQueryClient), daemon=True).start()
+    send_scheduler.reset()
+    # base stations don't move with the avatar, the tracking reference is kept
+    if oscQueryService is not None:
+        for node in oscQueryService.root_node:
+            if node.value is not None:
+                node.value = None
+
+
+def load_avatar_parameters(avatar_id: str, client: OSCQueryClient | None) -> None:
+    """
+    Reads the parameters of an avatar on a background thread, they are applied at the next frame boundary.
+    Parameters:
+        avatar_id (str): Avatar id
+        client (OSCQueryClient | None): Client of VRChat's OSCQuery service, used if the avatar has no OSC config
+    Returns:
+        None
+    """
+    try:
+        schema, source = load_avatar_schema(avatar_id, client)
+    except Exception as e:
+        logger.info(f"Error reading parameters of avatar {avatar_id}: {e}")
+        return
+    state.publish(AVATAR_SCHEMA_ADDRESS, (avatar_id, schema, source))
+
+
+def apply_avatar_schema(avatar_id: str, schema: dict | None, source: str) -> None:
+    """
+    Only sends tracker parameters the avatar has, unless the avatar changed again in the meantime.
+    Parameters:
+        avatar_id (str): Avatar id
+        schema (dict | None): Parameter name -> type, None if unknown
+        source (str): Where the parameters were read from
+    Returns:
+        None
+    """
+    if avatar_id != get_parameter("/avatar/change", None):
+        return
+    if schema is None:
+        logger.info(f"Parameters of avatar {avatar_id} not found, sending all tracker parameters")
+        return
+    count = sum(1 for parameter in schema if parameter.startswith("ObjectTracking/"))
+    if count == 0:
+        # VRChat doesn't rewrite the OSC config of a re-uploaded avatar, it can be outdated
+        logger.warning(f"Parameters of avatar {avatar_id} read from {source} have no ObjectTracking parameters, sending all tracker parameters (delete the file if it's outdated)")
+        return
+    tracker_encoder.set_schema(schema)
+    logger.info(f"Parameters of avatar {avatar_id} read from {source}: {count} ObjectTracking parameters")
+    # the avatar might have sent the config of devices that weren't advertised yet, VRChat dropped it
+    if oscQueryService is not None and advertise_devices(device_serials(schema)):
+        request_config()
+
+
+def osc_message_handler(addr, *args) -> None:
+    """
+    Receives OSC messages on the OSC server threads, they are applied at the next frame boundary.
+    Messages without exactly one argument are dropped.
+    Parameters:
+        addr (str): Address of the message
+        args (any): Arguments of the message
+    Returns:
+        None
+    """ 
+    if len(args) != 1:
+        return
+    value = args[0]
+    metrics.count_received()
+    traffic.record(DIRECTION_IN, addr, value)
+    state.publish(addr, value)
+
+
+def create_osc_router() -> OSCRouter:
+    """
+    Routes the OSC messages used by ObjectTracking to osc_message_handler, all others are dropped.
+    Returns:
+        OSCRouter: Router to be used as dispatcher of the OSC server
+    """
+    router = OSCRouter()
+    router.map_exact("/avatar/change", osc_message_handler)
+    for parameter in ["TrackingType", "VelocityX", "VelocityY", "VelocityZ"]:
+        router.map_exact(AVATAR_PARAMETERS_PREFIX + parameter, osc_message_handler)
+    router.map_prefix(AVATAR_PARAMETERS_PREFIX + "ObjectTracking/", osc_message_handler)
+    return router
+
+
+def apply_received_messages() -> None:
+    """
+    Applies all messages received since the last call, runs on the frame loop.
+    Returns:
+        None
+    """
+    for addr, value in state.pending():
+        apply_message(addr, value)
 
 
-def osc_message_handler(addr, value) -> None:
+def apply_message(addr, value) -> None:
     """
     Handles OSC messages.
     Parameters:
@@ -253,21 +510,38 @@ def osc_message_handler(addr, value) -> None:
         value (any): Value of the message
     Returns:
         None
-    """ 
+    """
+    if addr == AVATAR_SCHEMA_ADDRESS:
+        apply_avatar_schema(*value)
+        return
+    if addr == OSCQUERY_AVATAR_CHANGE_ADDRESS:
+        # usually the avatar change was received via OSC already, this catches lost UDP messages
+        if value != get_parameter("/avatar/change", None):
+            logger.info(f"Avatar change to {value} reported by OSCQuery only")
+            apply_message("/avatar/change", value)
+        return
     parameter = addr.removeprefix(AVATAR_PARAMETERS_PREFIX)
     if parameter.startswith("ObjectTracking/"):
-        logger.debug(f" ><  {addr}: {value} ({type(value)})")
+        logger.debug(" ><  %s: %s (%s)", addr, value, type(value))
     if addr == "/avatar/change":
         on_avatar_change(addr, value)
     set_parameter(parameter, value)
+    if parameter in state.sent and not state.is_sent(parameter, value):
+        # the avatar changed a parameter we send, send it again on the next change,
+        # echoes are float32 and keep the held value, otherwise it would be resent every frame
+        state.sent[parameter] = value
+    if oscQueryService is not None:
+        oscQueryService.set_value(addr, value)
     if parameter == "ObjectTracking/config/index" and value == 0:
         update_player_height()
-        logger.info(trackers)
+        # formatted later on the logging thread, the configs can change until then
+        logger.info("%s", {device: dict(config) for device, config in state.trackers.items()})
     if parameter == "ObjectTracking/config/index" and value != 0:
         device = get_parameter("ObjectTracking/config/device", 0)
         index = value
         new = get_parameter("ObjectTracking/config/value", 0)
         old = None
+        trackers = state.trackers
         if trackers.get(device, None) is None:
             trackers[device] = {}
         if trackers[device].get(index, None) is not None:
@@ -275,7 +549,9 @@ def osc_message_handler(addr, value) -> None:
         if old != new:
             logger.info(f"{device}[{index}] {old} => {new}")
         trackers[device][index] = new
-    if re.match(r"ObjectTracking/config/(?!index|value)", parameter) and value > 0:
+        if old != new:
+            tracker_encoder.invalidate()
+    if parameter.startswith("ObjectTracking/config/") and not parameter.startswith(("ObjectTracking/config/index", "ObjectTracking/config/value")) and value > 0:
         set_parameter("ObjectTracking/config/device", parameter.removeprefix("ObjectTracking/config/"))
     if parameter == "ObjectTracking/isStabilized" and value:
         oscClient.send_message("/input/Vertical", 0.0)
@@ -284,90 +560,66 @@ def osc_message_handler(addr, value) -> None:
 
 
 def rotate_matrix_xz(matrix: numpy.ndarray, pill: numpy.ndarray) -> numpy.ndarray:
-    px, py, pz, rx, ry, rz = convert_matrix_to_osc_tuple(pill)
-    rot_y = Rotation.from_euler('y', ry * 180, degrees=True).as_matrix()
+    rot_y = yaw_rotation(euler_yxz(pill[0:3, 0:3])[0])
 
     # position adjustment
-    matrix[:3, 3] = rot_y @ matrix[:3, 3]
+    matrix[..., :3, 3] = (rot_y @ matrix[..., :3, 3, None])[..., 0]
 
     # rotation adjustment
-    matrix[:3, :3] = rot_y @ matrix[:3, :3]
+    matrix[..., :3, :3] = rot_y @ matrix[..., :3, :3]
     # TODO: this is not correct, but it works
-    matrix[:3, :3] = rot_y @ matrix[:3, :3]
+    matrix[..., :3, :3] = rot_y @ matrix[..., :3, :3]
 
     return matrix
 
 
 def print_matrix(name: str, matrix: numpy.ndarray) -> None:
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
     px, py, pz, rx, ry, rz = convert_matrix_to_osc_tuple(matrix)
     logger.debug(f"{name}: px: {round(px, 3)}m, py: {round(py, 3)}m, pz: {round(pz, 3)}m, rx: {round(rx*180, 2)}° ({round(rx, 2)}), ry: {round(ry*180, 2)}° ({round(ry, 2)}), rz: {round(rz*180, 2)}° ({round(rz, 2)})")
 
 
-def compute_tracking_reference_position(references):
-    global tracking_reference_vector
-    order = sorted(references.keys())
-    references = numpy.array(list(references.values()))
-
-    tracking_reference_position = numpy.eye(4)
-    if len(references) == 0:
-        return tracking_reference_position
-    
-    if len(references) == 1:
-        return references[0]
-        
-    # positions
-    tracking_reference_position[:3, 3] = references[:, 0:3, 3].mean(axis=0)
-    return tracking_reference_position
-
-
 def relative_matrix(parent: numpy.ndarray, child: numpy.ndarray) -> numpy.ndarray:
-    result = numpy.eye(4)
-    result[0:3, 0:3] = numpy.dot(numpy.linalg.inv(parent[0:3, 0:3]), child[0:3, 0:3])
-    result[0:3, 3] = child[0:3, 3] - parent[0:3, 3]
+    """ child can be a single (4, 4) matrix or a (N, 4, 4) stack of matrices """
+    result = numpy.zeros(numpy.shape(child))
+    # parent rotation is orthonormal, its inverse is its transpose
+    result[..., 0:3, 0:3] = parent[0:3, 0:3].T @ child[..., 0:3, 0:3]
+    result[..., 0:3, 3] = child[..., 0:3, 3] - parent[0:3, 3]
+    result[..., 3, 3] = 1
     return result
 
 
-def convert_matrix34_to_matrix44(matrix34: openvr.HmdMatrix34_t) -> numpy.ndarray:
-    """ Convert OpenVR's 3x4 matrix to a 4x4 NumPy matrix """
-    return numpy.array([
-        [matrix34.m[0][0], matrix34.m[0][1], -matrix34.m[0][2], matrix34.m[0][3]],
-        [matrix34.m[1][0], matrix34.m[1][1], -matrix34.m[1][2], matrix34.m[1][3]],
-        [-matrix34.m[2][0], -matrix34.m[2][1], matrix34.m[2][2], -matrix34.m[2][3]],
-        [0, 0, 0, 1]
-    ])
+def convert_matrix34_to_matrix44(matrix34: numpy.ndarray) -> numpy.ndarray:
+    """ Convert OpenVR's (..., 3, 4) matrices to (..., 4, 4) NumPy matrices """
+    result = numpy.zeros(matrix34.shape[:-2] + (4, 4))
+    result[..., 0:3, :] = matrix34
+    result[..., 0:2, 2] *= -1
+    result[..., 2, 0:2] *= -1
+    result[..., 2, 3] *= -1
+    result[..., 3, 3] = 1
+    return result
 
 
 def convert_matrix_to_osc_tuple(pose: numpy.ndarray) -> tuple[float, float, float, float, float, float]:
-    # position
-    x, y, z = pose[0:3, 3]
-    x = float(x)
-    y = float(y)
-    z = float(z)
-
-    # rotation
-    yaw, pitch, roll = Rotation.from_matrix(pose[0:3, 0:3]).as_euler("YXZ")
-    # x, value range: -0.5 - 0.5
-    pitch = float(pitch / numpy.pi)
-    # y, value range: -1.0 - 1.0
-    yaw = float(yaw / numpy.pi)
-    # z, value range: -1.0 - 1.0
-    roll = float(roll / numpy.pi)
-
-    return (x, y, z, pitch, yaw, roll)
+    # x, y, z, pitch (-0.5 - 0.5), yaw (-1.0 - 1.0), roll (-1.0 - 1.0)
+    return tuple(matrices_to_osc_array(pose).tolist())
 
 
 def get_logger(debug=False):
+    global log_listener
     log_level = logging.DEBUG if debug else logging.INFO
 
-    logging.basicConfig(
-        level=log_level,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
+    # file writes and rotation happen on a background thread, not in the frame loop
+    log_listener = setup_logging(
+        log_level,
+        [
             RotatingFileHandler(
                 get_absolute_data_path("ObjectTracking.log"), maxBytes=10*1024*1024, backupCount=5
             ),
             logging.StreamHandler()
-        ]
+        ],
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     )
     return logging.getLogger(__name__)
 
@@ -375,6 +627,7 @@ def get_logger(debug=False):
 def update_player_height():
     # player height setting is not available as a parameter in VRChat
     # therefore we have to read it from the registry
+    import read_registry
     # Feature request: https://feedback.vrchat.com/feature-requests/p/irl-to-vr-scale
     player_height = read_registry.read_registry_raw_qword(
         read_registry.HKEY_CURRENT_USER,
@@ -390,184 +643,315 @@ def update_player_height():
     send_parameter(f"ObjectTracking/playerHeightIndex", closest_height_index)
 
 
-# Argument Parser
-parser = argparse.ArgumentParser(
-    description='ObjectTracking: OpenVR tracking data to VRChat via OSC.')
-parser.add_argument('--av3e-ip', required=False, type=str, help="AV3Emulator IP.")
-parser.add_argument('--av3e-port', required=False, type=str, help="AV3Emulator Port.")
-parser.add_argument('--debug', required=False, action='store_true', help="Debug mode.")
-args = parser.parse_args()
-logger = get_logger(args.debug)
+def process_frame(frame: PoseFrame) -> None:
+    """
+    Computes and sends the positions of all trackers for one frame.
+    Parameters:
+        frame (PoseFrame): Poses of all active devices
+    Returns:
+        None
+    """
+    global hmd_raw, pill_raw, tracking_reference
+    hmd = None
+    pill = None
+    tracking_objects_raw = {}
+    tracking_objects = {}
+    # only the base stations of this frame, switched off or lost ones are left out of the reference
+    tracking_references_raw = {}
+    poses_ok = ((frame.poses["flags"] & FLAGS_OK) == FLAGS_OK).tolist()
+    matrices = convert_matrix34_to_matrix44(frame.poses["matrix"])
+    for i, device in enumerate(frame.devices):
+        if not poses_ok[i]:
+            continue
+        if get_parameter(device.enabled_parameter, True) == False:
+            continue
+        
+        if device.device_class == openvr.TrackedDeviceClass_TrackingReference:
+            tracking_references_raw[device.serial] = matrices[i]
+        if device.device_class == openvr.TrackedDeviceClass_HMD:
+            hmd_raw = matrices[i].copy()
+        tracking_objects_raw[device.serial] = matrices[i]
+    frame_stages.mark("acquisition")
+
+    # only recomputed when a base station moved, see TrackingReferenceEstimator
+    tracking_reference_estimator.update(tracking_references_raw)
+    tracking_reference = tracking_reference_estimator.reference
+    if get_parameter("ObjectTracking/tracker/PlaySpace/enabled", True) and tracking_reference_estimator.recalibrations > 0:
+        tracking_objects_raw["PlaySpace"] = tracking_reference
+    frame_stages.mark("reference")
+
+    if hmd_raw is not None:
+        #hmd = relative_matrix(tracking_reference, hmd_raw)
+        if not get_parameter("ObjectTracking/isStabilized", False) and not get_parameter("ObjectTracking/isLazyStabilized", False):
+            old_pill_raw = pill_raw
+            pill_raw = hmd_raw
+            pill_raw[1, 3] = 0
+            yaw = euler_yxz(pill_raw[0:3, 0:3])[0]
+            # TODO: -yaw, otherwise it's inverted z axis for some reason
+            pill_raw[0:3, 0:3] = yaw_rotation(-yaw)
+            if get_parameter("TrackingType", 0) > 3 and get_parameter("VelocityX", 0) == 0 and get_parameter("VelocityY", 0) == 0 and get_parameter("VelocityZ", 0) == 0:
+                if old_pill_raw is not None:
+                    pill_raw[0:3, 0:3] = old_pill_raw[0:3, 0:3]
+        if pill_raw is not None:
+            pill = tracking_reference_estimator.inverse @ pill_raw
+    
+    if len(tracking_objects_raw) > 0:
+        tracking_objects = dict(zip(
+            tracking_objects_raw.keys(),
+            tracking_reference_estimator.inverse @ numpy.stack(list(tracking_objects_raw.values()))
+        ))
+    frame_stages.mark("relative")
+
+    if pill is not None:
+        send_positions(tracking_objects, pill, frame.timestamp)
 
-application = openvr.init(openvr.VRApplication_Utility)
-openvr.VRApplications().addApplicationManifest(get_absolute_path("app.vrmanifest"))
 
-# first start
-if getattr(sys, 'frozen', False) and not os.path.isfile(get_absolute_data_path("config.json")):
-    try:
-        openvr.VRApplications().setApplicationAutoLaunch("Hackebein.ObjectTracking", True)
-    except Exception as e:
-        pass
-    with open(get_absolute_data_path("config.json"), 'w') as f:
-        json.dump({
-            "IP": "127.0.0.1",
-            "Port": 9000,
-            "Server_Port": 0,
-            "HTTP_Port": 0,
-            "UpdateRate": 90
-        }, f, indent=4)
-
-openvr.VRInput().setActionManifestPath(get_absolute_data_path("config.json"))
-config = json.load(open(get_absolute_data_path("config.json")))
-
-IP = config["IP"]
-# shouldn't that be read from zeroconf?
-PORT = int(config["Port"])
-AV3EMULATOR_IP = args.av3e_ip if args.av3e_ip else IP
-AV3EMULATOR_PORT = int(args.av3e_port) if args.av3e_port else None
-SERVER_PORT = int(config["Server_Port"] if config["Server_Port"] > 0 else get_open_udp_port()) # OSC QUERY SERVER
-HTTP_PORT = int(config["HTTP_Port"] if config["HTTP_Port"] > 0 else get_open_tcp_port()) # OSC QUERY
-UPDATE_INTERVAL = 1 / float(config['UpdateRate'])
 AVATAR_PARAMETERS_PREFIX = "/avatar/parameters/"
+# not an OSC address, avatar parameters read by load_avatar_parameters() are passed to the frame loop with it
+AVATAR_SCHEMA_ADDRESS = "ObjectTracking:avatar-schema"
+# not an OSC address either, avatar changes seen by the OSCQuery subscription of VRChat's /avatar/change
+OSCQUERY_AVATAR_CHANGE_ADDRESS = "ObjectTracking:oscquery-avatar-change"
 TITLE = "ObjectTracking v0.1.18"
-
-set_title(TITLE)
-logger.info(f"IP: {IP} / {AV3EMULATOR_IP}")
-logger.info(f"Port: {PORT} / {AV3EMULATOR_PORT}")
-logger.info(f"Server Port: {SERVER_PORT}")
-logger.info(f"HTTP Port: {HTTP_PORT}")
-logger.info(f"Update Rate: {config['UpdateRate']}Hz / Update Interval: {UPDATE_INTERVAL * 1000:.2f}ms")
-
-# tracker config
-trackers = {}
-# osc recieved parameters
-parameters = {}
+# parameters (besides the per device ones) ObjectTracking listens to, by type
+ADVERTISED_PARAMETERS = {
+    "ObjectTracking/config/global": bool,
+    "ObjectTracking/config/index": int,
+    "ObjectTracking/config/value": float,
+    "ObjectTracking/isStabilized": bool,
+    "ObjectTracking/isLazyStabilized": bool,
+    "ObjectTracking/goStabilized": bool,
+    "ObjectTracking/isRemotePreview": bool,
+    "TrackingType": int,
+    "VelocityX": float,
+    "VelocityY": float,
+    "VelocityZ": float,
+}
+
+# osc recieved parameters and tracker config
+state = StateStore()
+tracker_encoder = TrackerEncoder()
+send_scheduler = SendScheduler()
 
 hmd_raw = None
 pill_raw = None
-tracking_references_raw = {}
-tracking_reference_vector = None
-try:
-    logger.info("Waiting for VRChat Client to start ...")
-    while not is_vrchat_running():  # TODO: check consistently for this
-        time.sleep(1)
-    logger.info(f"Waiting for OSCClient to connect to {IP}:{PORT} ...")
-    oscClient = udp_client.SimpleUDPClient(IP, PORT)
-    if AV3EMULATOR_PORT is not None:
-        oscClientUnity = udp_client.SimpleUDPClient(AV3EMULATOR_IP, AV3EMULATOR_PORT)
+tracking_reference_estimator = TrackingReferenceEstimator()
+frame_stages = StageTimer()
+metrics = Metrics()
+traffic = TrafficRecorder()
+last_traffic_dump = None
+TRAFFIC_DUMP_INTERVAL = 60
+TRAFFIC_DUMP_COUNT = 5
+vrchat_discovery = None
+oscQueryClient = None
+oscQueryService = None
+advertised_devices = set()
+config_requested_at = None
+CONFIG_REQUEST_INTERVAL = 1
+logger = logging.getLogger(__name__)
+
+if __name__ == "__main__":
+    # Argument Parser
+    parser = argparse.ArgumentParser(
+        description='ObjectTracking: OpenVR tracking data to VRChat via OSC.')
+    parser.add_argument('--av3e-ip', required=False, type=str, help="AV3Emulator IP.")
+    parser.add_argument('--av3e-port', required=False, type=str, help="AV3Emulator Port.")
+    parser.add_argument('--debug', required=False, action='store_true', help="Debug mode.")
+    parser.add_argument('--record', required=False, type=str, help="Record tracking data to file.")
+    parser.add_argument('--replay', required=False, type=str, help="Replay tracking data from file instead of SteamVR.")
+    parser.add_argument('--replay-fast', required=False, action='store_true', help="Replay as fast as possible instead of realtime.")
+    args = parser.parse_args()
+    logger = get_logger(args.debug)
+
+    if args.replay:
+        pose_source = PoseReplayer(args.replay, realtime=not args.replay_fast)
+        live_source = None
+        known_serials = pose_source.serials
+        logger.info(f"Replaying {len(pose_source)} frames from {args.replay}")
+    else:
+        application = openvr.init(openvr.VRApplication_Utility)
+        openvr.VRApplications().addApplicationManifest(get_absolute_path("app.vrmanifest"))
+        pose_source = live_source = OpenVRPoseSource(application)
+        known_serials = [device.serial for device in live_source.registry.devices.values()]
+    if args.record:
+        pose_source = PoseRecorder(pose_source, args.record)
+        logger.info(f"Recording to {args.record}")
+
+    # first start
+    if getattr(sys, 'frozen', False) and not os.path.isfile(get_absolute_data_path("config.json")):
+        try:
+            openvr.VRApplications().setApplicationAutoLaunch("Hackebein.ObjectTracking", True)
+        except Exception as e:
+            pass
+        with open(get_absolute_data_path("config.json"), 'w') as f:
+            json.dump({
+                "IP": "127.0.0.1",
+                "Port": 9000,
+                "Server_Port": 0,
+                "HTTP_Port": 0,
+                "UpdateRate": 90
+            }, f, indent=4)
+
+    if not args.replay:
+        openvr.VRInput().setActionManifestPath(get_absolute_data_path("config.json"))
+    config = json.load(open(get_absolute_data_path("config.json")))
+
+    IP = config["IP"]
+    # shouldn't that be read from zeroconf?
+    PORT = int(config["Port"])
+    AV3EMULATOR_IP = args.av3e_ip if args.av3e_ip else IP
+    AV3EMULATOR_PORT = int(args.av3e_port) if args.av3e_port else None
+    SERVER_PORT = int(config["Server_Port"] if config["Server_Port"] > 0 else get_open_udp_port()) # OSC QUERY SERVER
+    HTTP_PORT = int(config["HTTP_Port"] if config["HTTP_Port"] > 0 else get_open_tcp_port()) # OSC QUERY
+    UPDATE_INTERVAL = 1 / float(config['UpdateRate'])
+    OSC_BUNDLE = bool(config.get("OSC_Bundle", False))
+    OSC_MTU = int(config.get("OSC_MTU", 1472))
+    OSC_RECEIVER = str(config.get("OSC_Receiver", "threading"))
+    UPDATE_SPIN = float(config.get("UpdateSpin", 0)) / 1000
+    ADAPTIVE_UPDATE_RATE = bool(config.get("AdaptiveUpdateRate", False))
+    MIN_UPDATE_RATE = float(config.get("MinUpdateRate", 30))
+    REMOTE_PREVIEW_UPDATE_RATE = 10
+    TRAFFIC_RECORDER_SIZE = int(config.get("TrafficRecorderSize", 65536))
+    TRAFFIC_DUMP_ON_OVERRUN = bool(config.get("TrafficDumpOnOverrun", True))
+    AVATAR_SCHEMA = bool(config.get("AvatarSchema", True))
+    tracking_reference_estimator = TrackingReferenceEstimator(
+        str(config.get("TrackingReferenceMethod", "mean")),
+        float(config.get("TrackingReferenceThreshold", 0.01)),
+        float(config.get("TrackingReferenceAngleThreshold", 1)),
+        float(config.get("TrackingReferenceOutlierDistance", 0)),
+        bool(config.get("TrackingReferenceYaw", False)),
+    )
+    if TRAFFIC_RECORDER_SIZE != traffic.capacity:
+        traffic = TrafficRecorder(TRAFFIC_RECORDER_SIZE)
+    DEADBAND = [float(config.get("Deadband", {}).get(axis, 0)) for axis in AXES]
+    HYSTERESIS = float(config.get("Hysteresis", 0))
+    tracker_encoder.deadband = numpy.array(DEADBAND)
+    tracker_encoder.hysteresis = HYSTERESIS
+    tracker_encoder.invalidate()
+    send_scheduler.message_budget = SEND_BUDGET = float(config.get("SendBudget", 0))
+    send_scheduler.byte_budget = SEND_BYTE_BUDGET = float(config.get("SendByteBudget", 0))
+    send_scheduler.max_refresh_interval = MAX_REFRESH_INTERVAL = float(config.get("MaxRefreshInterval", 1))
+    PREDICTION = str(config.get("Prediction", "off"))
+    PREDICTION_TIME = config.get("PredictionTime", "auto")
+    PREDICTION_EXTRA_LATENCY = float(config.get("PredictionExtraLatency", 0)) / 1000
+    PREDICTION_TRACKER_TIME = {serial: float(ms) / 1000 for serial, ms in config.get("PredictionTrackerTime", {}).items()}
+    if PREDICTION == "openvr" and args.replay:
+        logger.info("SteamVR prediction isn't available for replays, extrapolating instead")
+        PREDICTION = "extrapolate"
+    predictor = PosePredictor(
+        PREDICTION,
+        None if PREDICTION_TIME == "auto" else float(PREDICTION_TIME) / 1000,
+        PREDICTION_EXTRA_LATENCY,
+        PREDICTION_TRACKER_TIME,
+    )
+
+    set_title(TITLE)
+    logger.info(f"IP: {IP} / {AV3EMULATOR_IP}")
+    logger.info(f"Port: {PORT} / {AV3EMULATOR_PORT}")
+    logger.info(f"Server Port: {SERVER_PORT}")
+    logger.info(f"HTTP Port: {HTTP_PORT}")
+    logger.info(f"Update Rate: {config['UpdateRate']}Hz / Update Interval: {UPDATE_INTERVAL * 1000:.2f}ms")
+    logger.info(f"Update Spin: {UPDATE_SPIN * 1000:.2f}ms / Adaptive Update Rate: {ADAPTIVE_UPDATE_RATE} (min. {MIN_UPDATE_RATE}Hz)")
+    logger.info(f"OSC Bundle: {OSC_BUNDLE} / MTU: {OSC_MTU} / Receiver: {OSC_RECEIVER}")
+    logger.info(f"Deadband: {dict(zip(AXES, DEADBAND))} / Hysteresis: {HYSTERESIS} steps")
+    logger.info(f"Send Budget: {SEND_BUDGET or 'unlimited'} messages/s / {SEND_BYTE_BUDGET or 'unlimited'} bytes/s / Max Refresh Interval: {MAX_REFRESH_INTERVAL}s")
+    logger.info(f"Prediction: {PREDICTION} / Prediction Time: {PREDICTION_TIME}{'' if PREDICTION_TIME == 'auto' else 'ms'} (+{PREDICTION_EXTRA_LATENCY * 1000:.1f}ms)")
+
+    try:
+        logger.info("Waiting for VRChat Client to start ...")
+        while not args.replay and not is_vrchat_running():  # TODO: check consistently for this
+            time.sleep(1)
+        logger.info(f"Waiting for OSCClient to connect to {IP}:{PORT} ...")
+        oscClient = BundledUDPClient(IP, PORT, OSC_BUNDLE, OSC_MTU)
+        if AV3EMULATOR_PORT is not None:
+            oscClientUnity = BundledUDPClient(AV3EMULATOR_IP, AV3EMULATOR_PORT, OSC_BUNDLE, OSC_MTU)
     
-    #logger.info("Waiting for OSCQueryClient to connect to VRChat Client ...")
-    #oscQueryClient = wait_get_oscquery_client()
+        if not args.replay:
+            # nothing waits for it, OSC works without OSCQuery
+            Thread(target=keep_oscquery_client, name="VRChatDiscovery", daemon=True).start()
     
-    logger.info("Waiting for OSCQueryServer to start ...")
-    oscQueryServer = wait_get_oscquery_server()
+        logger.info("Waiting for OSCQueryServer to start ...")
+        oscQueryServer = wait_get_oscquery_server()
+        # VRChat drops the config of devices that aren't advertised, devices showing up later are requested again
+        advertise_devices(known_serials)
     
-    logger.info("Sending test OSC message ...")
-    while get_parameter("ObjectTracking/config/global", True):
-        send_parameter("ObjectTracking/config/global", True)
-        time.sleep(1)
+        logger.info("Sending test OSC message ...")
+        while get_parameter("ObjectTracking/config/global", True):
+            send_parameter("ObjectTracking/config/global", True, force=True)
+            flush_parameters()
+            time.sleep(1)
+            apply_received_messages()
     
-    logger.info("Init complete!")
-
-    cycle_start_time = time.perf_counter()
-    while True:
-        target_time = UPDATE_INTERVAL
-        if get_parameter("ObjectTracking/isRemotePreview", False):
-            target_time = 1 / 10
-        wait_time = target_time - (time.perf_counter() - cycle_start_time)
-        if wait_time > 0:
-            if wait_time / target_time < 0.1:
-                logger.warning(f"Warning: about {wait_time / target_time * 100:.0f}% frame time left")
-            time.sleep(wait_time)
-        else:
-            logger.warning(f"Warning: {abs(wait_time * 1000):.2f}ms behind schedule, decreasing UpdateRate recommended if this gets spammed")
-        cycle_start_time = time.perf_counter()
-        try:
-            hmd = None
-            pill = None
-            tracking_objects_raw = {}
-            tracking_objects = {}
-            devices = application.getDeviceToAbsoluteTrackingPose(openvr.TrackingUniverseStanding, 0, openvr.k_unMaxTrackedDeviceCount)
-            for i in range(openvr.k_unMaxTrackedDeviceCount):
-                if not devices[i].bPoseIsValid:
-                    continue
-                serial_number = application.getStringTrackedDeviceProperty(i, openvr.Prop_SerialNumber_String)
-                if devices[i].eTrackingResult != openvr.TrackingResult_Running_OK:
-                    continue
-                if get_parameter("ObjectTracking/tracker/" + serial_number + "/enabled", True) == False:
-                    continue
-                
-                if application.getTrackedDeviceClass(i) == openvr.TrackedDeviceClass_TrackingReference:
-                    tracking_references_raw[serial_number] = convert_matrix34_to_matrix44(devices[i].mDeviceToAbsoluteTracking)
-                if application.getTrackedDeviceClass(i) == openvr.TrackedDeviceClass_HMD:
-                    hmd_raw = convert_matrix34_to_matrix44(devices[i].mDeviceToAbsoluteTracking)
-                tracking_objects_raw[serial_number] = convert_matrix34_to_matrix44(devices[i].mDeviceToAbsoluteTracking)
-            tracking_reference = compute_tracking_reference_position(tracking_references_raw)
-            if get_parameter("ObjectTracking/tracker/PlaySpace/enabled", True) and len(tracking_references_raw) > 0:
-                order = sorted(tracking_references_raw.keys())
-                tracking_objects_raw["PlaySpace"] = tracking_reference
-                tracking_objects_raw["PlaySpace"][1, 3] = 0
-                yaw = Rotation.from_matrix(tracking_objects_raw["PlaySpace"][0:3, 0:3]).as_euler("YXZ")[0]
-                tracking_objects_raw["PlaySpace"][0:3, 0:3] = Rotation.from_euler("YXZ", [yaw, 0, 0]).as_matrix()
-
-            # set y to zero
-            tracking_reference[1, 3] = 0
-            # set rotation to 0
-            tracking_reference[0:3, 0:3] = numpy.eye(3)
-
-            if hmd_raw is not None:
-                #hmd = relative_matrix(tracking_reference, hmd_raw)
-                if not get_parameter("ObjectTracking/isStabilized", False) and not get_parameter("ObjectTracking/isLazyStabilized", False):
-                    old_pill_raw = pill_raw
-                    pill_raw = hmd_raw
-                    pill_raw[1, 3] = 0
-                    yaw = Rotation.from_matrix(pill_raw[0:3, 0:3]).as_euler("YXZ")[0]
-                    # TODO: -yaw, otherwise it's inverted z axis for some reason
-                    pill_raw[0:3, 0:3] = Rotation.from_euler("YXZ", [-yaw, 0, 0]).as_matrix()
-                    if get_parameter("TrackingType", 0) > 3 and get_parameter("VelocityX", 0) == 0 and get_parameter("VelocityY", 0) == 0 and get_parameter("VelocityZ", 0) == 0:
-                        if old_pill_raw is not None:
-                            pill_raw[0:3, 0:3] = old_pill_raw[0:3, 0:3]
-                if pill_raw is not None:
-                    pill = relative_matrix(tracking_reference, pill_raw)
-            
-            for key, object_raw in tracking_objects_raw.items():
-                tracking_objects[key] = relative_matrix(tracking_reference, object_raw)
-                        
-            if pill is not None:
-                for key, tracker in trackers.items():
-                    if key == "global":
-                        continue
-                    if key in tracking_objects:
-                        pos = relative_matrix(pill, tracking_objects[key])
-                        pos = rotate_matrix_xz(pos, pill)
-                        send_position(key, pos, tracker)
-                    else:
-                        send_default_position(key, tracker)
-        except Exception as e:
-            logger.info(f"Error: {e}")
-            logger.info(traceback.format_exc())
+        logger.info("Init complete!")
+
+        scheduler = FrameScheduler(1 / UPDATE_INTERVAL, UPDATE_SPIN, adaptive=ADAPTIVE_UPDATE_RATE, min_rate=MIN_UPDATE_RATE)
+        scheduler.paced = not args.replay_fast
+        while True:
+            overrun = scheduler.wait()
+            if overrun and TRAFFIC_DUMP_ON_OVERRUN:
+                dump_traffic("overrun")
+            frame_stages.start()
+            try:
+                apply_received_messages()
+                send_config_request()
+                frame_stages.mark("receive")
+                if get_parameter("ObjectTracking/isRemotePreview", False):
+                    scheduler.rate_limit = REMOTE_PREVIEW_UPDATE_RATE
+                else:
+                    scheduler.rate_limit = None
+                predicted_seconds = 0.0
+                if PREDICTION == "openvr":
+                    predicted_seconds = live_source.predicted_seconds = predictor.horizon
+                frame = pose_source.get_frame()
+                if advertise_devices(device.serial for device in frame.devices):
+                    request_config()
+                frame_stages.mark("acquisition")
+                frame = predictor.predict(frame, predicted_seconds)
+                frame_stages.mark("prediction")
+                process_frame(frame)
+            except EOFError as e:
+                logger.info(f"{e}")
+                break
+            except Exception as e:
+                logger.info("Error: %s", e, extra={"rate_limit": True})
+                logger.info(traceback.format_exc(), extra={"rate_limit": True})
+                dump_traffic("error")
+            flush_parameters()
+            frame_stages.mark("flush")
+            metrics.record_frame(frame_stages.stages, overrun)
+            # from reading the poses (acquisition) to the flush, received messages are applied before
+            predictor.record_latency(sum(frame_stages.stages.values()) - frame_stages.stages.get("receive", 0.0))
+            metrics.latency_seconds = predictor.latency
+            metrics.prediction_seconds = predictor.horizon
+            if live_source is not None:
+                metrics.openvr_calls = live_source.registry.ipc_calls
+            metrics.tick()
+            scheduler.frame_done()
     
-except zeroconf._exceptions.NonUniqueNameException as e:
-    logger.info("NonUniqueNameException, trying again...")
-    os.execv(sys.executable, ['python'] + sys.argv)
-except KeyboardInterrupt:
-    pass
-except Exception:
-    logger.info("UNEXPECTED ERROR\n")
-    logger.info("Please Create an Issue on GitHub with the following information:\n")
-    logger.info(TITLE)
-    logger.info("Config:", config)
-    logger.info("Trackers:", trackers)
-    logger.info("Parameters:", parameters)
-    logger.info("Reference:", tracking_reference)
-    logger.info("Traceback:")
-    logger.info(traceback.format_exc())
-
-try:
-    openvr.shutdown()
-except Exception as e:
-    logger.info("Error shutting down OVR: " + str(e))
-
-if 'oscQueryServer' in globals():
-    oscQueryServer.shutdown()
-sys.exit()
\ No newline at end of file
+    except zeroconf._exceptions.NonUniqueNameException as e:
+        logger.info("NonUniqueNameException, trying again...")
+        log_listener.stop()
+        os.execv(sys.executable, ['python'] + sys.argv)
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        logger.info("UNEXPECTED ERROR\n")
+        logger.info("Please Create an Issue on GitHub with the following information:\n")
+        logger.info(TITLE)
+        logger.info("Config: %s", config)
+        logger.info("Trackers: %s", state.trackers)
+        logger.info("Parameters: %s", state.parameters)
+        logger.info("Reference: %s", tracking_reference)
+        logger.info("Traceback:")
+        logger.info(traceback.format_exc())
+        last_traffic_dump = None
+        dump_traffic("crash", background=False)
+
+    try:
+        pose_source.close()
+        openvr.shutdown()
+    except Exception as e:
+        logger.info("Error shutting down OVR: " + str(e))
+
+    if 'oscQueryServer' in globals():
+        oscQueryServer.shutdown()
+    sys.exit()
\ No newline at end of file
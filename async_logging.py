@@ -0,0 +1,85 @@
+import atexit
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Queues log records without formatting them, formatting and writing happens on the listener thread.
+
+    Arguments of records are formatted later, so they must not be changed after logging them.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            # tracebacks have to be rendered while they still exist
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets every message (by logger, level and unformatted message) pass at most once per interval,
+    the number of dropped repetitions is appended to the next message that passes.
+    Only warnings and errors are limited, other records opt in with extra={"rate_limit": True}.
+    At most max_keys messages are remembered, expired ones are forgotten first.
+    """
+
+    def __init__(self, interval: float = 10.0, max_keys: int = 1024) -> None:
+        super().__init__()
+        self.interval = interval
+        self.max_keys = max_keys
+        self._last = {}
+
+    def _prune(self, now: float) -> None:
+        self._last = {key: value for key, value in self._last.items() if now - value[0] < self.interval}
+        while len(self._last) >= self.max_keys:
+            # dicts keep insertion order, drop the oldest
+            del self._last[next(iter(self._last))]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING and not getattr(record, "rate_limit", False):
+            return True
+        # messages can be any object, e.g. a dict
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        last, dropped = self._last.get(key, (None, 0))
+        if last is not None and now - last < self.interval:
+            self._last[key] = (last, dropped + 1)
+            return False
+        if key not in self._last and len(self._last) >= self.max_keys:
+            self._prune(now)
+        self._last[key] = (now, 0)
+        if dropped:
+            record.msg = f"{record.msg} ({dropped} repetitions suppressed)"
+        return True
+
+
+def setup_logging(level: int, handlers: list, fmt: str, rate_limit: float = 10.0) -> QueueListener:
+    """
+    Configures the root logger to pass records through a queue to the given handlers on a background thread.
+    Parameters:
+        level (int): Log level
+        handlers (list): Handlers writing the records, e.g. file and console
+        fmt (str): Log format
+        rate_limit (float): Seconds between repetitions of the same message, 0 to disable
+    Returns:
+        QueueListener: Running listener, stopped (and flushed) on exit
+    """
+    formatter = logging.Formatter(fmt)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    if rate_limit > 0:
+        queue_handler.addFilter(RateLimitFilter(rate_limit))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers = [queue_handler]
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
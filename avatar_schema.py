@@ -0,0 +1,118 @@
+import glob
+import json
+import logging
+import os
+from tinyoscquery.shared.node import OSCQueryNode
+
+AVATAR_PARAMETERS_PREFIX = "/avatar/parameters/"
+TYPES = {"Float": float, "Int": int, "Bool": bool}
+# ObjectTracking/config/... parameters that don't select a device
+CONFIG_PARAMETERS = ("global", "index", "value", "device")
+
+logger = logging.getLogger(__name__)
+
+
+def get_osc_config_path() -> str:
+    """
+    Returns the folder VRChat writes the OSC config of avatars to.
+    Returns:
+        str: %USERPROFILE%/AppData/LocalLow/VRChat/VRChat/OSC
+    """
+    local_app_data = os.getenv("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), "AppData", "Local")
+    return os.path.join(os.path.dirname(local_app_data), "LocalLow", "VRChat", "VRChat", "OSC")
+
+
+def find_avatar_config(avatar_id: str, osc_path: str = None) -> str | None:
+    """
+    Finds the OSC config of an avatar, the most recently written one if several VRChat users have one.
+    Parameters:
+        avatar_id (str): Avatar id, e.g. avtr_...
+        osc_path (str): OSC config folder of VRChat, see get_osc_config_path()
+    Returns:
+        str | None: Path of the OSC config or None if there is none
+    """
+    paths = glob.glob(os.path.join(glob.escape(osc_path or get_osc_config_path()), "usr_*", "Avatars", glob.escape(avatar_id) + ".json"))
+    if not paths:
+        return None
+    return max(paths, key=os.path.getmtime)
+
+
+def parameters_from_config(config: dict) -> dict:
+    """
+    Reads the parameters that accept input from an avatar OSC config.
+    Parameters:
+        config (dict): OSC config as written by VRChat
+    Returns:
+        dict: Parameter name (without /avatar/parameters/) -> type
+    """
+    parameters = {}
+    for parameter in config.get("parameters", []):
+        parameter_input = parameter.get("input")
+        if not parameter_input or not parameter_input.get("address", "").startswith(AVATAR_PARAMETERS_PREFIX):
+            continue
+        parameters[parameter_input["address"].removeprefix(AVATAR_PARAMETERS_PREFIX)] = TYPES.get(parameter_input.get("type"))
+    return parameters
+
+
+def parameters_from_oscquery(node: OSCQueryNode) -> dict:
+    """
+    Reads the parameters from the /avatar/parameters node of VRChat's OSCQuery tree.
+    Parameters:
+        node (OSCQueryNode): /avatar/parameters node
+    Returns:
+        dict: Parameter name (without /avatar/parameters/) -> type
+    """
+    parameters = {}
+    for subNode in node:
+        if subNode.full_path is None or not subNode.full_path.startswith(AVATAR_PARAMETERS_PREFIX) or not subNode.type_:
+            continue
+        parameters[subNode.full_path.removeprefix(AVATAR_PARAMETERS_PREFIX)] = subNode.type_[0]
+    return parameters
+
+
+def device_serials(parameters: dict) -> list:
+    """
+    Finds the devices an avatar has a config or enabled parameter for.
+    Parameters:
+        parameters (dict): Parameter name (without /avatar/parameters/) -> type
+    Returns:
+        list: Serial numbers of the devices
+    """
+    serials = []
+    for parameter in parameters:
+        if parameter.startswith("ObjectTracking/config/"):
+            serial = parameter.removeprefix("ObjectTracking/config/")
+            if serial in CONFIG_PARAMETERS or "/" in serial:
+                continue
+        elif parameter.startswith("ObjectTracking/tracker/") and parameter.endswith("/enabled"):
+            serial = parameter.removeprefix("ObjectTracking/tracker/").removesuffix("/enabled")
+        else:
+            continue
+        if serial and serial not in serials:
+            serials.append(serial)
+    return serials
+
+
+def load_avatar_schema(avatar_id: str, oscquery_client=None, osc_path: str = None) -> tuple[dict | None, str]:
+    """
+    Reads the parameters of an avatar from its OSC config or, if there is none, from VRChat's OSCQuery tree.
+    Parameters:
+        avatar_id (str): Avatar id
+        oscquery_client (OSCQueryClient): Client of VRChat's OSCQuery service, optional
+        osc_path (str): OSC config folder of VRChat, see get_osc_config_path()
+    Returns:
+        tuple[dict | None, str]: Parameter name -> type (None if unknown) and the source
+    """
+    path = find_avatar_config(avatar_id, osc_path)
+    if path is not None:
+        try:
+            # VRChat writes the config with a byte order mark
+            with open(path, "r", encoding="utf-8-sig") as f:
+                return parameters_from_config(json.load(f)), path
+        except (OSError, ValueError) as e:
+            logger.info(f"Error reading avatar config {path}: {e}")
+    if oscquery_client is not None:
+        node = oscquery_client.query_node(AVATAR_PARAMETERS_PREFIX.rstrip("/"))
+        if node is not None:
+            return parameters_from_oscquery(node), "OSCQuery"
+    return None, "none"
@@ -0,0 +1,360 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import socket
+import sys
+import time
+import tracemalloc
+from threading import Event, Thread
+import numpy
+import openvr
+from pythonosc import dispatcher
+from pythonosc.osc_message_builder import OscMessageBuilder
+import ObjectTracking
+from device_registry import TrackedDevice
+from osc_client import BundledUDPClient
+from pose_math import yaw_rotation
+from frame_scheduler import FrameScheduler
+from osc_receiver import create_osc_server
+from send_scheduler import SendScheduler
+from state_store import StateStore
+from pose_source import POSE_DTYPE, FLAGS_OK, PoseFrame, PoseReplayer, PoseSource
+from tracker_encoder import TrackerEncoder
+from tracking_reference import TrackingReferenceEstimator
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_golden.json")
+
+
+class CaptureClient(BundledUDPClient):
+    """
+    Hashes and counts all outgoing datagrams instead of sending them.
+    """
+
+    def __init__(self) -> None:
+        super().__init__("127.0.0.1", 9)
+        self.hash = hashlib.sha256()
+        self.bytes_sent = 0
+
+    def _send_dgram(self, dgram: bytes) -> None:
+        self.hash.update(dgram)
+        self.bytes_sent += len(dgram)
+        self.datagrams_sent += 1
+
+
+class SyntheticPoseSource(PoseSource):
+    """
+    Deterministic poses of a HMD, 2 base stations and the given number of moving trackers.
+    """
+
+    def __init__(self, tracker_count: int) -> None:
+        self.frame = 0
+        self.devices = [TrackedDevice(0, "HMD", openvr.TrackedDeviceClass_HMD)]
+        self.devices += [TrackedDevice(1 + i, f"LHB-{i}", openvr.TrackedDeviceClass_TrackingReference) for i in range(2)]
+        self.devices += [TrackedDevice(3 + i, f"TRACKER-{i}", openvr.TrackedDeviceClass_GenericTracker) for i in range(tracker_count)]
+        self.phase = numpy.linspace(0, numpy.pi, len(self.devices))
+
+    def get_frame(self) -> PoseFrame:
+        t = self.frame / 90
+        self.frame += 1
+        angle = numpy.sin(t + self.phase)
+        c = numpy.cos(angle)
+        s = numpy.sin(angle)
+        pitch = numpy.zeros((len(self.devices), 3, 3))
+        pitch[:, 0, 0] = 1
+        pitch[:, 1, 1] = c
+        pitch[:, 1, 2] = -s
+        pitch[:, 2, 1] = s
+        pitch[:, 2, 2] = c
+        poses = numpy.zeros(len(self.devices), dtype=POSE_DTYPE)
+        poses["flags"] = FLAGS_OK
+        poses["matrix"][:, :, 0:3] = yaw_rotation(2 * angle + self.phase) @ pitch
+        poses["matrix"][:, :, 3] = numpy.stack([numpy.cos(t + self.phase), 1 + 0.5 * angle, numpy.sin(2 * t + self.phase)], axis=-1)
+        # base stations don't move
+        poses["matrix"][1:3] = [[[1, 0, 0, -2], [0, 1, 0, 2], [0, 0, 1, -2]], [[1, 0, 0, 2], [0, 1, 0, 2], [0, 0, 1, 2]]]
+        return PoseFrame(t, self.devices, poses)
+
+
+def tracker_config(bits: int) -> dict:
+    """
+    Builds a tracker config with the given accuracy for all axes, position range -2m - 2m, rotation range -180° - 180°.
+    Parameters:
+        bits (int): Accuracy in bits
+    Returns:
+        dict: Tracker config by config index
+    """
+    config = {}
+    for offset, limit in enumerate([2, 2, 2, 180, 180, 180]):
+        config[1 + offset] = bits
+        config[7 + offset] = config[13 + offset] = -limit
+        config[19 + offset] = config[25 + offset] = limit
+    return config
+
+
+def reset(tracker_names: list, bits: int) -> CaptureClient:
+    """
+    Resets the state of ObjectTracking and configures the given trackers.
+    Returns:
+        CaptureClient: New OSC client of ObjectTracking
+    """
+    ObjectTracking.state = StateStore()
+    ObjectTracking.state.trackers = {name: tracker_config(bits) for name in tracker_names}
+    ObjectTracking.tracker_encoder = TrackerEncoder()
+    ObjectTracking.send_scheduler = SendScheduler()
+    ObjectTracking.hmd_raw = None
+    ObjectTracking.pill_raw = None
+    ObjectTracking.tracking_reference_estimator = TrackingReferenceEstimator()
+    ObjectTracking.oscClient = CaptureClient()
+    return ObjectTracking.oscClient
+
+
+def run(source: PoseSource, tracker_names: list, bits: int, frames: int, allocations: bool) -> dict:
+    """
+    Runs the frame pipeline of ObjectTracking with fresh state.
+    Returns:
+        dict: stage timings, message statistics, output hash
+    """
+    client = reset(tracker_names, bits)
+    stages = ObjectTracking.frame_stages
+
+    timings = {}
+    peaks = []
+    if allocations:
+        tracemalloc.start()
+    for _ in range(frames):
+        if allocations:
+            tracemalloc.reset_peak()
+        stages.start()
+        frame = source.get_frame()
+        stages.mark("acquisition")
+        ObjectTracking.process_frame(frame)
+        ObjectTracking.flush_parameters()
+        stages.mark("flush")
+        if allocations:
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        for stage, duration in stages.stages.items():
+            timings.setdefault(stage, []).append(duration)
+    if allocations:
+        tracemalloc.stop()
+
+    timings["total"] = [sum(durations) for durations in zip(*timings.values())]
+    return {
+        "timings": timings,
+        "peaks": peaks,
+        "messages": client.messages_sent / frames,
+        "bytes": client.bytes_sent / frames,
+        "hash": client.hash.hexdigest(),
+    }
+
+
+def receive_datagrams(unrelated: int) -> list:
+    """
+    Builds datagrams like VRChat sends them: ObjectTracking and tracking parameters among many unrelated avatar parameters.
+    Parameters:
+        unrelated (int): Number of unrelated avatar parameters
+    Returns:
+        list: OSC datagrams
+    """
+    messages = [(f"/avatar/parameters/Parameter{i}", [0.5, 1, True][i % 3]) for i in range(unrelated)]
+    messages += [(ObjectTracking.AVATAR_PARAMETERS_PREFIX + parameter, value) for parameter, value in [
+        ("ObjectTracking/isStabilized", False),
+        ("ObjectTracking/isRemotePreview", False),
+        ("ObjectTracking/tracker/PlaySpace/enabled", True),
+        ("ObjectTracking/config/global", False),
+        ("TrackingType", 3),
+        ("VelocityX", 0.0),
+        ("VelocityY", 0.0),
+        ("VelocityZ", 0.0),
+    ]]
+    datagrams = []
+    for address, value in messages:
+        builder = OscMessageBuilder(address)
+        builder.add_arg(value)
+        datagrams.append(builder.build().dgram)
+    return datagrams
+
+
+def legacy_message_handler(addr, value) -> None:
+    # catch-all handler applying every message on the receiving thread, as osc_message_handler did before OSCRouter
+    parameter = addr.removeprefix(ObjectTracking.AVATAR_PARAMETERS_PREFIX)
+    if parameter.startswith("ObjectTracking/"):
+        ObjectTracking.logger.debug(f" ><  {addr}: {value} ({type(value)})")
+    if addr == "/avatar/change":
+        ObjectTracking.on_avatar_change(addr, value)
+    ObjectTracking.set_parameter(parameter, value)
+    trackers = ObjectTracking.state.trackers
+    if parameter == "ObjectTracking/config/index" and value == 0:
+        ObjectTracking.update_player_height()
+        ObjectTracking.logger.info(trackers)
+    if parameter == "ObjectTracking/config/index" and value != 0:
+        device = ObjectTracking.get_parameter("ObjectTracking/config/device", 0)
+        index = value
+        new = ObjectTracking.get_parameter("ObjectTracking/config/value", 0)
+        old = None
+        if trackers.get(device, None) is None:
+            trackers[device] = {}
+        if trackers[device].get(index, None) is not None:
+            old = trackers[device][index]
+        if old != new:
+            ObjectTracking.logger.info(f"{device}[{index}] {old} => {new}")
+        trackers[device][index] = new
+    if re.match(r"ObjectTracking/config/(?!index|value)", parameter) and value > 0:
+        ObjectTracking.set_parameter("ObjectTracking/config/device", parameter.removeprefix("ObjectTracking/config/"))
+    if parameter == "ObjectTracking/isStabilized" and value:
+        ObjectTracking.oscClient.send_message("/input/Vertical", 0.0)
+    if parameter == "ObjectTracking/goStabilized" and not ObjectTracking.get_parameter("ObjectTracking/isStabilized", False) and value:
+        ObjectTracking.oscClient.send_message("/input/Vertical", 1.0)
+
+
+def run_receive(disp: dispatcher.Dispatcher, datagrams: list, seconds: float) -> float:
+    """
+    Feeds datagrams through a dispatcher and applies them like the frame loop does.
+    Returns:
+        float: Messages per second
+    """
+    ObjectTracking.state = StateStore()
+    ObjectTracking.oscClient = CaptureClient()
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for datagram in datagrams:
+            disp.call_handlers_for_packet(datagram, ("127.0.0.1", 9000))
+        ObjectTracking.apply_received_messages()
+        count += len(datagrams)
+    return count / (time.perf_counter() - start)
+
+
+def run_jitter(receiver: str, rate: float, seconds: float) -> dict:
+    """
+    Runs the paced frame loop (16 trackers, 90Hz) while avatar parameters are sent to an OSC server.
+    Parameters:
+        receiver (str): OSC_Receiver mode of the server
+        rate (float): Sent messages per second
+        seconds (float): Duration
+    Returns:
+        dict: deviation of the frame start intervals from the update interval, frame work times, received messages
+    """
+    reset([f"TRACKER-{i}" for i in range(16)], 16)
+    received = ObjectTracking.metrics.received_messages
+    server = create_osc_server(receiver, ("127.0.0.1", 0), ObjectTracking.create_osc_router())
+    Thread(target=server.serve_forever, daemon=True).start()
+    stop = Event()
+
+    def send() -> None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        datagrams = receive_datagrams(100)
+        # send in chunks of 10 like VRChat's parameter bursts
+        interval = 10 / rate
+        deadline = time.perf_counter()
+        i = 0
+        while not stop.is_set():
+            for _ in range(10):
+                sock.sendto(datagrams[i % len(datagrams)], server.server_address)
+                i += 1
+            deadline += interval
+            time.sleep(max(0.0, deadline - time.perf_counter()))
+        sock.close()
+
+    if rate > 0:
+        Thread(target=send, daemon=True).start()
+    source = SyntheticPoseSource(16)
+    scheduler = FrameScheduler(90)
+    starts = []
+    work = []
+    for _ in range(int(seconds * 90)):
+        scheduler.wait()
+        start = time.perf_counter()
+        starts.append(start)
+        ObjectTracking.apply_received_messages()
+        ObjectTracking.process_frame(source.get_frame())
+        ObjectTracking.flush_parameters()
+        work.append(time.perf_counter() - start)
+    stop.set()
+    server.shutdown()
+    server.server_close()
+    return {
+        "jitter": numpy.abs(numpy.diff(starts) - scheduler.interval),
+        "work": numpy.array(work),
+        "received": (ObjectTracking.metrics.received_messages - received) / seconds,
+    }
+
+
+def print_result(name: str, result: dict) -> None:
+    print(f"{name}: {result['messages']:.0f} messages / {result['bytes']:.0f} bytes per frame"
+          + (f", peak allocation {numpy.median(result['peaks']) / 1024:.1f}KiB per frame" if result["peaks"] else ""))
+    print(f"  {'stage':<12} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for stage, durations in result["timings"].items():
+        p50, p90, p99, maximum = numpy.percentile(durations, [50, 90, 99, 100]) * 1e6
+        print(f"  {stage:<12} {p50:>7.1f}us {p90:>7.1f}us {p99:>7.1f}us {maximum:>7.1f}us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark of the ObjectTracking frame pipeline.')
+    parser.add_argument('--trackers', type=int, nargs='+', default=[1, 4, 16, 64], help="Tracker counts (synthetic poses only).")
+    parser.add_argument('--bits', type=int, nargs='+', default=[8, 16, 24], help="Accuracies in bits.")
+    parser.add_argument('--frames', type=int, default=900, help="Frames per run.")
+    parser.add_argument('--replay', type=str, help="Use poses of a recording instead of synthetic poses.")
+    parser.add_argument('--allocations', action='store_true', help="Measure allocations (slows down timings).")
+    parser.add_argument('--golden', type=str, default=GOLDEN_PATH, help="Golden output hashes.")
+    parser.add_argument('--update-golden', action='store_true', help="Store output hashes as new golden output.")
+    parser.add_argument('--receive', action='store_true', help="Benchmark receiving OSC messages instead of the frame pipeline.")
+    parser.add_argument('--receive-jitter', type=float, nargs='+', metavar='RATE', help="Measure frame timing while receiving OSC messages at the given rates (messages/s).")
+    args = parser.parse_args()
+
+    if args.receive_jitter:
+        print(f"  {'receiver':<10} {'rate':>7} {'received':>9} {'jitter p50':>11} {'p99':>9} {'max':>9} {'work p50':>9} {'p99':>9}")
+        for rate in args.receive_jitter:
+            for receiver in ["threading", "batched"]:
+                result = run_jitter(receiver, rate, 10.0)
+                jitter_p50, jitter_p99, jitter_max = numpy.percentile(result["jitter"], [50, 99, 100]) * 1e6
+                work_p50, work_p99 = numpy.percentile(result["work"], [50, 99]) * 1e6
+                print(f"  {receiver:<10} {rate:>7.0f} {result['received']:>7.0f}/s {jitter_p50:>9.1f}us {jitter_p99:>7.1f}us {jitter_max:>7.1f}us {work_p50:>7.1f}us {work_p99:>7.1f}us")
+        sys.exit(0)
+
+    if args.receive:
+        for unrelated in [0, 100, 500]:
+            datagrams = receive_datagrams(unrelated)
+            catch_all = dispatcher.Dispatcher()
+            catch_all.set_default_handler(legacy_message_handler)
+            before = run_receive(catch_all, datagrams, 2.0)
+            before_parameters = len(ObjectTracking.state.parameters)
+            after = run_receive(ObjectTracking.create_osc_router(), datagrams, 2.0)
+            print(f"{len(datagrams)} messages ({unrelated} unrelated): catch-all handler {before:,.0f} msgs/s ({before_parameters} parameters cached), router {after:,.0f} msgs/s ({after / before:.1f}x, {len(ObjectTracking.state.parameters)} parameters cached)")
+        sys.exit(0)
+
+    golden = {}
+    if os.path.isfile(args.golden):
+        with open(args.golden) as f:
+            golden = json.load(f)
+
+    mismatches = []
+    runs = []
+    if args.replay:
+        replayer = PoseReplayer(args.replay, realtime=False)
+        names = sorted({device.serial for i in range(len(replayer)) for device in replayer.get_frame().devices
+                        if device.device_class in (openvr.TrackedDeviceClass_GenericTracker, openvr.TrackedDeviceClass_Controller)})
+        replayer.close()
+        for bits in args.bits:
+            runs.append((f"{os.path.basename(args.replay)} bits={bits}", lambda: PoseReplayer(args.replay, realtime=False, loop=True), names, bits))
+    else:
+        for tracker_count in args.trackers:
+            names = [f"TRACKER-{i}" for i in range(tracker_count)]
+            for bits in args.bits:
+                runs.append((f"trackers={tracker_count} bits={bits}", lambda tracker_count=tracker_count: SyntheticPoseSource(tracker_count), names, bits))
+
+    for name, create_source, names, bits in runs:
+        result = run(create_source(), names, bits, args.frames, args.allocations)
+        print_result(name, result)
+        key = f"{name} frames={args.frames}"
+        if args.update_golden:
+            golden[key] = result["hash"]
+        elif key in golden and golden[key] != result["hash"]:
+            print(f"  OUTPUT CHANGED: {result['hash']} != {golden[key]}")
+            mismatches.append(key)
+
+    if args.update_golden:
+        with open(args.golden, "w") as f:
+            json.dump(golden, f, indent=4)
+    if mismatches:
+        sys.exit(1)
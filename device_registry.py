@@ -0,0 +1,91 @@
+import logging
+import openvr
+
+logger = logging.getLogger(__name__)
+
+
+class TrackedDevice(object):
+    def __init__(self, index: int, serial: str, device_class: int) -> None:
+        self.index = index
+        self.serial = serial
+        self.device_class = device_class
+        self.enabled_parameter = f"ObjectTracking/tracker/{serial}/enabled"
+
+    def __str__(self) -> str:
+        return f"<TrackedDevice #{self.index} {self.serial} (class {self.device_class})>"
+
+
+class DeviceRegistry(object):
+    """
+    Caches serial number and device class of all active OpenVR devices.
+
+    The cache is filled once on creation and afterwards only updated from
+    TrackedDeviceActivated/Deactivated/Updated events, see poll_events().
+    """
+
+    def __init__(self, system) -> None:
+        self.system = system
+        self.devices = {}
+        # number of calls into SteamVR (each one is an IPC round trip)
+        self.ipc_calls = 0
+        self._event = openvr.VREvent_t()
+        for index in range(openvr.k_unMaxTrackedDeviceCount):
+            self.update_device(index)
+
+    def update_device(self, index: int) -> None:
+        """
+        Reads serial number and device class of a device.
+        Parameters:
+            index (int): OpenVR device index
+        Returns:
+            None
+        """
+        self.ipc_calls += 1
+        device_class = self.system.getTrackedDeviceClass(index)
+        if device_class == openvr.TrackedDeviceClass_Invalid:
+            self.remove_device(index)
+            return
+        try:
+            # size query and read
+            self.ipc_calls += 2
+            serial = self.system.getStringTrackedDeviceProperty(index, openvr.Prop_SerialNumber_String)
+        except openvr.error_code.TrackedPropertyError:
+            self.remove_device(index)
+            return
+        previous = self.devices.get(index)
+        if previous is not None and previous.serial == serial and previous.device_class == device_class:
+            # TrackedDeviceUpdated is sent for all kinds of property changes, e.g. the battery level
+            return
+        device = TrackedDevice(index, serial, device_class)
+        logger.info(f"Device activated: {device}")
+        self.devices[index] = device
+
+    def remove_device(self, index: int) -> None:
+        """
+        Removes a device from the cache.
+        Parameters:
+            index (int): OpenVR device index
+        Returns:
+            None
+        """
+        device = self.devices.pop(index, None)
+        if device is not None:
+            logger.info(f"Device deactivated: {device}")
+
+    def poll_events(self) -> None:
+        """
+        Processes all pending OpenVR events and updates the cache.
+        Returns:
+            None
+        """
+        while True:
+            self.ipc_calls += 1
+            if not self.system.pollNextEvent(self._event):
+                return
+            index = self._event.trackedDeviceIndex
+            if index >= openvr.k_unMaxTrackedDeviceCount:
+                continue
+            if self._event.eventType in (openvr.VREvent_TrackedDeviceActivated, openvr.VREvent_TrackedDeviceUpdated):
+                self.update_device(index)
+            elif self._event.eventType == openvr.VREvent_TrackedDeviceDeactivated:
+                self.remove_device(index)
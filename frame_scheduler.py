@@ -0,0 +1,151 @@
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class FrameScheduler(object):
+    """
+    Paces the frame loop on absolute deadlines, so sleep inaccuracy doesn't add up to drift.
+
+    Attributes
+    ----------
+    rate : float
+        Configured update rate in Hz
+    spin : float
+        Seconds before each deadline that are busy-waited instead of slept
+    max_catch_up : float
+        Frames that may run back to back to catch up after an overrun, beyond that missed frames are skipped
+    adaptive : bool
+        Lower the update rate under sustained overload and raise it again when there is headroom
+    min_rate : float
+        Lowest update rate used by the adaptive mode
+    rate_limit : float | None
+        Temporary upper limit of the update rate
+    paced : bool
+        Run frames as fast as possible if False
+    """
+
+    # adaptive mode: load (work time / frame interval) thresholds and how long they have to hold
+    OVERLOAD = 0.9
+    UNDERLOAD = 0.5
+    OVERLOAD_SECONDS = 2.0
+    UNDERLOAD_SECONDS = 5.0
+    REPORT_INTERVAL = 10.0
+
+    def __init__(self, rate: float, spin: float = 0.0, max_catch_up: float = 1.0, adaptive: bool = False, min_rate: float = 30.0) -> None:
+        self.rate = float(rate)
+        self.spin = spin
+        self.max_catch_up = max_catch_up
+        self.adaptive = adaptive
+        self.min_rate = min(float(min_rate), self.rate)
+        self.rate_limit = None
+        self.paced = True
+        self.current_rate = self.rate
+        self.load = 0.0
+        self.achieved_rate = 0.0
+        self._next_deadline = None
+        self._frame_start = None
+        self._load_since = None
+        self._reset_stats(time.perf_counter())
+
+    @property
+    def interval(self) -> float:
+        if self.rate_limit is not None:
+            return 1 / min(self.current_rate, self.rate_limit)
+        return 1 / self.current_rate
+
+    def wait(self) -> bool:
+        """
+        Waits for the next frame deadline.
+        Returns:
+            bool: True if the frame started late (overrun)
+        """
+        interval = self.interval
+        now = time.perf_counter()
+        if self._next_deadline is None:
+            self._next_deadline = now
+        elif self._frame_start is not None:
+            # the rate might have been raised since the deadline got scheduled
+            self._next_deadline = min(self._next_deadline, self._frame_start + interval)
+        overrun = False
+        remaining = self._next_deadline - now
+        if not self.paced:
+            pass
+        elif remaining > 0:
+            if remaining > self.spin:
+                time.sleep(remaining - self.spin)
+            while time.perf_counter() < self._next_deadline:
+                pass
+        elif -remaining > interval * 0.1:
+            overrun = True
+            self._overruns += 1
+            self._max_lateness = max(self._max_lateness, -remaining)
+            if -remaining > interval * self.max_catch_up:
+                # too far behind, skip the missed frames instead of running them back to back
+                skipped = math.floor(-remaining / interval)
+                self._skipped += skipped
+                self._next_deadline += skipped * interval
+
+        self._frame_start = time.perf_counter()
+        self._next_deadline += interval
+        self._frames += 1
+        self._report(self._frame_start)
+        return overrun
+
+    def frame_done(self) -> None:
+        """
+        Marks the end of the work of a frame, used for the adaptive update rate.
+        Returns:
+            None
+        """
+        now = time.perf_counter()
+        interval = self.interval
+        load = (now - self._frame_start) / interval
+        # exponential moving average over roughly one second
+        alpha = min(1.0, interval)
+        self.load += (load - self.load) * alpha
+        if not self.adaptive or not self.paced:
+            return
+
+        if self.load > self.OVERLOAD and self.current_rate > self.min_rate:
+            state = "overload"
+        elif self.load < self.UNDERLOAD and self.current_rate < self.rate:
+            state = "underload"
+        else:
+            self._load_since = None
+            return
+        if self._load_since is None or self._load_since[0] != state:
+            self._load_since = (state, now)
+            return
+        if now - self._load_since[1] < (self.OVERLOAD_SECONDS if state == "overload" else self.UNDERLOAD_SECONDS):
+            return
+
+        old_rate = self.current_rate
+        if state == "overload":
+            self.current_rate = max(self.min_rate, self.current_rate * 0.8)
+        else:
+            self.current_rate = min(self.rate, self.current_rate * 1.1)
+        self._load_since = None
+        logger.info(f"Update rate {old_rate:.1f}Hz => {self.current_rate:.1f}Hz ({state}, load {self.load * 100:.0f}%)")
+
+    def _reset_stats(self, now: float) -> None:
+        self._stats_start = now
+        self._frames = 0
+        self._overruns = 0
+        self._skipped = 0
+        self._max_lateness = 0.0
+
+    def _report(self, now: float) -> None:
+        elapsed = now - self._stats_start
+        if elapsed < self.REPORT_INTERVAL:
+            return
+        self.achieved_rate = self._frames / elapsed
+        message = (f"Update rate: {self.achieved_rate:.1f}Hz achieved / {1 / self.interval:.1f}Hz target, "
+                   f"load {self.load * 100:.0f}%, {self._overruns} overruns (max {self._max_lateness * 1000:.2f}ms late), {self._skipped} frames skipped")
+        if self._overruns > 0 and self.paced:
+            logger.warning(message + ", decreasing UpdateRate recommended if this persists")
+        else:
+            logger.debug(message)
+        self._reset_stats(now)
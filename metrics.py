@@ -0,0 +1,247 @@
+import json
+import time
+
+
+class StageTimer(object):
+    """
+    Measures the time spent in each stage of a frame.
+
+    Call start() at the beginning of a frame and mark(stage) at the end of every stage,
+    stages marked multiple times per frame are summed up.
+    """
+
+    def __init__(self) -> None:
+        self.stages = {}
+        self._last = time.perf_counter()
+
+    def start(self) -> None:
+        self.stages.clear()
+        self._last = time.perf_counter()
+
+    def mark(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._last
+        self._last = now
+
+
+# upper bounds of the frame time histogram buckets in seconds
+FRAME_TIME_BUCKETS = [0.0005, 0.001, 0.002, 0.004, 0.008, 0.011, 0.016, 0.033, 0.066, 0.1]
+
+
+def escape_label_value(value) -> str:
+    """
+    Escapes a label value for the Prometheus text format, a serial number with a quote would break the whole scrape otherwise.
+    Parameters:
+        value (any): Label value
+    Returns:
+        str: Value with backslash, double quote and line feed escaped
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics(object):
+    """
+    Always-on performance counters of the frame loop.
+
+    Counters only ever increase, per second rates are calculated over the last
+    completed window of tick() calls.
+    """
+
+    def __init__(self, window: float = 1.0) -> None:
+        self.window = window
+        self.frames = 0
+        self.frame_seconds = 0.0
+        self.frame_buckets = [0] * (len(FRAME_TIME_BUCKETS) + 1)
+        self.overruns = 0
+        self.received_messages = 0
+        # by tracker name, "" for parameters that don't belong to a tracker
+        self.sent_messages = {}
+        self.sent_bytes = {}
+        # changed values held back by dead-band/hysteresis
+        self.suppressed_messages = 0
+        # trackers postponed to a later frame by the send budget
+        self.deferred_trackers = 0
+        self.stage_seconds = {}
+        # pipeline latency (reading poses to sending parameters) and prediction horizon in seconds
+        self.latency_seconds = 0.0
+        self.prediction_seconds = 0.0
+        # time from starting the OSCQuery discovery until VRChat was ready
+        self.connect_seconds = 0.0
+        # calls into SteamVR by the pose source, each one is an IPC round trip
+        self.openvr_calls = 0
+        self.rates = {}
+        self._window_start = time.perf_counter()
+        self._window_counters = self._counters()
+
+    def record_frame(self, stages: dict, overrun: bool) -> None:
+        """
+        Records the stage timings of a finished frame.
+        Parameters:
+            stages (dict): Seconds spent by stage
+            overrun (bool): True if the frame started after its scheduled time
+        Returns:
+            None
+        """
+        frame_time = 0.0
+        for stage, duration in stages.items():
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + duration
+            frame_time += duration
+        bucket = 0
+        while bucket < len(FRAME_TIME_BUCKETS) and frame_time > FRAME_TIME_BUCKETS[bucket]:
+            bucket += 1
+        self.frame_buckets[bucket] += 1
+        self.frame_seconds += frame_time
+        self.frames += 1
+        if overrun:
+            self.overruns += 1
+
+    def count_sent(self, tracker: str, size: int) -> None:
+        if size == 0:
+            return
+        self.sent_messages[tracker] = self.sent_messages.get(tracker, 0) + 1
+        self.sent_bytes[tracker] = self.sent_bytes.get(tracker, 0) + size
+
+    def count_suppressed(self, count: int) -> None:
+        self.suppressed_messages += count
+
+    def count_deferred(self, count: int) -> None:
+        self.deferred_trackers += count
+
+    def count_received(self) -> None:
+        self.received_messages += 1
+
+    def tick(self) -> None:
+        """
+        Updates the per second rates once per window, call once per frame.
+        Returns:
+            None
+        """
+        now = time.perf_counter()
+        elapsed = now - self._window_start
+        if elapsed < self.window:
+            return
+        counters = self._counters()
+        self.rates = {key: (value - self._window_counters.get(key, 0)) / elapsed for key, value in counters.items()}
+        self._window_start = now
+        self._window_counters = counters
+
+    def _counters(self) -> dict:
+        counters = {"frames": self.frames, "overruns": self.overruns, "received_messages": self.received_messages,
+                    "suppressed_messages": self.suppressed_messages, "deferred_trackers": self.deferred_trackers,
+                    "openvr_calls": self.openvr_calls}
+        for tracker, value in dict(self.sent_messages).items():
+            counters[("sent_messages", tracker)] = value
+        for tracker, value in dict(self.sent_bytes).items():
+            counters[("sent_bytes", tracker)] = value
+        for stage, value in dict(self.stage_seconds).items():
+            counters[("stage_seconds", stage)] = value
+        return counters
+
+    def to_json(self) -> str:
+        rates = dict(self.rates)
+        sent_messages = dict(self.sent_messages)
+        sent_bytes = dict(self.sent_bytes)
+        stage_seconds = dict(self.stage_seconds)
+        return json.dumps({
+            "frames": self.frames,
+            "frames_per_second": rates.get("frames", 0.0),
+            "frame_seconds": {
+                "buckets": dict(zip([str(le) for le in FRAME_TIME_BUCKETS] + ["+Inf"], self._cumulative_buckets())),
+                "sum": self.frame_seconds,
+                "count": self.frames,
+            },
+            "overruns": self.overruns,
+            "overruns_per_second": rates.get("overruns", 0.0),
+            "sent": {
+                "messages": sum(sent_messages.values()),
+                "bytes": sum(sent_bytes.values()),
+                "messages_per_second": sum(rate for key, rate in rates.items() if key[0] == "sent_messages"),
+                "bytes_per_second": sum(rate for key, rate in rates.items() if key[0] == "sent_bytes"),
+                "suppressed_messages": self.suppressed_messages,
+                "suppressed_messages_per_second": rates.get("suppressed_messages", 0.0),
+                "deferred_trackers": self.deferred_trackers,
+                "deferred_trackers_per_second": rates.get("deferred_trackers", 0.0),
+                "trackers": {
+                    tracker: {
+                        "messages": sent_messages[tracker],
+                        "bytes": sent_bytes.get(tracker, 0),
+                        "messages_per_second": rates.get(("sent_messages", tracker), 0.0),
+                        "bytes_per_second": rates.get(("sent_bytes", tracker), 0.0),
+                    } for tracker in sent_messages if tracker
+                },
+            },
+            "received": {
+                "messages": self.received_messages,
+                "messages_per_second": rates.get("received_messages", 0.0),
+            },
+            "latency_seconds": self.latency_seconds,
+            "prediction_seconds": self.prediction_seconds,
+            "connect_seconds": self.connect_seconds,
+            "openvr_calls": self.openvr_calls,
+            "openvr_calls_per_second": rates.get("openvr_calls", 0.0),
+            "stages": {
+                stage: {
+                    "seconds": seconds,
+                    "seconds_per_frame": rates.get(("stage_seconds", stage), 0.0) / rates["frames"] if rates.get("frames") else 0.0,
+                } for stage, seconds in stage_seconds.items()
+            },
+        }, indent=4)
+
+    def to_prometheus(self) -> str:
+        lines = [
+            "# HELP objecttracking_frame_seconds Time spent working on a frame.",
+            "# TYPE objecttracking_frame_seconds histogram",
+        ]
+        for le, count in zip([str(le) for le in FRAME_TIME_BUCKETS] + ["+Inf"], self._cumulative_buckets()):
+            lines.append(f'objecttracking_frame_seconds_bucket{{le="{le}"}} {count}')
+        lines += [
+            f"objecttracking_frame_seconds_sum {self.frame_seconds}",
+            f"objecttracking_frame_seconds_count {self.frames}",
+            "# HELP objecttracking_frame_overruns_total Frames started after their scheduled time.",
+            "# TYPE objecttracking_frame_overruns_total counter",
+            f"objecttracking_frame_overruns_total {self.overruns}",
+            "# HELP objecttracking_received_messages_total Received OSC messages.",
+            "# TYPE objecttracking_received_messages_total counter",
+            f"objecttracking_received_messages_total {self.received_messages}",
+            "# HELP objecttracking_suppressed_messages_total Changed parameter values held back by dead-band/hysteresis.",
+            "# TYPE objecttracking_suppressed_messages_total counter",
+            f"objecttracking_suppressed_messages_total {self.suppressed_messages}",
+            "# HELP objecttracking_deferred_trackers_total Trackers postponed to a later frame by the send budget.",
+            "# TYPE objecttracking_deferred_trackers_total counter",
+            f"objecttracking_deferred_trackers_total {self.deferred_trackers}",
+            "# HELP objecttracking_latency_seconds Smoothed time from reading poses to sending parameters.",
+            "# TYPE objecttracking_latency_seconds gauge",
+            f"objecttracking_latency_seconds {self.latency_seconds}",
+            "# HELP objecttracking_prediction_seconds Default pose prediction horizon.",
+            "# TYPE objecttracking_prediction_seconds gauge",
+            f"objecttracking_prediction_seconds {self.prediction_seconds}",
+            "# HELP objecttracking_connect_seconds Time from starting the OSCQuery discovery until VRChat was ready.",
+            "# TYPE objecttracking_connect_seconds gauge",
+            f"objecttracking_connect_seconds {self.connect_seconds}",
+            "# HELP objecttracking_openvr_calls_total Calls into SteamVR (IPC round trips) to read devices and poses.",
+            "# TYPE objecttracking_openvr_calls_total counter",
+            f"objecttracking_openvr_calls_total {self.openvr_calls}",
+        ]
+        for name, counter in [("messages", self.sent_messages), ("bytes", self.sent_bytes)]:
+            lines += [
+                f"# HELP objecttracking_sent_{name}_total Sent OSC {name} by tracker.",
+                f"# TYPE objecttracking_sent_{name}_total counter",
+            ]
+            for tracker, value in dict(counter).items():
+                label = f'{{tracker="{escape_label_value(tracker)}"}}' if tracker else ""
+                lines.append(f"objecttracking_sent_{name}_total{label} {value}")
+        lines += [
+            "# HELP objecttracking_stage_seconds_total Time spent by frame loop stage.",
+            "# TYPE objecttracking_stage_seconds_total counter",
+        ]
+        for stage, value in dict(self.stage_seconds).items():
+            lines.append(f'objecttracking_stage_seconds_total{{stage="{escape_label_value(stage)}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def _cumulative_buckets(self) -> list:
+        result = []
+        total = 0
+        for count in self.frame_buckets:
+            total += count
+            result.append(total)
+        return result
@@ -0,0 +1,110 @@
+import struct
+import time
+from threading import Lock
+from pythonosc import udp_client
+
+BUNDLE_HEADER = b"#bundle\x00" + struct.pack(">Q", 1)  # time tag: immediately
+
+
+class BundledUDPClient(udp_client.SimpleUDPClient):
+    """
+    SimpleUDPClient that optionally collects messages and sends them as OSC bundles on flush().
+
+    Bundles are split so no datagram exceeds the given MTU. With bundling disabled every message
+    is sent as its own datagram, same as SimpleUDPClient.
+    """
+
+    def __init__(self, address: str, port: int, bundle: bool = False, mtu: int = 1472) -> None:
+        super().__init__(address, port)
+        self.bundle = bundle
+        self.mtu = mtu
+        self.datagrams_sent = 0
+        self.messages_sent = 0
+        self.last_message_size = 0
+        self._pending = []
+        self._pending_lock = Lock()
+
+    def send(self, content) -> None:
+        """
+        Sends a message or bundle, or queues it for the next flush() if bundling is enabled.
+        Parameters:
+            content (OscMessage | OscBundle): Message or bundle to be sent
+        Returns:
+            None
+        """
+        self.messages_sent += 1
+        self.last_message_size = len(content.dgram)
+        if not self.bundle:
+            self._send_dgram(content.dgram)
+            return
+        with self._pending_lock:
+            self._pending.append(content.dgram)
+
+    def flush(self) -> None:
+        """
+        Sends all queued messages as OSC bundles.
+        Returns:
+            None
+        """
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        if len(pending) == 1:
+            self._send_dgram(pending[0])
+            return
+
+        elements = []
+        size = len(BUNDLE_HEADER)
+        for dgram in pending:
+            element_size = 4 + len(dgram)
+            if elements and size + element_size > self.mtu:
+                self._send_dgram(b"".join(elements))
+                elements = []
+                size = len(BUNDLE_HEADER)
+            if not elements:
+                elements.append(BUNDLE_HEADER)
+            elements.append(struct.pack(">i", len(dgram)))
+            elements.append(dgram)
+            size += element_size
+        if elements:
+            self._send_dgram(b"".join(elements))
+
+    def _send_dgram(self, dgram: bytes) -> None:
+        self._sock.sendto(dgram, (self._address, self._port))
+        self.datagrams_sent += 1
+
+
+if __name__ == "__main__":
+    import socket
+
+    # Benchmark: sendto calls and CPU time per frame, individual messages vs. bundles
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.setblocking(False)
+    port = receiver.getsockname()[1]
+
+    frames = 900
+    trackers = 10
+    # 6 local floats and 2 bytes + 4 bits per axis
+    parameters = [
+        (f"/avatar/parameters/ObjectTracking/T{t}/{name}", value)
+        for t in range(trackers)
+        for key in ["PX", "PY", "PZ", "RX", "RY", "RZ"]
+        for name, value in [(f"L{key}", 0.5)] + [(f"R{key}-Byte{i}", 127) for i in range(2)] + [(f"R{key}-Bit{i}", 1) for i in range(4)]
+    ]
+
+    for bundle in [False, True]:
+        client = BundledUDPClient("127.0.0.1", port, bundle=bundle)
+        cpu_start = time.process_time()
+        for _ in range(frames):
+            for address, value in parameters:
+                client.send_message(address, value)
+            client.flush()
+            try:
+                while True:
+                    receiver.recv(65536)
+            except BlockingIOError:
+                pass
+        cpu = time.process_time() - cpu_start
+        print(f"{'bundled' if bundle else 'individual':>10}: {len(parameters)} messages/frame, "
+              f"{client.datagrams_sent / frames:.1f} sendto/frame, {cpu / frames * 1000:.3f}ms CPU/frame")
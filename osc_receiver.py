@@ -0,0 +1,68 @@
+from pythonosc import osc_server
+
+
+class BatchedOSCUDPServer(osc_server.OSCUDPServer):
+    """
+    Receives all datagrams on the thread running serve_forever().
+
+    ThreadingOSCUDPServer starts a new thread for every datagram, this server reads all queued datagrams
+    (up to batch_size) per wakeup from a non-blocking socket and dispatches them directly.
+    Handlers have to be fast, e.g. only queue the message.
+
+    Attributes
+    ----------
+    batch_size : int
+        Maximum datagrams read per wakeup
+    datagrams : int
+        Number of received datagrams
+    batches : int
+        Number of wakeups with at least one datagram
+    """
+
+    max_packet_size = 65535
+
+    def __init__(self, server_address, dispatcher, batch_size: int = 64) -> None:
+        super().__init__(server_address, dispatcher)
+        self.socket.setblocking(False)
+        self.batch_size = batch_size
+        self.datagrams = 0
+        self.batches = 0
+
+    def _handle_request_noblock(self) -> None:
+        # called by serve_forever() whenever the socket is readable
+        received = 0
+        while received < self.batch_size:
+            try:
+                data, client_address = self.socket.recvfrom(self.max_packet_size)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                return
+            received += 1
+            if not self.verify_request((data, self.socket), client_address):
+                continue
+            try:
+                self.dispatcher.call_handlers_for_packet(data, client_address)
+            except Exception:
+                # like socketserver, a broken datagram must not end serve_forever()
+                self.handle_error((data, self.socket), client_address)
+        if received:
+            self.batches += 1
+            self.datagrams += received
+
+
+def create_osc_server(receiver: str, server_address, dispatcher) -> osc_server.OSCUDPServer:
+    """
+    Creates the OSC server for the given receiver mode.
+    Parameters:
+        receiver (str): "threading" (a thread per datagram) or "batched" (one thread)
+        server_address (tuple[str, int]): IP and port to listen on
+        dispatcher (Dispatcher): Dispatcher of the received messages
+    Returns:
+        OSCUDPServer: Server, start it with serve_forever()
+    """
+    if receiver == "batched":
+        return BatchedOSCUDPServer(server_address, dispatcher)
+    if receiver == "threading":
+        return osc_server.ThreadingOSCUDPServer(server_address, dispatcher)
+    raise Exception(f"Unknown OSC receiver {receiver}, expected threading or batched")
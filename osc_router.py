@@ -0,0 +1,101 @@
+import logging
+from pythonosc import dispatcher, osc_bundle, osc_message, osc_packet
+
+logger = logging.getLogger(__name__)
+
+
+class OSCRouter(dispatcher.Dispatcher):
+    """
+    Routes incoming OSC messages by exact address or address prefix.
+
+    The address of a datagram is read without parsing the message, messages without a route
+    (e.g. the avatar parameters of other systems) are dropped before their arguments get parsed.
+    Handlers are called as handler(address, *arguments), like pythonosc handlers without fixed arguments.
+    Errors of a handler are logged and don't stop the other messages of a bundle from being dispatched.
+
+    Attributes
+    ----------
+    routed : int
+        Number of messages passed to a handler
+    dropped : int
+        Number of messages without a route
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.routed = 0
+        self.dropped = 0
+        self._exact = {}
+        self._prefixes = ()
+
+    def map_exact(self, address: str, handler) -> None:
+        """
+        Routes messages sent to address to handler.
+        Parameters:
+            address (str): OSC address
+            handler (Callable): Called with the address and the message arguments
+        Returns:
+            None
+        """
+        self._exact[address] = handler
+
+    def map_prefix(self, prefix: str, handler) -> None:
+        """
+        Routes messages sent to addresses starting with prefix to handler, exact routes take precedence.
+        Parameters:
+            prefix (str): Start of the OSC address
+            handler (Callable): Called with the address and the message arguments
+        Returns:
+            None
+        """
+        self._prefixes += ((prefix, handler),)
+
+    def route(self, address: str):
+        """
+        Looks up the handler of an address.
+        Parameters:
+            address (str): OSC address
+        Returns:
+            Callable | None: Handler or None if the message should be dropped
+        """
+        handler = self._exact.get(address)
+        if handler is not None:
+            return handler
+        for prefix, handler in self._prefixes:
+            if address.startswith(prefix):
+                return handler
+        return None
+
+    def call_handlers_for_packet(self, data: bytes, client_address) -> None:
+        try:
+            if osc_bundle.OscBundle.dgram_is_bundle(data):
+                for timed_message in osc_packet.OscPacket(data).messages:
+                    message = timed_message.message
+                    self._dispatch(message.address, message)
+                return
+            # the address is the first, null terminated string of a message
+            end = data.find(b"\x00")
+            if end < 0:
+                return
+            address = data[:end].decode("utf-8", "replace")
+            handler = self.route(address)
+            if handler is None:
+                self.dropped += 1
+                return
+            self._call(handler, address, osc_message.OscMessage(data).params)
+        except (osc_packet.ParseError, osc_message.ParseError):
+            pass
+
+    def _dispatch(self, address: str, message: osc_message.OscMessage) -> None:
+        handler = self.route(address)
+        if handler is None:
+            self.dropped += 1
+            return
+        self._call(handler, address, message.params)
+
+    def _call(self, handler, address: str, params: list) -> None:
+        self.routed += 1
+        try:
+            handler(address, *params)
+        except Exception:
+            logger.debug("Error handling OSC message %s %s", address, params, exc_info=True)
@@ -0,0 +1,172 @@
+import numpy
+
+# below this cos(pitch) the rotation is treated as gimbal locked and roll is set to 0 (same as scipy)
+GIMBAL_LOCK_EPSILON = 1e-7
+
+
+def euler_yxz(rotations: numpy.ndarray) -> numpy.ndarray:
+    """
+    Extracts intrinsic YXZ euler angles, same as scipy's Rotation.from_matrix(r).as_euler("YXZ").
+    Parameters:
+        rotations (numpy.ndarray): (..., 3, 3) rotation matrices
+    Returns:
+        numpy.ndarray: (..., 3) yaw, pitch, roll in radians
+    """
+    # R = Ry(yaw) @ Rx(pitch) @ Rz(roll)
+    r = numpy.asarray(rotations, dtype=numpy.float64)
+    cos_pitch = numpy.hypot(r[..., 1, 0], r[..., 1, 1])
+    pitch = numpy.arctan2(-r[..., 1, 2], cos_pitch)
+    locked = cos_pitch < GIMBAL_LOCK_EPSILON
+    yaw = numpy.where(
+        locked,
+        numpy.arctan2(-r[..., 2, 0], r[..., 0, 0]),
+        numpy.arctan2(r[..., 0, 2], r[..., 2, 2]),
+    )
+    roll = numpy.where(locked, 0.0, numpy.arctan2(r[..., 1, 0], r[..., 1, 1]))
+    return numpy.stack((yaw, pitch, roll), axis=-1)
+
+
+def yaw_rotation(yaw) -> numpy.ndarray:
+    """
+    Builds rotation matrices around the y axis.
+    Parameters:
+        yaw (float | numpy.ndarray): (...) yaw in radians
+    Returns:
+        numpy.ndarray: (..., 3, 3) rotation matrices
+    """
+    yaw = numpy.asarray(yaw, dtype=numpy.float64)
+    c = numpy.cos(yaw)
+    s = numpy.sin(yaw)
+    result = numpy.zeros(yaw.shape + (3, 3))
+    result[..., 0, 0] = c
+    result[..., 0, 2] = s
+    result[..., 1, 1] = 1.0
+    result[..., 2, 0] = -s
+    result[..., 2, 2] = c
+    return result
+
+
+def flatten_to_yaw(rotations: numpy.ndarray) -> numpy.ndarray:
+    """
+    Removes pitch and roll from rotation matrices.
+    Parameters:
+        rotations (numpy.ndarray): (..., 3, 3) rotation matrices
+    Returns:
+        numpy.ndarray: (..., 3, 3) rotation matrices around the y axis
+    """
+    return yaw_rotation(euler_yxz(rotations)[..., 0])
+
+
+def rotation_from_rotvec(rotvecs: numpy.ndarray) -> numpy.ndarray:
+    """
+    Builds rotation matrices from rotation vectors (axis * angle), same as scipy's Rotation.from_rotvec(v).as_matrix().
+    Parameters:
+        rotvecs (numpy.ndarray): (..., 3) rotation vectors in radians
+    Returns:
+        numpy.ndarray: (..., 3, 3) rotation matrices
+    """
+    rotvecs = numpy.asarray(rotvecs, dtype=numpy.float64)
+    angle = numpy.linalg.norm(rotvecs, axis=-1)[..., None, None]
+    x, y, z = numpy.moveaxis(rotvecs, -1, 0)
+    skew = numpy.zeros(rotvecs.shape[:-1] + (3, 3))
+    skew[..., 0, 1] = -z
+    skew[..., 0, 2] = y
+    skew[..., 1, 0] = z
+    skew[..., 1, 2] = -x
+    skew[..., 2, 0] = -y
+    skew[..., 2, 1] = x
+    # Rodrigues' formula, series expansion for small angles
+    small = angle < 1e-6
+    safe_angle = numpy.where(small, 1.0, angle)
+    a = numpy.where(small, 1 - angle ** 2 / 6, numpy.sin(safe_angle) / safe_angle)
+    b = numpy.where(small, 0.5 - angle ** 2 / 24, (1 - numpy.cos(safe_angle)) / safe_angle ** 2)
+    return numpy.eye(3) + a * skew + b * (skew @ skew)
+
+
+def rigid_inverse(matrices: numpy.ndarray) -> numpy.ndarray:
+    """
+    Inverts rigid transformation matrices (rotation and translation only).
+    Parameters:
+        matrices (numpy.ndarray): (..., 4, 4) transformation matrices
+    Returns:
+        numpy.ndarray: (..., 4, 4) inverted transformation matrices
+    """
+    matrices = numpy.asarray(matrices)
+    rotation_inv = numpy.swapaxes(matrices[..., 0:3, 0:3], -1, -2)
+    result = numpy.zeros(matrices.shape)
+    result[..., 0:3, 0:3] = rotation_inv
+    result[..., 0:3, 3] = -(rotation_inv @ matrices[..., 0:3, 3, None])[..., 0]
+    result[..., 3, 3] = 1.0
+    return result
+
+
+def matrices_to_osc_array(poses: numpy.ndarray) -> numpy.ndarray:
+    """
+    Converts pose matrices to positions and normalized euler angles.
+    Parameters:
+        poses (numpy.ndarray): (..., 4, 4) pose matrices
+    Returns:
+        numpy.ndarray: (..., 6) x, y, z, pitch (-0.5 - 0.5), yaw (-1.0 - 1.0), roll (-1.0 - 1.0)
+    """
+    poses = numpy.asarray(poses)
+    yaw, pitch, roll = numpy.moveaxis(euler_yxz(poses[..., 0:3, 0:3]), -1, 0)
+    result = numpy.empty(poses.shape[:-2] + (6,))
+    result[..., 0:3] = poses[..., 0:3, 3]
+    result[..., 3] = pitch / numpy.pi
+    result[..., 4] = yaw / numpy.pi
+    result[..., 5] = roll / numpy.pi
+    return result
+
+
+if __name__ == "__main__":
+    # Compare against scipy, including rotations at and near gimbal lock, fails with an AssertionError
+    import warnings
+    from scipy.spatial.transform import Rotation
+
+    rng = numpy.random.default_rng(0)
+    rotations = Rotation.random(10000, random_state=1)
+    angles = rng.uniform(-numpy.pi, numpy.pi, (2000, 3))
+    for offset in [0.0, 1e-9, 1e-6, 1e-3]:
+        angles[:, 1] = rng.choice([-1, 1], len(angles)) * (numpy.pi / 2 - offset)
+        rotations = Rotation.concatenate([rotations, Rotation.from_euler("YXZ", angles)])
+    matrices = rotations.as_matrix()
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        expected = rotations.as_euler("YXZ")
+    actual = euler_yxz(matrices)
+
+    # angles differ near gimbal lock, the resulting rotation must not
+    rebuilt = Rotation.from_euler("YXZ", actual).as_matrix()
+    print(f"max angle difference: {numpy.abs(numpy.angle(numpy.exp(1j * (actual - expected)))).max():.2e} rad")
+    difference = numpy.abs(rebuilt - matrices).max()
+    print(f"max matrix difference: {difference:.2e}")
+    # precision is lost close to gimbal lock (sqrt of 1 - sin^2), 2e-9 at 1e-9 rad off
+    assert difference < 1e-8, "euler_yxz doesn't match scipy"
+
+    # the angles are what is sent, away from gimbal lock they have to be the same triple as scipy's
+    random = rotations[:10000]
+    expected = random.as_euler("YXZ", degrees=True)
+    free = numpy.abs(expected[:, 1]) < 89
+    actual = numpy.degrees(euler_yxz(random.as_matrix()))
+    # -180° and 180° are the same angle
+    difference = numpy.abs((actual - expected + 180) % 360 - 180)[free].max()
+    print(f"max angle difference away from gimbal lock: {difference:.2e}° ({free.sum()} rotations)")
+    assert difference < 1e-9, "euler_yxz angles don't match scipy"
+
+    rotvecs = rng.normal(size=(1000, 3)) * rng.choice([1e-9, 1e-4, 1.0], (1000, 1))
+    difference = numpy.abs(rotation_from_rotvec(rotvecs) - Rotation.from_rotvec(rotvecs).as_matrix()).max()
+    print(f"rotation_from_rotvec max difference: {difference:.2e}")
+    assert difference < 1e-12, "rotation_from_rotvec doesn't match scipy"
+
+    yaws = rng.uniform(-numpy.pi, numpy.pi, 1000)
+    difference = numpy.abs(yaw_rotation(yaws) - Rotation.from_euler('y', yaws[:, None]).as_matrix()).max()
+    print(f"yaw_rotation max difference: {difference:.2e}")
+    assert difference < 1e-12, "yaw_rotation doesn't match scipy"
+
+    poses = numpy.tile(numpy.eye(4), (len(matrices), 1, 1))
+    poses[:, 0:3, 0:3] = matrices
+    poses[:, 0:3, 3] = rng.uniform(-5, 5, (len(matrices), 3))
+    difference = numpy.abs(rigid_inverse(poses) - numpy.linalg.inv(poses)).max()
+    print(f"rigid_inverse max difference: {difference:.2e}")
+    assert difference < 1e-12, "rigid_inverse doesn't match numpy.linalg.inv"
@@ -0,0 +1,122 @@
+import logging
+import numpy
+from pose_math import rotation_from_rotvec
+from pose_source import FLAG_POSE_VALID, PoseFrame
+
+logger = logging.getLogger(__name__)
+
+PREDICTION_MODES = ("off", "openvr", "extrapolate")
+
+
+class PosePredictor(object):
+    """
+    Predicts poses ahead in time to compensate the latency between reading a pose and VRChat applying it.
+
+    Modes:
+        off: poses are sent as read
+        openvr: SteamVR predicts all poses by the default horizon, per tracker differences are extrapolated
+        extrapolate: poses are extrapolated from the device velocities and angular velocities
+
+    Attributes
+    ----------
+    mode : str
+        One of PREDICTION_MODES
+    seconds : float | None
+        Fixed prediction horizon, None to use the measured pipeline latency plus extra_latency
+    extra_latency : float
+        Latency after sending in seconds (network, VRChat's OSC ingest), only used with the measured horizon
+    tracker_seconds : dict
+        Prediction horizons by serial number, overriding the default horizon
+    latency : float
+        Measured pipeline latency (reading poses to sending parameters) in seconds
+    """
+
+    # don't predict further ahead than this, extrapolation errors grow quickly
+    MAX_SECONDS = 0.1
+
+    def __init__(self, mode: str = "off", seconds: float = None, extra_latency: float = 0.0, tracker_seconds: dict = None) -> None:
+        if mode not in PREDICTION_MODES:
+            raise Exception(f"Unknown prediction mode {mode}, expected one of {', '.join(PREDICTION_MODES)}")
+        self.mode = mode
+        self.seconds = seconds
+        self.extra_latency = extra_latency
+        self.tracker_seconds = tracker_seconds or {}
+        self.latency = 0.0
+
+    @property
+    def horizon(self) -> float:
+        """
+        Default prediction horizon in seconds.
+        """
+        if self.mode == "off":
+            return 0.0
+        seconds = self.seconds if self.seconds is not None else self.latency + self.extra_latency
+        return min(max(seconds, 0.0), self.MAX_SECONDS)
+
+    def record_latency(self, seconds: float) -> None:
+        """
+        Records the pipeline latency of a frame.
+        Parameters:
+            seconds (float): Time from reading the poses to sending the parameters
+        Returns:
+            None
+        """
+        if self.latency == 0.0:
+            self.latency = seconds
+        else:
+            # exponential moving average, smooths out single slow frames
+            self.latency += (seconds - self.latency) * 0.05
+
+    def predict(self, frame: PoseFrame, predicted_seconds: float = 0.0) -> PoseFrame:
+        """
+        Extrapolates the poses of a frame to their prediction horizons.
+        Parameters:
+            frame (PoseFrame): Poses to extrapolate
+            predicted_seconds (float): Time the poses are already predicted ahead (by SteamVR)
+        Returns:
+            PoseFrame: Frame with extrapolated poses, the given frame if there is nothing to do
+        """
+        if self.mode == "off" or len(frame.devices) == 0:
+            return frame
+        horizon = self.horizon
+        if self.mode == "openvr" and not self.tracker_seconds:
+            return frame
+        if self.tracker_seconds:
+            seconds = numpy.array([min(self.tracker_seconds.get(device.serial, horizon), self.MAX_SECONDS) for device in frame.devices])
+        else:
+            seconds = numpy.full(len(frame.devices), horizon)
+        seconds -= predicted_seconds
+        seconds[(frame.poses["flags"] & FLAG_POSE_VALID) == 0] = 0.0
+        if not seconds.any():
+            return frame
+
+        poses = frame.poses.copy()
+        matrix = poses["matrix"].astype(numpy.float64)
+        matrix[..., 3] += poses["velocity"] * seconds[:, None]
+        # angular velocity is given in tracking space, so the rotation is applied from the left
+        matrix[..., 0:3] = rotation_from_rotvec(poses["angular_velocity"] * seconds[:, None]) @ matrix[..., 0:3]
+        poses["matrix"] = matrix
+        return PoseFrame(frame.timestamp, frame.devices, poses)
+
+
+if __name__ == "__main__":
+    # self check: a device spinning and moving at constant speed is predicted exactly
+    from device_registry import TrackedDevice
+    from pose_math import yaw_rotation
+    from pose_source import POSE_DTYPE, FLAGS_OK
+
+    def spinning_frame(t: float) -> PoseFrame:
+        poses = numpy.zeros(1, dtype=POSE_DTYPE)
+        poses["flags"] = FLAGS_OK
+        poses["matrix"][0, :, 0:3] = yaw_rotation(2.0 * t)
+        poses["matrix"][0, :, 3] = [0.5 * t, 1.0, 0.0]
+        poses["velocity"] = [0.5, 0.0, 0.0]
+        poses["angular_velocity"] = [0.0, 2.0, 0.0]
+        return PoseFrame(t, [TrackedDevice(0, "TRACKER", 3)], poses)
+
+    predictor = PosePredictor("extrapolate", tracker_seconds={"TRACKER": 0.05})
+    predicted = predictor.predict(spinning_frame(1.0))
+    expected = spinning_frame(1.05)
+    error = numpy.abs(predicted.poses['matrix'] - expected.poses['matrix']).max()
+    print(f"max prediction error: {error:.2e}")
+    assert error < 1e-6, "prediction of a constant motion is off"
@@ -0,0 +1,249 @@
+import mmap
+import os
+import struct
+import time
+import numpy
+import openvr
+from device_registry import DeviceRegistry, TrackedDevice
+
+FLAG_POSE_VALID = 1
+FLAG_RUNNING_OK = 2
+FLAGS_OK = FLAG_POSE_VALID | FLAG_RUNNING_OK
+
+# raw poses in OpenVR's (right handed) tracking space
+POSE_DTYPE = numpy.dtype([
+    ("flags", "u1"),
+    ("matrix", "<f4", (3, 4)),
+    ("velocity", "<f4", (3,)),
+    ("angular_velocity", "<f4", (3,)),
+])
+
+# layout of openvr.TrackedDevicePose_t
+OPENVR_POSE_DTYPE = numpy.dtype({
+    "names": ["matrix", "velocity", "angular_velocity", "tracking_result", "pose_is_valid", "device_is_connected"],
+    "formats": [("<f4", (3, 4)), ("<f4", (3,)), ("<f4", (3,)), "<u4", "u1", "u1"],
+    "offsets": [0, 48, 60, 72, 76, 77],
+    "itemsize": 80,
+})
+
+# Recording file layout:
+#   FILE_HEADER
+#   frames, each: FRAME_HEADER, new serials (SERIAL_HEADER + utf-8 serial), device count * RECORD_DTYPE
+FILE_MAGIC = b"OTPOSES\x00"
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct("<8sI")
+FRAME_HEADER = struct.Struct("<dHH")  # timestamp, device count, new serial count
+SERIAL_HEADER = struct.Struct("<HB")  # serial id, serial length
+RECORD_DTYPE = numpy.dtype([
+    ("index", "u1"),
+    ("device_class", "u1"),
+    ("serial", "<u2"),
+] + [(name, POSE_DTYPE.fields[name][0]) for name in POSE_DTYPE.names])
+
+
+class PoseFrame(object):
+    """
+    Poses of all active devices at one point in time.
+
+    Attributes
+    ----------
+    timestamp : float
+        Time of the frame in seconds
+    devices : list[TrackedDevice]
+        Active devices
+    poses : numpy.ndarray
+        POSE_DTYPE array in order of devices
+    """
+
+    def __init__(self, timestamp: float, devices: list, poses: numpy.ndarray) -> None:
+        self.timestamp = timestamp
+        self.devices = devices
+        self.poses = poses
+
+
+class PoseSource(object):
+    def get_frame(self) -> PoseFrame:
+        """
+        Returns the poses of all active devices.
+        Returns:
+            PoseFrame: Current poses
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class OpenVRPoseSource(PoseSource):
+    """
+    Reads poses from SteamVR, predicted_seconds ahead of now.
+    """
+
+    def __init__(self, system, origin=openvr.TrackingUniverseStanding) -> None:
+        self.system = system
+        self.origin = origin
+        self.predicted_seconds = 0.0
+        self.registry = DeviceRegistry(system)
+
+    def get_frame(self) -> PoseFrame:
+        self.registry.poll_events()
+        timestamp = time.perf_counter()
+        self.registry.ipc_calls += 1
+        raw = self.system.getDeviceToAbsoluteTrackingPose(self.origin, self.predicted_seconds, openvr.k_unMaxTrackedDeviceCount)
+        raw = numpy.frombuffer(raw, dtype=OPENVR_POSE_DTYPE)
+
+        devices = list(self.registry.devices.values())
+        raw = raw[[device.index for device in devices]]
+        poses = numpy.empty(len(devices), dtype=POSE_DTYPE)
+        poses["flags"] = (raw["pose_is_valid"] != 0) * FLAG_POSE_VALID | (raw["tracking_result"] == openvr.TrackingResult_Running_OK) * FLAG_RUNNING_OK
+        poses["matrix"] = raw["matrix"]
+        poses["velocity"] = raw["velocity"]
+        poses["angular_velocity"] = raw["angular_velocity"]
+        return PoseFrame(timestamp, devices, poses)
+
+
+class PoseRecorder(PoseSource):
+    """
+    Passes through the frames of another pose source and writes them to a file for PoseReplayer.
+    """
+
+    def __init__(self, source: PoseSource, path: str) -> None:
+        self.source = source
+        self._file = open(path, "wb")
+        self._file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION))
+        self._serial_ids = {}
+
+    def get_frame(self) -> PoseFrame:
+        frame = self.source.get_frame()
+
+        new_serials = []
+        records = numpy.empty(len(frame.devices), dtype=RECORD_DTYPE)
+        for i, device in enumerate(frame.devices):
+            serial_id = self._serial_ids.get(device.serial)
+            if serial_id is None:
+                serial_id = self._serial_ids[device.serial] = len(self._serial_ids)
+                new_serials.append((serial_id, device.serial.encode("utf-8")))
+            records[i]["index"] = device.index
+            records[i]["device_class"] = device.device_class
+            records[i]["serial"] = serial_id
+        for name in POSE_DTYPE.names:
+            records[name] = frame.poses[name]
+
+        self._file.write(FRAME_HEADER.pack(frame.timestamp, len(records), len(new_serials)))
+        for serial_id, serial in new_serials:
+            self._file.write(SERIAL_HEADER.pack(serial_id, len(serial)) + serial)
+        self._file.write(records.tobytes())
+        return frame
+
+    def close(self) -> None:
+        self._file.close()
+        self.source.close()
+
+
+class PoseReplayer(PoseSource):
+    """
+    Replays a file written by PoseRecorder.
+
+    In realtime mode the frame matching the time since the first get_frame() call is returned,
+    otherwise every call returns the next frame. Raises EOFError after the last frame unless loop is set.
+    """
+
+    def __init__(self, path: str, realtime: bool = True, loop: bool = False) -> None:
+        self.realtime = realtime
+        self.loop = loop
+        self._file = open(path, "rb")
+        # empty files can't be mapped
+        if os.fstat(self._file.fileno()).st_size < FILE_HEADER.size:
+            self._file.close()
+            raise Exception(f"{path} is not a pose recording (version {FILE_VERSION})!")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = FILE_HEADER.unpack_from(self._mmap, 0)
+        if magic != FILE_MAGIC or version != FILE_VERSION:
+            self.close()
+            raise Exception(f"{path} is not a pose recording (version {FILE_VERSION})!")
+
+        # index all frames once, serials are only written in the first frame they appear in
+        self.timestamps = []
+        self._offsets = []
+        self._counts = []
+        self._serials = {}
+        self._devices = {}
+        offset = FILE_HEADER.size
+        while offset + FRAME_HEADER.size <= len(self._mmap):
+            timestamp, count, serial_count = FRAME_HEADER.unpack_from(self._mmap, offset)
+            offset += FRAME_HEADER.size
+            complete = True
+            for _ in range(serial_count):
+                if offset + SERIAL_HEADER.size > len(self._mmap):
+                    complete = False
+                    break
+                serial_id, length = SERIAL_HEADER.unpack_from(self._mmap, offset)
+                offset += SERIAL_HEADER.size
+                self._serials[serial_id] = bytes(self._mmap[offset:offset + length]).decode("utf-8")
+                offset += length
+            if not complete or offset + count * RECORD_DTYPE.itemsize > len(self._mmap):
+                # incomplete last frame
+                break
+            self.timestamps.append(timestamp)
+            self._offsets.append(offset)
+            self._counts.append(count)
+            offset += count * RECORD_DTYPE.itemsize
+
+        self._position = 0
+        self._start_time = None
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    @property
+    def serials(self) -> list:
+        """
+        Serial numbers of all devices in the recording.
+        """
+        return list(self._serials.values())
+
+    def _get_device(self, index: int, serial_id: int, device_class: int) -> TrackedDevice:
+        key = (index, serial_id, device_class)
+        device = self._devices.get(key)
+        if device is None:
+            device = self._devices[key] = TrackedDevice(index, self._serials[serial_id], device_class)
+        return device
+
+    def get_frame(self) -> PoseFrame:
+        if len(self) == 0:
+            raise EOFError("Pose recording is empty")
+        if self.realtime:
+            now = time.perf_counter()
+            if self._start_time is None:
+                self._start_time = now
+            elapsed = now - self._start_time
+            duration = self.timestamps[-1] - self.timestamps[0]
+            if elapsed > duration:
+                if not self.loop:
+                    raise EOFError("End of pose recording")
+                self._start_time = now
+                self._position = 0
+                elapsed = 0
+            while self._position + 1 < len(self) and self.timestamps[self._position + 1] - self.timestamps[0] <= elapsed:
+                self._position += 1
+        elif self._position >= len(self):
+            if not self.loop:
+                raise EOFError("End of pose recording")
+            self._position = 0
+
+        position = self._position
+        if not self.realtime:
+            self._position += 1
+        records = numpy.frombuffer(self._mmap, dtype=RECORD_DTYPE, count=self._counts[position], offset=self._offsets[position])
+        devices = [
+            self._get_device(index, serial_id, device_class)
+            for index, serial_id, device_class in zip(records["index"].tolist(), records["serial"].tolist(), records["device_class"].tolist())
+        ]
+        poses = numpy.empty(len(records), dtype=POSE_DTYPE)
+        for name in POSE_DTYPE.names:
+            poses[name] = records[name]
+        return PoseFrame(self.timestamps[position], devices, poses)
+
+    def close(self) -> None:
+        self._mmap.close()
+        self._file.close()
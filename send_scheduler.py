@@ -0,0 +1,185 @@
+import numpy
+
+
+class SendScheduler(object):
+    """
+    Spends a bandwidth budget on the trackers that need it most.
+
+    The budget is a token bucket refilled with message_budget messages and byte_budget bytes per second
+    (0 for unlimited). Every frame the trackers with changed parameters are ordered by priority,
+    recent motion plus time since they were last sent, and sent as long as the budget lasts.
+    Trackers are always sent as a whole, so a pose is never mixed from two frames.
+    Every max_refresh_interval seconds a tracker is refreshed regardless of the budget: all its parameters
+    are resent, even unchanged ones, which repairs lost UDP messages. The refreshes of the trackers are
+    spread over the interval and take their share of the budget first, so they never stall the others for
+    more than a frame. Without a budget only these refreshes are scheduled, everything that changed is sent.
+
+    Attributes
+    ----------
+    message_budget : float
+        Messages per second, 0 for unlimited
+    byte_budget : float
+        Bytes per second, 0 for unlimited
+    max_refresh_interval : float
+        Seconds after which all parameters of a tracker are resent regardless of the budget
+    burst : float
+        Seconds of budget that can be saved up
+    deferred : int
+        Number of times a tracker got deferred to a later frame
+    forced : set
+        Names of the trackers selected by the last select() for a refresh, to be sent with all parameters
+    """
+
+    # motion is measured in steps of 1cm / 1°
+    POSITION_STEP = 0.01
+    ROTATION_STEP = 1.0
+
+    def __init__(self, message_budget: float = 0.0, byte_budget: float = 0.0, max_refresh_interval: float = 1.0, burst: float = 0.1) -> None:
+        self.message_budget = message_budget
+        self.byte_budget = byte_budget
+        self.max_refresh_interval = max_refresh_interval
+        self.burst = burst
+        self.deferred = 0
+        self.forced = set()
+        self.message_tokens = message_budget * burst
+        self.byte_tokens = byte_budget * burst
+        # exponential moving average of the size of a sent message, for estimating the bytes of a tracker
+        self.message_size = 64.0
+        self._last_refill = None
+        self._refreshed = {}
+        self._sent_at = {}
+        self._sent_values = {}
+
+    @property
+    def limited(self) -> bool:
+        return self.message_budget > 0 or self.byte_budget > 0
+
+    def _refill(self, now: float) -> None:
+        if self._last_refill is not None:
+            # a looping replay starts over in time
+            elapsed = max(0.0, now - self._last_refill)
+            self.message_tokens = min(self.message_tokens + elapsed * self.message_budget, self.message_budget * self.burst)
+            self.byte_tokens = min(self.byte_tokens + elapsed * self.byte_budget, self.byte_budget * self.burst)
+        self._last_refill = now
+
+    def select(self, names: list, values: numpy.ndarray, costs: list, now: float, counts: list = None) -> set:
+        """
+        Selects the trackers to send this frame.
+        Parameters:
+            names (list): Tracker names
+            values (numpy.ndarray): (N, 6) array of px, py, pz, rx, ry, rz (rotation in degrees) in order of names
+            costs (list): Number of changed parameters by tracker, in order of names
+            now (float): Current time in seconds
+            counts (list): Number of all parameters by tracker, in order of names, the cost of a refresh (default: costs)
+        Returns:
+            set: Names of the trackers to send
+        """
+        self._refill(now)
+        selected = set()
+        self.forced = set()
+        candidates = []
+        for i, name in enumerate(names):
+            # new trackers (e.g. after an avatar change) are sent by motion priority within the budget,
+            # a looping replay starts over in time
+            self._sent_at[name] = sent_at = min(self._sent_at.get(name, now), now)
+            # refreshes of new trackers are spread over the interval, so they don't all fall into the same frame
+            stagger = self.max_refresh_interval * (i + 1 - len(names)) / len(names)
+            self._refreshed[name] = refreshed = min(self._refreshed.get(name, now + stagger), now)
+            staleness = now - sent_at
+            # sending changed parameters doesn't repair lost messages of unchanged ones
+            forced = now - refreshed >= self.max_refresh_interval
+            if costs[i] == 0 and not forced:
+                # nothing to send, VRChat is up to date
+                continue
+            previous = self._sent_values.get(name)
+            if previous is None:
+                motion = numpy.inf
+            else:
+                delta = values[i] - previous
+                delta[3:] = (delta[3:] + 180) % 360 - 180
+                motion = max(numpy.linalg.norm(delta[:3]) / self.POSITION_STEP, numpy.abs(delta[3:]).max() / self.ROTATION_STEP)
+            candidates.append((forced, motion + staleness / self.max_refresh_interval, i, name))
+
+        message_tokens = self.message_tokens
+        byte_tokens = self.byte_tokens
+        # forced trackers come first and take their tokens from the same frame
+        for forced, priority, i, name in sorted(candidates, reverse=True):
+            message_cost = counts[i] if forced and counts is not None else costs[i]
+            byte_cost = message_cost * self.message_size
+            # a full bucket lets any tracker through, even if it is bigger than the bucket
+            fits = (
+                (self.message_budget <= 0 or message_cost <= message_tokens or message_tokens >= self.message_budget * self.burst)
+                and (self.byte_budget <= 0 or byte_cost <= byte_tokens or byte_tokens >= self.byte_budget * self.burst)
+            )
+            if not forced and not fits:
+                self.deferred += 1
+                continue
+            message_tokens -= message_cost
+            byte_tokens -= byte_cost
+            selected.add(name)
+            if forced:
+                self.forced.add(name)
+                # keeps the staggered phase, unless the tracker fell behind (e.g. no frames for a while)
+                refreshed = self._refreshed[name]
+                self._refreshed[name] = refreshed + self.max_refresh_interval if now - refreshed < 2 * self.max_refresh_interval else now
+            self._sent_at[name] = now
+            self._sent_values[name] = values[i]
+        return selected
+
+    def charge(self, messages: int, size: int) -> None:
+        """
+        Takes the actually sent messages from the budget.
+        Parameters:
+            messages (int): Number of sent messages
+            size (int): Bytes sent
+        Returns:
+            None
+        """
+        # refreshes can overdraw the budget, by at most one burst
+        self.message_tokens = max(self.message_tokens - messages, -self.message_budget * self.burst)
+        self.byte_tokens = max(self.byte_tokens - size, -self.byte_budget * self.burst)
+        if messages > 0:
+            self.message_size += (size / messages - self.message_size) * 0.1
+
+    def reset(self) -> None:
+        """
+        Forgets all trackers, e.g. after an avatar change.
+        Returns:
+            None
+        """
+        self._refreshed = {}
+        self._sent_at = {}
+        self._sent_values = {}
+        self.forced = set()
+
+
+if __name__ == "__main__":
+    # self check: 16 moving trackers on a budget at 90Hz, no frame sends more than the burst size,
+    # refreshes don't stall the other trackers and every tracker is refreshed in time
+    scheduler = SendScheduler(message_budget=1500, max_refresh_interval=1.0)
+    names = [f"TRACKER-{i}" for i in range(16)]
+    rng = numpy.random.default_rng(0)
+    values = numpy.zeros((len(names), 6))
+    refreshes = {name: [] for name in names}
+    sent = []
+    for frame in range(900):
+        now = frame / 90
+        values += rng.normal(0, 0.01, values.shape)
+        # 12 of 18 parameters of a moving tracker change, a refresh sends all 18
+        selected = scheduler.select(names, values.copy(), [12] * len(names), now, [18] * len(names))
+        messages = sum(18 if name in scheduler.forced else 12 for name in selected)
+        scheduler.charge(messages, messages * 64)
+        sent.append(messages)
+        for name in scheduler.forced:
+            refreshes[name].append(now)
+    sent = numpy.array(sent)
+    burst_size = scheduler.message_budget * scheduler.burst
+    print(f"max {sent.max()} messages per frame (burst size {burst_size:.0f}), {sent[90:].sum() / 9:.0f} messages/s")
+    assert sent.max() <= burst_size, "a frame sent more than the burst size"
+    assert (sent[1:] > 0).all(), "a frame sent nothing, refreshes stalled the other trackers"
+    assert abs(sent[90:].sum() / 9 - scheduler.message_budget) < 0.01 * scheduler.message_budget, "budget isn't used"
+    gaps = numpy.concatenate([numpy.diff(times) for times in refreshes.values()])
+    assert all(len(times) >= 8 for times in refreshes.values()) and gaps.max() <= 1.0 + 1 / 90, "tracker not refreshed in time"
+    frames = numpy.array([round(time * 90) for times in refreshes.values() for time in times])
+    assert numpy.bincount(frames).max() <= 2, "refreshes of the trackers fall into the same frame"
+    print(f"ok, refreshes every {gaps.min():.3f}s - {gaps.max():.3f}s")
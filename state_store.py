@@ -0,0 +1,81 @@
+from collections import deque
+
+# relative rounding error of float32, 2**-24
+FLOAT32_EPSILON = 5.960464477539063e-08
+
+
+class StateStore(object):
+    """
+    Received parameters and tracker configs.
+
+    OSC server threads only publish() incoming messages, the frame loop applies them in order
+    at the frame boundary (see pending()) and is the only writer of parameters and trackers.
+    This gives every frame a consistent state without locks, also across avatar changes.
+
+    Attributes
+    ----------
+    parameters : dict
+        Received parameter values by parameter name
+    sent : dict
+        Last sent (or received, if it was sent before) value by parameter name
+    trackers : dict
+        Tracker config by tracker name, config index to value
+    """
+
+    def __init__(self) -> None:
+        self.parameters = {}
+        self.sent = {}
+        self.trackers = {}
+        # deque.append and popleft are atomic, no lock needed between publishing threads and the frame loop
+        self._pending = deque()
+
+    def publish(self, address: str, value) -> None:
+        """
+        Queues a received message, safe to call from any thread.
+        Parameters:
+            address (str): OSC address of the message
+            value (any): Value of the message
+        Returns:
+            None
+        """
+        self._pending.append((address, value))
+
+    def pending(self):
+        """
+        Yields all queued messages in order of arrival, call from the frame loop only.
+        Returns:
+            Iterator[tuple[str, any]]: (address, value) pairs
+        """
+        while True:
+            try:
+                yield self._pending.popleft()
+            except IndexError:
+                return
+
+    def is_sent(self, parameter: str, value) -> bool:
+        """
+        Checks if a value is the last sent value of a parameter. Floats are compared with float32 precision,
+        OSC transmits them like that, so an echo from VRChat matches the value it was sent as.
+        Parameters:
+            parameter (str): Name of the parameter
+            value (any): Value of the parameter
+        Returns:
+            bool: True if the value doesn't need to be sent
+        """
+        sent = self.sent.get(parameter, None)
+        if sent == value:
+            return True
+        if isinstance(value, float) and isinstance(sent, float):
+            # rounding to float32 changes a value by at most half a unit in the last place
+            return abs(sent - value) <= max(abs(sent), abs(value)) * FLOAT32_EPSILON
+        return False
+
+    def reset(self) -> None:
+        """
+        Forgets all parameters and tracker configs, call from the frame loop only.
+        Returns:
+            None
+        """
+        self.parameters = {}
+        self.sent = {}
+        self.trackers = {}
@@ -0,0 +1,384 @@
+import argparse
+import json
+import random
+import socket
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+import requests
+from zeroconf import ServiceInfo
+
+from .query import OSCQueryBrowser, OSCQueryClient
+from .queryservice import OSCQueryHTTPServer, OSCQueryHTTPHandler
+from .shared.node import OSCQueryNode, OSCAccess, OSCHostInfo, OSCNodeEncoder, OSC_Type_String_to_Python_Type, diff_nodes, node_from_json
+
+
+def make_paths(count, seed=0):
+    """
+    Endpoint paths shaped like ObjectTracking's: per tracker config values and parameters below a few prefixes.
+    """
+    rng = random.Random(seed)
+    paths = []
+    tracker = 0
+    while len(paths) < count:
+        for name in ["enabled"] + [f"config/{i}" for i in range(1, 31)] + [f"{side}{axis}" for side in "LR" for axis in ["PX", "PY", "PZ", "RX", "RY", "RZ"]]:
+            paths.append(f"/avatar/parameters/ObjectTracking/tracker/TRACKER-{tracker}/{name}")
+        tracker += 1
+    paths = paths[:count]
+    rng.shuffle(paths)
+    return paths
+
+
+def legacy_find_subnode(node, full_path):
+    # recursive search of the whole tree, as OSCQueryNode.find_subnode did before the path index
+    if node.full_path == full_path:
+        return node
+    if node.contents is None:
+        return None
+    for subNode in node.contents:
+        foundNode = legacy_find_subnode(subNode, full_path)
+        if foundNode is not None:
+            return foundNode
+    return None
+
+
+def legacy_add_child_node(root, child):
+    parent_path = child.full_path.rsplit("/", 1)[0] or "/"
+    parent = legacy_find_subnode(root, parent_path)
+    if parent is None:
+        parent = OSCQueryNode(parent_path)
+        legacy_add_child_node(root, parent)
+    if parent._contents is None:
+        parent._contents = []
+    parent._contents.append(child)
+
+
+def bench_build(paths, add):
+    root = OSCQueryNode("/", description="root node")
+    start = time.perf_counter()
+    for path in paths:
+        add(root, OSCQueryNode(path, access=OSCAccess.READWRITE_VALUE, value=[0.0], type_=[float]))
+    return root, time.perf_counter() - start
+
+
+def bench_lookup(root, paths, find, lookups):
+    start = time.perf_counter()
+    for i in range(lookups):
+        if find(root, paths[i % len(paths)]) is None:
+            raise Exception(f"{paths[i % len(paths)]} not found")
+    return (time.perf_counter() - start) / lookups
+
+
+def bench_remove(root, paths):
+    start = time.perf_counter()
+    for path in paths:
+        root.remove_child_node(path)
+    return (time.perf_counter() - start) / len(paths)
+
+
+class LegacyHTTPHandler(SimpleHTTPRequestHandler):
+    # single threaded, HTTP/1.0 and serializing the node on every request, as OSCQueryHTTPHandler did before the JSON caches
+    def do_GET(self) -> None:
+        node = self.server.root_node.find_subnode(self.path)
+        self.send_response(200)
+        self.send_header("Content-type", "text/json")
+        self.end_headers()
+        self.wfile.write(bytes(json.dumps(node, cls=OSCNodeEncoder), 'utf-8'))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class QuietOSCQueryHTTPHandler(OSCQueryHTTPHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_http(server, paths, clients, requests_per_client, conditional):
+    """
+    Runs concurrent keep-alive clients against a server, returns requests per second and latencies in seconds.
+    """
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def client(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        etags = {}
+        latencies = []
+        for _ in range(requests_per_client):
+            path = rng.choice(paths)
+            headers = {"If-None-Match": etags[path]} if conditional and path in etags else {}
+            start = time.perf_counter()
+            response = session.get(url + path, headers=headers, timeout=10)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code == 200 and "ETag" in response.headers:
+                etags[path] = response.headers["ETag"]
+        session.close()
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        latencies = [latency for result in executor.map(client, range(clients)) for latency in result]
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    server.server_close()
+    latencies.sort()
+    return len(latencies) / elapsed, latencies
+
+
+def run_http(args):
+    paths = make_paths(args.http_nodes)
+    root, _ = bench_build(paths, OSCQueryNode.add_child_node)
+    # polled paths: the whole tree, a few trackers and single values
+    polled = ["/", "/avatar/parameters/ObjectTracking"] + sorted({path.rsplit("/", 1)[0] for path in paths[:20]}) + paths[:20]
+    host_info = OSCHostInfo("benchmark", {"ACCESS": True, "CLIPMODE": False, "RANGE": True, "TYPE": True, "VALUE": True})
+    runs = [
+        ("legacy", lambda: HTTPServer(("127.0.0.1", 0), LegacyHTTPHandler), False),
+        ("cached", lambda: OSCQueryHTTPServer(root, host_info, ("127.0.0.1", 0), QuietOSCQueryHTTPHandler), False),
+        ("cached+etag", lambda: OSCQueryHTTPServer(root, host_info, ("127.0.0.1", 0), QuietOSCQueryHTTPHandler), True),
+    ]
+    print(f"HTTP: {args.http_nodes} endpoints, {args.clients} clients x {args.requests} requests")
+    for name, create, conditional in runs:
+        server = create()
+        server.root_node = root
+        rate, latencies = bench_http(server, polled, args.clients, args.requests, conditional)
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"  {name:<12} {rate:>8.0f} req/s, p50 {p50 * 1000:.2f}ms, p99 {p99 * 1000:.2f}ms")
+
+
+class DelayedOSCQueryHTTPHandler(QuietOSCQueryHTTPHandler):
+    # answers after the simulated network round trip of the server
+    def do_GET(self) -> None:
+        time.sleep(self.server.delay)
+        super().do_GET()
+
+
+def start_services(count, delay):
+    servers = []
+    services = []
+    for i in range(count):
+        root = OSCQueryNode("/", description="root node")
+        root.add_child_node(OSCQueryNode("/avatar/change", access=OSCAccess.READWRITE_VALUE, value=["avtr"], type_=[str]))
+        server = OSCQueryHTTPServer(root, OSCHostInfo(f"Service-{i}", {}), ("127.0.0.1", 0), DelayedOSCQueryHTTPHandler)
+        server.delay = delay
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        services.append(ServiceInfo("_oscjson._tcp.local.", f"Service-{i}._oscjson._tcp.local.", port=server.server_address[1], addresses=[socket.inet_aton("127.0.0.1")]))
+    return servers, services
+
+
+def legacy_find_service_by_name(services, name):
+    # a new client and connection per service, one after another, as OSCQueryBrowser did before the client pool
+    for svc in services:
+        client = OSCQueryClient(svc)
+        client.session = requests
+        host_info = client.get_host_info()
+        if host_info is not None and name in host_info.name:
+            return svc
+    return None
+
+
+def run_discovery(args):
+    servers, services = start_services(args.services, args.rtt / 1000)
+    # the wanted service is found last by a sequential search
+    name = f"Service-{args.services - 1}"
+    print(f"Discovery: {args.services} services with {args.rtt:.0f}ms round trip, looking for {name}")
+
+    start = time.perf_counter()
+    assert legacy_find_service_by_name(services, name) is not None
+    print(f"  sequential        {(time.perf_counter() - start) * 1000:>7.1f}ms")
+
+    browser = OSCQueryBrowser()
+    # discovered services are injected, zeroconf is not part of the measurement
+    for svc in services:
+        browser.listener.oscjson_services[svc.name] = svc
+    for label in ["concurrent (cold)", "concurrent (warm)"]:
+        start = time.perf_counter()
+        assert browser.find_service_by_name(name) is not None
+        print(f"  {label:<17} {(time.perf_counter() - start) * 1000:>7.1f}ms")
+    start = time.perf_counter()
+    assert len(browser.find_nodes_by_endpoint_address("/avatar/change")) == args.services
+    print(f"  find_nodes_by_endpoint_address {(time.perf_counter() - start) * 1000:.1f}ms")
+    browser.close()
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def run_listen(args):
+    # stand-in peer: the endpoints of an app, one of them changes at the given rate
+    paths = make_paths(args.listen_paths, seed=1)
+    root = OSCQueryNode("/", description="root node")
+    for path in paths:
+        root.add_child_node(OSCQueryNode(path, access=OSCAccess.READWRITE_VALUE, value=[0.0], type_=[float]))
+    server = OSCQueryHTTPServer(root, OSCHostInfo("peer", {"LISTEN": True}), ("127.0.0.1", 0), QuietOSCQueryHTTPHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = OSCQueryClient(ServiceInfo("_oscjson._tcp.local.", "peer._oscjson._tcp.local.", port=server.server_address[1], addresses=[socket.inet_aton("127.0.0.1")]))
+    print(f"LISTEN: {len(paths)} subscribed nodes, {args.change_rate:.0f} changes/s for {args.seconds:.0f}s")
+
+    modes = [("listen", 0, True)] + [(f"poll {interval * 1000:.0f}ms", interval, False) for interval in args.poll_intervals]
+    for name, interval, listen in [("no subscriber", 0, None)] + modes:
+        latencies = []
+        # the changed value is the time of the change
+        callback = lambda address, values: latencies.append(time.perf_counter() - values[0])
+        subscription = client.subscribe(paths, callback, poll_interval=interval, listen=listen) if listen is not None else None
+        time.sleep(0.2)
+        changes = int(args.seconds * args.change_rate)
+        cpu = time.process_time()
+        start = time.perf_counter()
+        for i in range(changes):
+            time.sleep(max(0.0, start + i / args.change_rate - time.perf_counter()))
+            root.find_subnode(paths[i % len(paths)]).set_value(time.perf_counter())
+        time.sleep(max(interval, 0.05))
+        cpu = (time.process_time() - cpu) / (time.perf_counter() - start)
+        if subscription is not None:
+            subscription.close()
+        if latencies:
+            latencies.sort()
+            print(f"  {name:<14} notified {len(latencies):>5}/{changes}, latency p50 {latencies[len(latencies) // 2] * 1000:>7.2f}ms"
+                  f" p99 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:>7.2f}ms, CPU {cpu * 100:5.1f}%")
+        else:
+            print(f"  {name:<14} CPU {cpu * 100:5.1f}%")
+    server.shutdown()
+    server.server_close()
+
+
+def legacy_node_from_json(json):
+    # recursive and eager, as OSCQueryClient._make_node_from_json did before node_from_json()
+    newNode = OSCQueryNode()
+    if "CONTENTS" in json:
+        newNode.contents = [legacy_node_from_json(json["CONTENTS"][subNode]) for subNode in json["CONTENTS"]]
+    if "FULL_PATH" in json:
+        newNode.full_path = json["FULL_PATH"]
+    if "TYPE" in json:
+        newNode.type_ = OSC_Type_String_to_Python_Type(json["TYPE"])
+    if "ACCESS" in json:
+        newNode.access = OSCAccess(json["ACCESS"])
+    if "VALUE" in json:
+        newNode.value = [newNode.type_[idx](v) for idx, v in enumerate(json["VALUE"])]
+    return newNode
+
+
+def measure(function):
+    """
+    Returns the duration of function() and the memory still allocated by its result (in a second, traced run).
+    """
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = function()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return elapsed, retained
+
+
+def run_parse(args):
+    paths = make_paths(args.parse_nodes)
+    root, _ = bench_build(paths, OSCQueryNode.add_child_node)
+    document = root.to_json()
+    # the same tree after an avatar change: some values changed, some parameters removed and added
+    rng = random.Random(2)
+    changes = max(1, len(paths) // 100)
+    for path in rng.sample(paths, changes):
+        root.find_subnode(path).set_value(1.0)
+    for path in rng.sample(paths, changes):
+        root.remove_child_node(path)
+    for i in range(changes):
+        root.add_child_node(OSCQueryNode(f"/avatar/parameters/Added/{i}", access=OSCAccess.READWRITE_VALUE, value=[0.0], type_=[float]))
+    changed_document = root.to_json()
+    total = sum(1 for _ in root)
+    lookup = paths[len(paths) // 2]
+    print(f"Parse: {total} nodes, {len(document) / 1e6:.1f}MB JSON")
+
+    def legacy():
+        # the document was kept as last_json
+        data = json.loads(document)
+        return legacy_node_from_json(data), data
+
+    def lazy_lookup():
+        node = node_from_json(json.loads(document))
+        node.find_subnode(lookup)
+        return node
+
+    def lazy_all():
+        node = node_from_json(json.loads(document))
+        sum(1 for _ in node)
+        return node
+
+    loads, _ = measure(lambda: json.loads(document))
+    print(f"  json.loads          {loads * 1000:>7.1f}ms (part of all below)")
+    for name, function in [
+        ("recursive", legacy),
+        ("iterative", lambda: node_from_json(json.loads(document), lazy=False)),
+        ("lazy + 1 lookup", lazy_lookup),
+        ("lazy + all nodes", lazy_all),
+    ]:
+        elapsed, retained = measure(function)
+        print(f"  {name:<19} {elapsed * 1000:>7.1f}ms, {retained / 1e6:>6.1f}MB retained")
+
+    old_data = json.loads(document)
+    new_data = json.loads(changed_document)
+    for lazy in [False, True]:
+        start = time.perf_counter()
+        old = node_from_json(old_data, lazy)
+        new = node_from_json(new_data, lazy)
+        parsed = time.perf_counter()
+        diff = diff_nodes(old, new)
+        end = time.perf_counter()
+        print(f"  {'lazy' if lazy else 'iterative'} parse + diff {(end - start) * 1000:>7.1f}ms (diff {(end - parsed) * 1000:.1f}ms):"
+              f" {len(diff.added)} added, {len(diff.removed)} removed, {len(diff.changed)} changed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of OSCQueryNode tree building and lookups.")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1000, 10000, 50000], help="Endpoint counts.")
+    parser.add_argument("--lookups", type=int, default=20000, help="Lookups per tree.")
+    parser.add_argument("--legacy-max", type=int, default=10000, help="Largest tree also measured with the recursive search (quadratic build time).")
+    parser.add_argument("--http", action="store_true", help="Load test the OSCQuery HTTP server instead.")
+    parser.add_argument("--http-nodes", type=int, default=2000, help="Endpoints served by the HTTP load test.")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent HTTP clients.")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per HTTP client.")
+    parser.add_argument("--discovery", action="store_true", help="Measure finding a service among several OSCQuery services instead.")
+    parser.add_argument("--services", type=int, default=6, help="OSCQuery services of the discovery benchmark.")
+    parser.add_argument("--listen", action="store_true", help="Measure change-to-notify latency and CPU of LISTEN against polling instead.")
+    parser.add_argument("--listen-paths", type=int, default=20, help="Subscribed nodes of the LISTEN benchmark.")
+    parser.add_argument("--change-rate", type=float, default=20, help="Value changes per second of the LISTEN benchmark.")
+    parser.add_argument("--poll-intervals", type=float, nargs="+", default=[0.01, 0.1, 1.0], help="Poll intervals in seconds compared with LISTEN.")
+    parser.add_argument("--seconds", type=float, default=5, help="Duration of each LISTEN benchmark run.")
+    parser.add_argument("--parse", action="store_true", help="Measure parsing and diffing of OSCQuery JSON instead.")
+    parser.add_argument("--parse-nodes", type=int, default=20000, help="Endpoints of the parse benchmark.")
+    parser.add_argument("--rtt", type=float, default=50, help="Simulated round trip in milliseconds of the discovery benchmark.")
+    args = parser.parse_args()
+
+    if args.http:
+        run_http(args)
+        raise SystemExit
+    if args.discovery:
+        run_discovery(args)
+        raise SystemExit
+    if args.listen:
+        run_listen(args)
+        raise SystemExit
+    if args.parse:
+        run_parse(args)
+        raise SystemExit
+
+    for count in args.nodes:
+        paths = make_paths(count)
+        root, build = bench_build(paths, OSCQueryNode.add_child_node)
+        lookup = bench_lookup(root, paths, OSCQueryNode.find_subnode, args.lookups)
+        total = sum(1 for _ in root)
+        remove = bench_remove(root, paths[:1000])
+        print(f"{count} endpoints ({total} nodes): build {build * 1000:.1f}ms ({build / count * 1e6:.2f}us/node), lookup {lookup * 1e6:.2f}us, remove {remove * 1e6:.2f}us")
+        if count <= args.legacy_max:
+            legacy_root, legacy_build = bench_build(paths, legacy_add_child_node)
+            legacy_lookup = bench_lookup(legacy_root, paths, legacy_find_subnode, min(args.lookups, 200))
+            print(f"  recursive search: build {legacy_build * 1000:.1f}ms ({legacy_build / count * 1e6:.2f}us/node), lookup {legacy_lookup * 1e6:.2f}us"
+                  f" -> {legacy_build / build:.0f}x / {legacy_lookup / lookup:.0f}x faster")
@@ -1,76 +1,185 @@
+import json
+import socket
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Event, Lock, Thread
 from zeroconf import ServiceBrowser, ServiceInfo, ServiceListener, Zeroconf
+from pythonosc import osc_packet
 import requests
 
-from .shared.node import OSCQueryNode, OSC_Type_String_to_Python_Type, OSCAccess, OSCHostInfo
+from .shared.node import OSCQueryNode, OSCHostInfo, node_from_json
+from . import websocket
 
 class OSCQueryListener(ServiceListener):
+    """
+    Keeps the discovered OSC and OSCQuery services by name.
 
-    def __init__(self) -> None:
+    callback(event, type_, name, service_info) is called with event "added", "updated" or "removed"
+    (service_info None) on the zeroconf thread after a change.
+    """
+
+    def __init__(self, callback=None) -> None:
         self.osc_services = {}
         self.oscjson_services = {}
+        self.callback = callback
 
         super().__init__()
 
-    def remove_service(self, zc: 'Zeroconf', type_: str, name: str) -> None:
-        if name in self.osc_services:
-            del self.osc_services[name]
+    def _get_services(self, type_):
+        if type_ == '_osc._udp.local.':
+            return self.osc_services
+        elif type_ == '_oscjson._tcp.local.':
+            return self.oscjson_services
+        return None
+
+    def _notify(self, event, type_, name, info):
+        if self.callback is not None:
+            self.callback(event, type_, name, info)
 
-        if name in self.oscjson_services:
-            del self.oscjson_services[name]
+    def remove_service(self, zc: 'Zeroconf', type_: str, name: str) -> None:
+        services = self._get_services(type_)
+        if services is not None and services.pop(name, None) is not None:
+            self._notify("removed", type_, name, None)
 
     def add_service(self, zc: 'Zeroconf', type_: str, name: str) -> None:
-        if type_ == '_osc._udp.local.':
-            self.osc_services[name] = zc.get_service_info(type_, name)
-        elif type_ == '_oscjson._tcp.local.':
-            self.oscjson_services[name] = zc.get_service_info(type_, name)
+        self._resolve_service(zc, type_, name, "added")
 
     def update_service(self, zc: 'Zeroconf', type_: str, name: str) -> None:
-        if type_ == '_osc._udp.local.':
-            self.osc_services[name] = zc.get_service_info(type_, name)
-        elif type_ == '_oscjson._tcp.local.':
-            self.oscjson_services[name] = zc.get_service_info(type_, name)
+        self._resolve_service(zc, type_, name, "updated")
+
+    def _resolve_service(self, zc, type_, name, event):
+        services = self._get_services(type_)
+        if services is None:
+            return
+        info = zc.get_service_info(type_, name)
+        # services that couldn't be resolved (yet) are left out, they are announced again
+        if info is None or not info.addresses:
+            return
+        services[name] = info
+        self._notify(event, type_, name, info)
 
 
 class OSCQueryBrowser(object):
-    def __init__(self) -> None:
-        self.listener = OSCQueryListener()
+    """
+    Discovers OSC and OSCQuery services. Keeps one OSCQueryClient per OSCQuery service, so connections
+    and host info are reused, and queries all services concurrently.
+
+    Meant to be long-lived: add_callback() registers for services being announced, changed or removed.
+    """
+
+    def __init__(self, max_workers=8) -> None:
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="OSCQueryBrowser")
+        self._clients = {}
+        self._clients_lock = Lock()
+        self._callbacks = []
+        self._callbacks_lock = Lock()
+        self.listener = OSCQueryListener(self._on_service_change)
         self.zc = Zeroconf()
         self.browser = ServiceBrowser(self.zc, ["_oscjson._tcp.local.", "_osc._udp.local."], self.listener)
 
+    def add_callback(self, callback):
+        """
+        Registers callback(event, type_, name, service_info), see OSCQueryListener. It's called on the
+        zeroconf thread and must not block, use submit() for queries. Services discovered before are
+        passed as "added" right away.
+        """
+        with self._callbacks_lock:
+            self._callbacks.append(callback)
+            for type_, services in [("_oscjson._tcp.local.", self.listener.oscjson_services), ("_osc._udp.local.", self.listener.osc_services)]:
+                for name, info in list(services.items()):
+                    callback("added", type_, name, info)
+
+    def remove_callback(self, callback):
+        with self._callbacks_lock:
+            self._callbacks.remove(callback)
+
+    def _on_service_change(self, event, type_, name, info):
+        if type_ == "_oscjson._tcp.local." and event == "removed":
+            with self._clients_lock:
+                client = self._clients.pop(name, None)
+            if client is not None:
+                client.close()
+        with self._callbacks_lock:
+            for callback in self._callbacks:
+                callback(event, type_, name, info)
+
+    def submit(self, fn, *args):
+        """
+        Runs fn(*args) on the query thread pool of the browser.
+        """
+        return self._executor.submit(fn, *args)
+
     def get_discovered_osc(self):
         return [oscsvc[1] for oscsvc in self.listener.osc_services.items()]
 
     def get_discovered_oscquery(self):
         return [oscjssvc[1] for oscjssvc in self.listener.oscjson_services.items()]
 
+    def get_client(self, svc):
+        """
+        Returns the client of a discovered service, a new one if the service changed since the last call.
+        """
+        with self._clients_lock:
+            client = self._clients.get(svc.name)
+            if client is None or client.service_info is not svc:
+                if client is not None:
+                    client.close()
+                client = self._clients[svc.name] = OSCQueryClient(svc)
+            return client
+
+    def _query_services(self, query):
+        # calls query(svc, client) for all discovered services at once, yields (svc, result) as they complete
+        futures = {self._executor.submit(query, svc, self.get_client(svc)): svc for svc in self.get_discovered_oscquery()}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    def get_host_infos(self) -> list[tuple[ServiceInfo, OSCHostInfo]]:
+        """
+        Returns the host info of all discovered services that answered, in order of their answers.
+        """
+        return [(svc, hi) for svc, hi in self._query_services(lambda svc, client: client.get_host_info()) if hi is not None]
+
     def find_service_by_name(self, name):
-        for svc in self.get_discovered_oscquery():
-            client = OSCQueryClient(svc)
-            host_info = client.get_host_info()
-            if host_info is None:
-                continue
-            if name in host_info.name:
+        for svc, host_info in self._query_services(lambda svc, client: client.get_host_info()):
+            if host_info is not None and name in host_info.name:
                 return svc
 
         return None
 
     def find_nodes_by_endpoint_address(self, address) -> list[tuple[ServiceInfo, OSCHostInfo, OSCQueryNode]]:
-        svcs = []
-        for svc in self.get_discovered_oscquery():
-            client = OSCQueryClient(svc)
+        def query(svc, client):
             hi = client.get_host_info()
             if hi is None:
-                continue
+                return None
             node = client.query_node(address)
-            if node is not None:
-                svcs.append((svc, hi, node))
+            if node is None:
+                return None
+            return (svc, hi, node)
 
-        return svcs
+        return [result for svc, result in self._query_services(query) if result is not None]
+
+    def close(self):
+        self.browser.cancel()
+        self._executor.shutdown(wait=False)
+        with self._clients_lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+        self.zc.close()
 
 
 class OSCQueryClient(object):
-    def __init__(self, service_info) -> None:
+    """
+    Queries an OSCQuery service over a keep-alive connection. Use shared.node.diff_nodes() to compare two
+    results of query_node().
+
+    Requests time out after timeout seconds (connect, read). Host info is cached, use
+    get_host_info(refresh=True) to query it again.
+    """
+
+    DEFAULT_TIMEOUT = (1.0, 3.0)
+
+    def __init__(self, service_info, timeout=DEFAULT_TIMEOUT) -> None:
         if not isinstance(service_info, ServiceInfo):
             raise Exception("service_info isn't a ServiceInfo class!")
 
@@ -78,7 +187,12 @@ class OSCQueryClient(object):
             raise Exception("service_info does not represent an OSCQuery service!")
 
         self.service_info = service_info
-        self.last_json = None
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._host_info = None
+
+    def close(self):
+        self.session.close()
 
     def _get_query_root(self):
         return f"http://{self._get_ip_str()}:{self.service_info.port}"
@@ -87,11 +201,15 @@ class OSCQueryClient(object):
         ip_str = '.'.join([str(int(num)) for num in self.service_info.addresses[0]])
         return ip_str
 
-    def query_node(self, node="/"):
+    def query_node(self, node="/", lazy=True):
+        """
+        Queries a node, returns None if it doesn't exist. The children of the returned node are built
+        on first access unless lazy is False, see node_from_json().
+        """
         url = self._get_query_root() + node
         r = None
         try:
-            r = requests.get(url)
+            r = self.session.get(url, timeout=self.timeout)
         except Exception as ex:
             print("Error querying node...", ex)
         if r is None:
@@ -103,16 +221,17 @@ class OSCQueryClient(object):
         if r.status_code != 200:
             raise Exception("Node query error: (HTTP", r.status_code, ") ", r.content)
 
-        self.last_json = r.json()
+        return node_from_json(r.json(), lazy)
 
-        return self._make_node_from_json(self.last_json)
 
+    def get_host_info(self, refresh=False):
+        if self._host_info is not None and not refresh:
+            return self._host_info
 
-    def get_host_info(self):
         url = self._get_query_root() + "/HOST_INFO"
         r = None
         try:
-            r = requests.get(url)
+            r = self.session.get(url, timeout=self.timeout)
         except Exception as ex:
             #print("Error querying HOST_INFO...", ex)
             pass
@@ -139,49 +258,135 @@ class OSCQueryClient(object):
         else:
             hi.osc_transport = "UDP"
 
-        return hi
-
-    def _make_node_from_json(self, json):
-        newNode = OSCQueryNode()
-
-        if "CONTENTS" in json:
-            subNodes = []
-            for subNode in json["CONTENTS"]:
-                subNodes.append(self._make_node_from_json(json["CONTENTS"][subNode]))
-            newNode.contents = subNodes
+        # the WebSocket is served by the HTTP server unless stated otherwise
+        hi.ws_ip = json.get('WS_IP', self._get_ip_str())
+        hi.ws_port = json.get('WS_PORT', self.service_info.port)
 
-        # This *should* be required but some implementations don't have it...
-        if "FULL_PATH" in json:
-            newNode.full_path = json["FULL_PATH"]
-
-        if "TYPE" in json:
-            newNode.type_ = OSC_Type_String_to_Python_Type(json["TYPE"])
+        self._host_info = hi
+        return hi
 
-        if "DESCRIPTION" in json:
-            newNode.description = json["DESCRIPTION"]
+    def subscribe(self, addresses, callback, poll_interval=1.0, listen=True):
+        """
+        Calls callback(address, values) when the value of one of the nodes changes, see OSCQuerySubscription.
+        """
+        return OSCQuerySubscription(self, addresses, callback, poll_interval, listen)
 
-        if "ACCESS" in json:
-            newNode.access = OSCAccess(json["ACCESS"])
 
-        if "VALUE" in json:
-            newNode.value = []
-            # This should always be an array... throw an exception here?
-            if not isinstance(json['VALUE'], list):
-                raise Exception("OSCQuery JSON Value is not List / Array? Out-of-spec?")
-            
-            for idx, v in enumerate(json["VALUE"]):
-                # According to the spec, if there is not yet a value, the return will be an empty JSON object
-                if isinstance(v, dict) and not v:
-                    # FIXME does this apply to all values in the value array always...? I assume it does here
-                    newNode.value = []
-                    break
-                else:
-                    newNode.value.append(newNode.type_[idx](v))
+class OSCQuerySubscription(object):
+    """
+    Notifies about value changes of nodes of an OSCQuery service.
 
+    Uses the LISTEN extension (values pushed over a WebSocket) if the service supports it, otherwise
+    or after the WebSocket broke the nodes are polled every poll_interval seconds with conditional
+    requests (always with listen=False). callback(address, values) is called on the subscription
+    thread for changes only, not for the values at the time of subscribing.
+    """
 
-        return newNode
+    def __init__(self, client, addresses, callback, poll_interval=1.0, listen=True) -> None:
+        self.client = client
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.addresses = set(addresses)
+        self.websocket = None
+        self._stopped = Event()
 
+        host_info = client.get_host_info()
+        if listen and host_info is not None and host_info.extensions.get("LISTEN"):
+            try:
+                self.websocket = websocket.connect(host_info.ws_ip, host_info.ws_port, timeout=client.timeout[0])
+            except (ConnectionError, OSError) as ex:
+                print("Error connecting to LISTEN WebSocket, polling instead...", ex)
+        if self.websocket is not None:
+            for address in list(self.addresses):
+                self._send_command("LISTEN", address)
+        self.thread = Thread(target=self._run, name="OSCQuerySubscription", daemon=True)
+        self.thread.start()
+
+    @property
+    def polling(self):
+        return self.websocket is None
+
+    def _send_command(self, command, address):
+        ws = self.websocket
+        if ws is None:
+            return
+        try:
+            ws.send_text(json.dumps({"COMMAND": command, "DATA": address}))
+        except OSError:
+            pass
 
+    def listen(self, address):
+        self.addresses.add(address)
+        self._send_command("LISTEN", address)
+
+    def ignore(self, address):
+        self.addresses.discard(address)
+        self._send_command("IGNORE", address)
+
+    def _run(self):
+        if self.websocket is not None:
+            self._receive()
+        if not self._stopped.is_set():
+            self._poll()
+
+    def _receive(self):
+        ws = self.websocket
+        while not self._stopped.is_set():
+            try:
+                opcode, payload = ws.recv()
+            except (ConnectionError, OSError):
+                break
+            if opcode == websocket.OP_CLOSE:
+                break
+            if opcode != websocket.OP_BINARY:
+                continue
+            try:
+                messages = osc_packet.OscPacket(payload).messages
+            except osc_packet.ParseError:
+                continue
+            for timed_message in messages:
+                message = timed_message.message
+                if message.address in self.addresses:
+                    self.callback(message.address, message.params)
+        self.websocket = None
+        ws.sock.close()
+
+    def _poll(self):
+        etags = {}
+        values = {}
+        while True:
+            for address in list(self.addresses):
+                headers = {"If-None-Match": etags[address]} if address in etags else {}
+                try:
+                    r = self.client.session.get(self.client._get_query_root() + address, headers=headers, timeout=self.client.timeout)
+                except Exception:
+                    continue
+                if r.status_code != 200:
+                    continue
+                # also for broken nodes, so they are only reported again after they changed
+                if "ETag" in r.headers:
+                    etags[address] = r.headers["ETag"]
+                try:
+                    value = node_from_json(r.json()).value
+                except Exception as ex:
+                    # a broken node must not end the subscription of the others
+                    print("Error parsing node", address, ex)
+                    continue
+                if address in values and value != values[address]:
+                    self.callback(address, value)
+                values[address] = value
+            if self._stopped.wait(self.poll_interval):
+                return
+
+    def close(self):
+        self._stopped.set()
+        ws = self.websocket
+        if ws is not None:
+            ws.close()
+            try:
+                ws.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
 
 
 if __name__ == "__main__":
@@ -1,7 +1,10 @@
+import queue
 import socket
 from zeroconf import ServiceInfo, Zeroconf
-from http.server import SimpleHTTPRequestHandler, HTTPServer
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pythonosc.osc_message_builder import OscMessageBuilder
 from .shared.node import OSCQueryNode, OSCHostInfo, OSCAccess
+from . import websocket
 import json, threading
 
 
@@ -26,15 +29,16 @@ class OSCQueryService(object):
         self.oscIp = oscIp
 
         self.root_node = OSCQueryNode("/", description="root node")
-        self.host_info = OSCHostInfo(serverName, {"ACCESS":True,"CLIPMODE":False,"RANGE":True,"TYPE":True,"VALUE":True}, 
+        self.host_info = OSCHostInfo(serverName, {"ACCESS":True,"CLIPMODE":False,"RANGE":True,"TYPE":True,"VALUE":True,"LISTEN":True}, 
             self.oscIp, self.oscPort, "UDP")
 
-        self._zeroconf = Zeroconf()
-        self._startOSCQueryService()
-        self._advertiseOSCService()
+        # serve before advertising, so browsers reacting to the announcement get an answer
         self.http_server = OSCQueryHTTPServer(self.root_node, self.host_info, ('', self.httpPort), OSCQueryHTTPHandler)
         self.http_thread = threading.Thread(target=self._startHTTPServer, daemon=True)
         self.http_thread.start()
+        self._zeroconf = Zeroconf()
+        self._startOSCQueryService()
+        self._advertiseOSCService()
 
     def __del__(self):
         self._zeroconf.unregister_all_services()
@@ -42,8 +46,37 @@ class OSCQueryService(object):
     def add_node(self, node):
         self.root_node.add_child_node(node)
 
-    def advertise_endpoint(self, address, value=None, access=OSCAccess.READWRITE_VALUE):
+    def remove_node(self, address):
+        return self.root_node.remove_child_node(address)
+
+    def set_value(self, address, value):
+        """
+        Updates the value of an advertised endpoint, returns False if it isn't advertised.
+        """
+        node = self.root_node.find_subnode(address)
+        if node is None:
+            return False
+        if node.value != [value]:
+            node.set_value(value)
+        return True
+
+    def add_route(self, path, callback):
+        """
+        Serves additional (non OSC) content from the oscjson http server.
+
+        Parameters
+        ----------
+        path : str
+            HTTP path, e.g. "/metrics"
+        callback : callable
+            Called on every request, returns a (content type, body bytes) tuple
+        """
+        self.http_server.routes[path] = callback
+
+    def advertise_endpoint(self, address, value=None, access=OSCAccess.READWRITE_VALUE, type_=None):
         new_node = OSCQueryNode(full_path=address, access=access)
+        if value is None and type_ is not None:
+            new_node.type_ = [type_]
         if value is not None:
             if not isinstance(value, list):
                 new_node.value = [value]
@@ -71,32 +104,177 @@ class OSCQueryService(object):
         self._zeroconf.register_service(oscInfo)
 
 
-class OSCQueryHTTPServer(HTTPServer):
+class OSCQueryListeners(object):
+    """
+    LISTEN extension: pushes the values of nodes to the WebSockets listening to them, as OSC messages.
+
+    Value changes are queued and sent by a background thread, so assigning values never waits for
+    the network. A node changed several times before it's sent is only sent once, with its latest value.
+    """
+
+    def __init__(self, root_node) -> None:
+        self._paths = {}
+        self._lock = threading.Lock()
+        self._queue = queue.SimpleQueue()
+        self._queued = set()
+        self._thread = threading.Thread(target=self._run, name="OSCQueryListeners", daemon=True)
+        self._thread.start()
+        root_node.set_value_callback(self._on_value_change)
+
+    def add(self, ws):
+        with self._lock:
+            self._paths[ws] = set()
+
+    def remove(self, ws):
+        with self._lock:
+            self._paths.pop(ws, None)
+
+    def command(self, ws, message):
+        """
+        Handles a {"COMMAND": "LISTEN" or "IGNORE", "DATA": path} message, other commands are ignored.
+        """
+        try:
+            command = json.loads(message)
+            name = command["COMMAND"]
+            path = command["DATA"]
+        except (ValueError, KeyError, TypeError):
+            return
+        with self._lock:
+            paths = self._paths.get(ws)
+            if paths is None or not isinstance(path, str):
+                return
+            if name == "LISTEN":
+                paths.add(path)
+            elif name == "IGNORE":
+                paths.discard(path)
+
+    def _on_value_change(self, node):
+        if not self._paths or node in self._queued:
+            return
+        self._queued.add(node)
+        self._queue.put(node)
+
+    def _run(self):
+        while True:
+            node = self._queue.get()
+            self._queued.discard(node)
+            with self._lock:
+                listeners = [ws for ws, paths in self._paths.items() if node.full_path in paths]
+            if not listeners or not node.value:
+                continue
+            try:
+                dgram = encode_osc_message(node)
+            except Exception:
+                continue
+            for ws in listeners:
+                try:
+                    ws.send_binary(dgram)
+                except OSError:
+                    self.remove(ws)
+
+
+def encode_osc_message(node):
+    """
+    Encodes the value of a node as OSC message, values are cast to the types of the node.
+    """
+    builder = OscMessageBuilder(node.full_path)
+    types = node.type_ or []
+    for i, value in enumerate(node.value):
+        builder.add_arg(types[i](value) if i < len(types) else value)
+    return builder.build().dgram
+
+
+class OSCQueryHTTPServer(ThreadingHTTPServer):
+    """
+    Serves every connection on its own thread, so a slow client doesn't block others.
+    """
+
+    daemon_threads = True
+
     def __init__(self, root_node, host_info, server_address: tuple[str, int], RequestHandlerClass, bind_and_activate: bool = ...) -> None:
         super().__init__(server_address, RequestHandlerClass, bind_and_activate)
         self.root_node = root_node
         self.host_info = host_info
+        self.routes = {}
+        self.listeners = OSCQueryListeners(root_node)
 
 
 class OSCQueryHTTPHandler(SimpleHTTPRequestHandler):
+    """
+    Answers with the cached JSON of nodes and host info. Supports keep-alive connections
+    and conditional requests (ETag / If-None-Match).
+    """
+
+    protocol_version = "HTTP/1.1"
+    # close idle keep-alive connections after this many seconds
+    timeout = 30
+    # headers and body are written separately, with Nagle's algorithm the body waits for the delayed ACK
+    disable_nagle_algorithm = True
+
     def do_GET(self) -> None:
+        if self.headers.get("Upgrade", "").lower() == "websocket":
+            self._handle_websocket()
+            return
+        route = self.server.routes.get(self.path.split("?", 1)[0])
+        if route is not None:
+            content_type, body = route()
+            self._send(200, content_type, body)
+            return
         if 'HOST_INFO' in self.path:
-            self.send_response(200)
-            self.send_header("Content-type", "text/json")
-            self.end_headers()
-            self.wfile.write(bytes(str(self.server.host_info.to_json()), 'utf-8'))
+            body, etag = self.server.host_info.to_json_bytes()
+            self._send(200, "text/json", body, etag)
             return
         node = self.server.root_node.find_subnode(self.path)
         if node is None:
-            self.send_response(404)
-            self.send_header("Content-type", "text/json")
-            self.end_headers()
-            self.wfile.write(bytes("OSC Path not found", 'utf-8'))
+            self._send(404, "text/json", bytes("OSC Path not found", 'utf-8'))
         else:
-            self.send_response(200)
-            self.send_header("Content-type", "text/json")
+            body, etag = node.to_json_bytes()
+            self._send(200, "text/json", body, etag)
+
+    def _send(self, status, content_type, body, etag=None):
+        if etag is not None and etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
             self.end_headers()
-            self.wfile.write(bytes(str(node.to_json()), 'utf-8'))
+            return
+        self.send_response(status)
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle_websocket(self):
+        key = self.headers.get("Sec-WebSocket-Key")
+        if key is None or self.headers.get("Sec-WebSocket-Version") != "13":
+            self.send_response(400)
+            self.send_header("Sec-WebSocket-Version", "13")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", websocket.accept_key(key))
+        self.end_headers()
+        self.close_connection = True
+        # listening connections stay open without requests
+        self.connection.settimeout(None)
+        ws = websocket.WebSocket(self.connection, self.rfile)
+        listeners = self.server.listeners
+        listeners.add(ws)
+        try:
+            while True:
+                opcode, payload = ws.recv()
+                if opcode == websocket.OP_CLOSE:
+                    break
+                if opcode == websocket.OP_TEXT:
+                    listeners.command(ws, payload.decode("utf-8", "replace"))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            listeners.remove(ws)
 
     def log_message(self, format, *args):
         pass
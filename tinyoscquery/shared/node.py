@@ -1,30 +1,24 @@
 from enum import IntEnum
 import json
+import threading
+import zlib
 from json import JSONEncoder
 
+# guards the serialized JSON caches of all nodes, so a cache filled concurrently to a change isn't kept
+_json_cache_lock = threading.Lock()
+# guards building and changing the path indexes, lookups in a complete index don't need it
+_index_lock = threading.RLock()
+
 class OSCNodeEncoder(JSONEncoder):
     def default(self, o):
         if isinstance(o, OSCQueryNode):
             obj_dict = {}
-            for k, v in vars(o).items():
-                if v is None:
-                    continue
-                if k.lower() == "type_":
-                    obj_dict["TYPE"] = Python_Type_List_to_OSC_Type(v)
-                if k == "contents":
-                    obj_dict["CONTENTS"] = {}
-                    for subNode in v:
-                        if subNode.full_path is not None:
-                            obj_dict["CONTENTS"][subNode.full_path.split("/")[-1]] = subNode
-                        else:
-                            continue
-                else:
-                    obj_dict[k.upper()] = v
-
-            # FIXME: I missed something, so here's a hack!
-
-            if "TYPE_" in obj_dict:
-                del obj_dict["TYPE_"]
+            if o.contents is not None:
+                obj_dict["CONTENTS"] = {}
+                for subNode in o.contents:
+                    if subNode.full_path is not None:
+                        obj_dict["CONTENTS"][subNode.full_path.split("/")[-1]] = subNode
+            obj_dict.update(o._attributes())
             return obj_dict
 
         if isinstance(o, type):
@@ -33,7 +27,7 @@ class OSCNodeEncoder(JSONEncoder):
         if isinstance(o, OSCHostInfo):
             obj_dict = {}
             for k, v in vars(o).items():
-                if v is None:
+                if v is None or k.startswith("_"):
                     continue
                 obj_dict[k.upper()] = v
             return obj_dict
@@ -47,31 +41,127 @@ class OSCAccess(IntEnum):
     READWRITE_VALUE = 3
 
 class OSCQueryNode():
+    """
+    A node of an OSCQuery tree.
+
+    The topmost node of a tree keeps an index of all nodes by full path, so find_subnode() and
+    add_child_node() only take O(depth). The index is kept up to date by add_child_node(),
+    remove_child_node() and by assigning contents. Changing the full_path of a node in a tree or
+    modifying a contents list in place isn't tracked.
+
+    Every node caches its serialized JSON, assigning an attribute (e.g. with set_value()) clears
+    the cache of the node and all its parents. Lists (like value) changed in place aren't tracked.
+    Assigning a value also calls the value callback of the topmost node, see set_value_callback().
+    """
+
     def __init__(self, full_path=None, contents=None, type_=None, access=None, description=None, value=None, host_info=None):
+        # nobody else knows the node yet, nothing to invalidate or notify (order of the public attributes is the order in the JSON)
+        vars(self).update(
+            # (json, utf-8 encoded json, etag) or None
+            _json=None,
+            _json_version=0,
+            _parent=None,
+            _value_callback=None,
+            # full path -> node of the whole tree, only used on the topmost node, built on first lookup
+            _index=None,
+            _index_has_duplicates=False,
+            full_path=full_path,
+            access=access,
+            type_=type_,
+            # Value is always an array!
+            value=value,
+            description=description,
+            host_info=host_info,
+        )
         self.contents = contents
-        self.full_path = full_path
-        self.access = access
-        self.type_ = type_
-        # Value is always an array!
-        self.value = value
-        self.description = description
-        self.host_info = host_info
 
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if not name.startswith("_"):
+            self._invalidate_json()
+            if name == "value":
+                callback = self._get_root()._value_callback
+                if callback is not None:
+                    callback(self)
+
+    def set_value_callback(self, callback):
+        """
+        Calls callback(node) after the value of any node of this tree was assigned, on the assigning thread.
+        Only the callback of the topmost node is used.
+        """
+        self._value_callback = callback
+
+    def _invalidate_json(self):
+        with _json_cache_lock:
+            node = self
+            while node is not None:
+                node._json = None
+                node._json_version += 1
+                node = node._parent
+
+    def set_value(self, value):
+        """
+        Sets the value of the node, single values are wrapped in a list.
+        """
+        self.value = value if isinstance(value, list) else [value]
+
+    @property
+    def contents(self):
+        return self._contents
+
+    @contents.setter
+    def contents(self, contents):
+        with _index_lock:
+            self._contents = contents
+            if contents is not None:
+                for subNode in contents:
+                    subNode._parent = self
+                    subNode._index = None
+            self._get_root()._index = None
+
+    def _get_root(self):
+        node = self
+        while node._parent is not None:
+            node = node._parent
+        return node
+
+    def _get_index(self):
+        index = self._index
+        if index is None:
+            with _index_lock:
+                index = self._index
+                if index is None:
+                    # other threads only ever see a complete index
+                    index = {}
+                    self._index_has_duplicates = False
+                    for node in self:
+                        self._add_to_index(index, node)
+                    self._index = index
+        return index
+
+    def _add_to_index(self, index, node):
+        if node.full_path is None:
+            return
+        # like a depth first search, the first node with a path wins
+        if index.setdefault(node.full_path, node) is not node:
+            self._index_has_duplicates = True
+
+    def _is_ancestor_of(self, node):
+        while node is not None:
+            if node is self:
+                return True
+            node = node._parent
+        return False
+
     def find_subnode(self, full_path):
         if self.full_path == full_path:
             return self
 
-        foundNode = None
-        if self.contents is None:
-            return None
-        
-        for subNode in self.contents:
-            foundNode = subNode.find_subnode(full_path)
-            if foundNode is not None:
-                break
-
-        return foundNode
+        foundNode = self._get_root()._get_index().get(full_path)
+        if foundNode is None or self._parent is None or self._is_ancestor_of(foundNode):
+            return foundNode
+        return None
 
     def add_child_node(self, child):
         if child == self:
@@ -86,20 +176,104 @@ class OSCQueryNode():
         if parent_path == '':
             parent_path = "/"
 
-        parent = self.find_subnode(parent_path)
+        with _index_lock:
+            parent = self.find_subnode(parent_path)
 
-        if parent is None:
-            parent = OSCQueryNode(parent_path)
-            self.add_child_node(parent)
+            if parent is None:
+                parent = OSCQueryNode(parent_path)
+                self.add_child_node(parent)
+                
             
-        
-        if parent.contents is None:
-            parent.contents = []
-        parent.contents.append(child)
+            if parent._contents is None:
+                parent._contents = []
+            parent._contents.append(child)
+            child._parent = parent
+            child._index = None
+            parent._invalidate_json()
+
+            root = self._get_root()
+            if root._index is not None:
+                for node in child:
+                    root._add_to_index(root._index, node)
+
+    def remove_child_node(self, child):
+        """
+        Removes a node (given by node or full path) and all its children from the tree.
+
+        Returns the removed node or None if it isn't part of the tree.
+        """
+        if not isinstance(child, OSCQueryNode):
+            child = self.find_subnode(child)
+        if child is None or child is self or not self._is_ancestor_of(child):
+            return None
+
+        with _index_lock:
+            parent = child._parent
+            parent._contents.remove(child)
+            child._parent = None
+            parent._invalidate_json()
+            root = self._get_root()
+            if root._index is not None:
+                if root._index_has_duplicates:
+                    # a node with the same path might have been hidden by the removed one
+                    root._index = None
+                else:
+                    for node in child:
+                        if node.full_path is not None and root._index.get(node.full_path) is node:
+                            del root._index[node.full_path]
+        return child
 
     
+    def _attributes(self):
+        obj_dict = {}
+        for k, v in vars(self).items():
+            # private attributes (parent, path index, caches, contents) aren't part of the node
+            if v is None or k.startswith("_"):
+                continue
+            # a VALUE can't be parsed without its TYPE
+            if k == "value" and self.type_ is None:
+                continue
+            if k == "type_":
+                obj_dict["TYPE"] = Python_Type_List_to_OSC_Type(v)
+            else:
+                obj_dict[k.upper()] = v
+        return obj_dict
+
+    def _get_json(self):
+        cached = self._json
+        if cached is not None:
+            return cached
+
+        version = self._json_version
+        # same output as json.dumps(self, cls=OSCNodeEncoder), but reusing the cached JSON of the children
+        attributes = json.dumps(self._attributes(), cls=OSCNodeEncoder)
+        contents = self.contents
+        if contents is None:
+            text = attributes
+        else:
+            # like in a dict, the last node of a name wins
+            subNodes = {}
+            for subNode in contents:
+                if subNode.full_path is not None:
+                    subNodes[subNode.full_path.split("/")[-1]] = subNode
+            text = '{"CONTENTS": {' + ", ".join(
+                f"{json.dumps(name)}: {subNode._get_json()[0]}" for name, subNode in subNodes.items()
+            ) + "}" + (", " + attributes[1:] if attributes != "{}" else "}")
+        body = text.encode("utf-8")
+        cached = (text, body, f'"{zlib.crc32(body):08x}-{len(body):x}"')
+        with _json_cache_lock:
+            if self._json_version == version:
+                self._json = cached
+        return cached
+
     def to_json(self):
-        return json.dumps(self, cls=OSCNodeEncoder)
+        return self._get_json()[0]
+
+    def to_json_bytes(self):
+        """
+        Returns the utf-8 encoded JSON of the node and its ETag.
+        """
+        return self._get_json()[1:]
 
 
     def __iter__(self):
@@ -113,6 +287,7 @@ class OSCQueryNode():
 
 class OSCHostInfo():
     def __init__(self, name, extensions, osc_ip=None, osc_port=None, osc_transport=None, ws_ip=None, ws_port=None) -> None:
+        self._json = None
         self.name = name
         self.osc_ip = osc_ip
         self.osc_port = osc_port
@@ -121,12 +296,204 @@ class OSCHostInfo():
         self.ws_port = ws_port
         self.extensions = extensions
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if not name.startswith("_"):
+            self._json = None
+
     def to_json(self) -> str:
         return json.dumps(self, cls=OSCNodeEncoder)
 
+    def to_json_bytes(self):
+        """
+        Returns the utf-8 encoded JSON of the host info and its ETag, cached until an attribute changes.
+        """
+        cached = self._json
+        if cached is None:
+            body = self.to_json().encode("utf-8")
+            cached = self._json = (body, f'"{zlib.crc32(body):08x}-{len(body):x}"')
+        return cached
+
     def __str__(self) -> str:
         return json.dumps(self, cls=OSCNodeEncoder)
 
+class LazyOSCQueryNode(OSCQueryNode):
+    """
+    A node parsed from OSCQuery JSON (see node_from_json()) that builds its children on first
+    access of contents and keeps only the JSON of its own not yet built children, it's dropped
+    once they are built.
+
+    find_subnode() walks down by name instead of indexing the whole tree, so only the nodes on
+    the way are built.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._raw_contents = None
+        super().__init__(*args, **kwargs)
+
+    @property
+    def contents(self):
+        raw = self._raw_contents
+        if raw is not None:
+            self._raw_contents = None
+            OSCQueryNode.contents.fset(self, _nodes_from_json_contents(raw, self.full_path, LazyOSCQueryNode))
+        return self._contents
+
+    @contents.setter
+    def contents(self, contents):
+        self._raw_contents = None
+        OSCQueryNode.contents.fset(self, contents)
+
+    def find_subnode(self, full_path):
+        if self.full_path == full_path:
+            return self
+        if self.full_path is None or full_path is None:
+            return None
+        prefix = self.full_path.rstrip("/") + "/"
+        if not full_path.startswith(prefix):
+            return None
+
+        node = self
+        for name in full_path[len(prefix):].split("/"):
+            contents = node.contents
+            if contents is None:
+                return None
+            for subNode in contents:
+                if subNode.full_path is not None and subNode.full_path.rsplit("/", 1)[-1] == name:
+                    node = subNode
+                    break
+            else:
+                return None
+        return node
+
+
+def _node_from_json_attributes(json, full_path, cls):
+    # builds a node without its children
+    type_ = None
+    if "TYPE" in json:
+        type_ = OSC_Type_String_to_Python_Type(json["TYPE"])
+
+    access = None
+    if "ACCESS" in json:
+        access = OSCAccess(json["ACCESS"])
+
+    value = None
+    if "VALUE" in json:
+        # This should always be an array... throw an exception here?
+        if not isinstance(json['VALUE'], list):
+            raise Exception("OSCQuery JSON Value is not List / Array? Out-of-spec?")
+
+        value = []
+        for idx, v in enumerate(json["VALUE"]):
+            # According to the spec, if there is not yet a value, the return will be an empty JSON object
+            if isinstance(v, dict) and not v:
+                # FIXME does this apply to all values in the value array always...? I assume it does here
+                value = []
+                break
+            else:
+                value.append(type_[idx](v))
+
+    return cls(full_path=json.get("FULL_PATH", full_path), type_=type_, access=access, description=json.get("DESCRIPTION"), value=value)
+
+
+def _nodes_from_json_contents(contents, parent_path, cls):
+    # FULL_PATH *should* be required but some implementations don't have it, the path is made up from the names then
+    prefix = None if parent_path is None else parent_path.rstrip("/") + "/"
+    nodes = []
+    for name, child_json in contents.items():
+        node = _node_from_json_attributes(child_json, None if prefix is None else prefix + name, cls)
+        if cls is LazyOSCQueryNode:
+            node._raw_contents = child_json.get("CONTENTS")
+        nodes.append(node)
+    return nodes
+
+
+def node_from_json(json, lazy=True):
+    """
+    Builds a node tree from the parsed OSCQuery JSON of a node.
+
+    With lazy, a LazyOSCQueryNode is returned and children are built on demand. The JSON of subtrees
+    that weren't built yet stays referenced by their parent nodes, so the parsed document is only
+    released as far as the tree got built. Otherwise the whole tree is built at once, iteratively,
+    so deep trees don't hit the recursion limit, and no JSON is kept.
+    """
+    if lazy:
+        root = _node_from_json_attributes(json, None, LazyOSCQueryNode)
+        root._raw_contents = json.get("CONTENTS")
+        return root
+
+    root = _node_from_json_attributes(json, None, OSCQueryNode)
+    stack = [(root, json)]
+    while stack:
+        node, node_json = stack.pop()
+        contents = node_json.get("CONTENTS")
+        if contents is None:
+            continue
+        subNodes = _nodes_from_json_contents(contents, node.full_path, OSCQueryNode)
+        node.contents = subNodes
+        stack.extend(zip(subNodes, contents.values()))
+    return root
+
+
+class OSCQueryDiff(object):
+    """
+    Differences between two node trees, see diff_nodes().
+
+    Attributes
+    ----------
+    added : list
+        Nodes only in the new tree, including all nodes of added subtrees
+    removed : list
+        Nodes only in the old tree, including all nodes of removed subtrees
+    changed : list
+        (old node, new node) tuples of nodes in both trees with different attributes (value, type, access, ...)
+    """
+
+    def __init__(self, added, removed, changed) -> None:
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __str__(self) -> str:
+        return f"<OSCQueryDiff +{len(self.added)} -{len(self.removed)} ~{len(self.changed)}>"
+
+
+def diff_nodes(old, new):
+    """
+    Compares two node trees (e.g. two queries of the same node) by the names of their children.
+
+    Subtrees of LazyOSCQueryNodes that weren't built yet are compared by their JSON and only
+    built if they differ.
+    """
+    added = []
+    removed = []
+    changed = []
+    stack = [(old, new)]
+    while stack:
+        old_node, new_node = stack.pop()
+        if old_node._attributes() != new_node._attributes():
+            changed.append((old_node, new_node))
+
+        old_raw = getattr(old_node, "_raw_contents", None)
+        if old_raw is not None and old_raw == getattr(new_node, "_raw_contents", None):
+            continue
+        old_contents = {subNode.full_path.rsplit("/", 1)[-1]: subNode for subNode in old_node.contents or [] if subNode.full_path is not None}
+        new_contents = {subNode.full_path.rsplit("/", 1)[-1]: subNode for subNode in new_node.contents or [] if subNode.full_path is not None}
+        for name, subNode in new_contents.items():
+            old_subNode = old_contents.get(name)
+            if old_subNode is None:
+                added.extend(subNode)
+            else:
+                stack.append((old_subNode, subNode))
+        for name, subNode in old_contents.items():
+            if name not in new_contents:
+                removed.extend(subNode)
+    return OSCQueryDiff(added, removed, changed)
+
+
 def OSC_Type_String_to_Python_Type(typestr):
     types = []
     for typevalue in typestr:
@@ -0,0 +1,188 @@
+import base64
+import hashlib
+import os
+import socket
+import struct
+import threading
+
+# Minimal WebSocket (RFC 6455) implementation for the OSCQuery LISTEN extension, no extensions or subprotocols.
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+def accept_key(key):
+    """
+    Returns the Sec-WebSocket-Accept value for a Sec-WebSocket-Key.
+    """
+    return base64.b64encode(hashlib.sha1((key + GUID).encode("ascii")).digest()).decode("ascii")
+
+
+def _apply_mask(payload, key):
+    length = len(payload)
+    if length == 0:
+        return b""
+    # xor with the repeated key as one big integer instead of byte by byte
+    mask = (key * (length // 4 + 1))[:length]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(mask, "big")).to_bytes(length, "big")
+
+
+def encode_frame(opcode, payload, mask=False):
+    """
+    Encodes a single (final) frame, frames sent by clients have to be masked.
+    """
+    header = bytearray([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    length = len(payload)
+    if length < 126:
+        header.append(mask_bit | length)
+    elif length < 0x10000:
+        header.append(mask_bit | 126)
+        header += struct.pack("!H", length)
+    else:
+        header.append(mask_bit | 127)
+        header += struct.pack("!Q", length)
+    if mask:
+        key = os.urandom(4)
+        header += key
+        payload = _apply_mask(payload, key)
+    return bytes(header) + payload
+
+
+class WebSocket(object):
+    """
+    A WebSocket connection on a socket after the opening handshake.
+
+    send methods are thread safe, recv() must only be called from one thread.
+
+    Attributes
+    ----------
+    sock : socket.socket
+        Connected socket
+    client : bool
+        True on the client side, client frames are masked
+    closed : bool
+        True after a close frame was sent
+    """
+
+    def __init__(self, sock, rfile=None, client=False, max_size=1 << 20):
+        self.sock = sock
+        self.rfile = rfile if rfile is not None else sock.makefile("rb")
+        self.client = client
+        self.max_size = max_size
+        self.closed = False
+        self._send_lock = threading.Lock()
+
+    def send(self, opcode, payload):
+        frame = encode_frame(opcode, payload, self.client)
+        with self._send_lock:
+            self.sock.sendall(frame)
+
+    def send_text(self, text):
+        self.send(OP_TEXT, text.encode("utf-8"))
+
+    def send_binary(self, data):
+        self.send(OP_BINARY, data)
+
+    def _read_exact(self, length):
+        data = self.rfile.read(length)
+        if data is None or len(data) < length:
+            raise ConnectionError("WebSocket connection closed")
+        return data
+
+    def _read_frame(self):
+        first, second = self._read_exact(2)
+        length = second & 0x7F
+        if length == 126:
+            (length,) = struct.unpack("!H", self._read_exact(2))
+        elif length == 127:
+            (length,) = struct.unpack("!Q", self._read_exact(8))
+        if length > self.max_size:
+            raise ConnectionError(f"WebSocket frame of {length} bytes is too big")
+        key = self._read_exact(4) if second & 0x80 else None
+        payload = self._read_exact(length)
+        if key is not None:
+            payload = _apply_mask(payload, key)
+        return bool(first & 0x80), first & 0x0F, payload
+
+    def recv(self):
+        """
+        Waits for the next message, answers pings on the way.
+
+        Returns (OP_TEXT or OP_BINARY, payload bytes) or (OP_CLOSE, b"") when the other side closed the connection.
+        Raises ConnectionError (or OSError) if the connection broke.
+        """
+        opcode = None
+        message = b""
+        while True:
+            fin, frame_opcode, payload = self._read_frame()
+            if frame_opcode == OP_PING:
+                self.send(OP_PONG, payload)
+                continue
+            if frame_opcode == OP_PONG:
+                continue
+            if frame_opcode == OP_CLOSE:
+                self.close()
+                return OP_CLOSE, b""
+            if frame_opcode != OP_CONTINUATION:
+                opcode = frame_opcode
+                message = payload
+            else:
+                message += payload
+            if len(message) > self.max_size:
+                raise ConnectionError(f"WebSocket message of {len(message)} bytes is too big")
+            if fin:
+                return opcode, message
+
+    def close(self):
+        """
+        Sends a close frame (normal closure), the socket is closed by its owner.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.send(OP_CLOSE, struct.pack("!H", 1000))
+        except OSError:
+            pass
+
+
+def connect(host, port, path="/", timeout=None):
+    """
+    Opens a WebSocket connection to ws://host:port/path, timeout only applies to the handshake.
+    """
+    sock = socket.create_connection((host, port), timeout)
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        sock.sendall((
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {host}:{port}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n"
+            "\r\n"
+        ).encode("ascii"))
+        rfile = sock.makefile("rb")
+        status = rfile.readline().split()
+        headers = {}
+        while True:
+            line = rfile.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if status[1:2] != [b"101"] or headers.get("sec-websocket-accept") != accept_key(key):
+            raise ConnectionError(f"WebSocket handshake with {host}:{port} failed: {b' '.join(status).decode('latin-1')}")
+        sock.settimeout(None)
+        return WebSocket(sock, rfile, client=True)
+    except BaseException:
+        sock.close()
+        raise
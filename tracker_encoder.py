@@ -0,0 +1,219 @@
+import numpy
+
+AXES = ["PX", "PY", "PZ", "RX", "RY", "RZ"]
+
+
+class TrackerEncoder(object):
+    """
+    Encodes the poses of all configured trackers into OSC parameter values at once.
+
+    The tracker config (as received via ObjectTracking/config/index) is compiled into flat arrays
+    and is only recompiled after invalidate() has been called.
+
+    The previously encoded values are held until the pose moves far enough:
+    local values by more than deadband (meters/degrees per axis), remote values by more than
+    hysteresis quantization steps beyond the rounding boundary, so noise doesn't cause resends.
+
+    With a schema (the parameters of the current avatar), only parameters the avatar has are
+    compiled, cast to the avatar's parameter types.
+    """
+
+    def __init__(self, deadband: list = None, hysteresis: float = 0.0, schema: dict = None) -> None:
+        # in meters (position) and degrees (rotation), in order of AXES
+        self.deadband = numpy.zeros(6) if deadband is None else numpy.asarray(deadband, dtype=numpy.float64)
+        # in quantization steps of the remote values
+        self.hysteresis = hysteresis
+        # parameter name -> type of the avatar's parameters, None to send all parameters
+        self.schema = schema
+        # number of changed parameter values held back by the last encode()
+        self.suppressed = 0
+        self.names = []
+        # tracker name of every parameter, in order of parameters()
+        self.parameter_trackers = []
+        self.dirty = True
+        self._local_min = numpy.zeros((0, 6))
+        self._local_span = numpy.ones((0, 6))
+        self._remote_min = numpy.zeros((0, 6))
+        self._remote_span = numpy.ones((0, 6))
+        self._scale = numpy.zeros((0, 6))
+        self._shift = numpy.zeros((0, 6, 0), dtype=numpy.int64)
+        self._mask = numpy.zeros((0, 6, 0), dtype=numpy.int64)
+        self._digit_valid = numpy.zeros((0, 6, 0), dtype=bool)
+        self._local_deadband = numpy.zeros((0, 6))
+        self._held_local = None
+        self._held_bin = None
+        self._local_index = numpy.zeros(0, dtype=numpy.intp)
+        self._remote_index = numpy.zeros(0, dtype=numpy.intp)
+        self._casts = []
+        self._parameters = []
+
+    def set_schema(self, schema: dict) -> None:
+        """
+        Sets the parameters of the current avatar and marks the compiled tracker config as outdated.
+        Parameters:
+            schema (dict): Parameter name -> type (float, int or bool), None to send all parameters
+        Returns:
+            None
+        """
+        self.schema = schema
+        self.dirty = True
+
+    def invalidate(self) -> None:
+        """
+        Marks the compiled tracker config as outdated.
+        Returns:
+            None
+        """
+        self.dirty = True
+
+    def update(self, trackers: dict) -> bool:
+        """
+        Recompiles the tracker config if it got invalidated.
+        Parameters:
+            trackers (dict): Tracker config by tracker name
+        Returns:
+            bool: True if the config got recompiled
+        """
+        if not self.dirty:
+            return False
+        self.dirty = False
+        self.compile(trackers)
+        return True
+
+    def compile(self, trackers: dict) -> None:
+        """
+        Compiles the tracker config into arrays used by encode().
+        Parameters:
+            trackers (dict): Tracker config by tracker name
+        Returns:
+            None
+        """
+        names = []
+        configs = []
+        for name, tracker_config in list(trackers.items()):
+            if name == "global":
+                continue
+            # 1-6: bits, 7-12: local min, 13-18: remote min, 19-24: local max, 25-30: remote max
+            if any(tracker_config.get(index) is None for index in range(1, 31)):
+                continue
+            names.append(name)
+            configs.append([tracker_config[index] for index in range(1, 31)])
+
+        config = numpy.array(configs, dtype=numpy.float64).reshape(-1, 30)
+        bits = config[:, 0:6].astype(numpy.int64)
+        accuracy_bytes, accuracy_bits = numpy.divmod(bits, 8)
+        max_bytes = int(accuracy_bytes.max(initial=0))
+        max_bits = int(accuracy_bits.max(initial=0))
+
+        self._local_min = config[:, 6:12]
+        self._local_span = config[:, 18:24] - self._local_min
+        self._remote_min = config[:, 12:18]
+        self._remote_span = config[:, 24:30] - self._remote_min
+        self._scale = 2.0 ** bits - 1
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            self._local_deadband = numpy.where(self._local_span != 0, numpy.abs(self.deadband / self._local_span), 0.0)
+        self._held_local = None
+        self._held_bin = None
+
+        # every remote value is split into bytes (lowest first) followed by single bits
+        slot = numpy.arange(max_bytes + max_bits)
+        is_byte = slot < max_bytes
+        bit_slot = slot - max_bytes
+        self._shift = numpy.where(is_byte, 8 * slot, 8 * accuracy_bytes[..., None] + bit_slot)
+        self._mask = numpy.where(is_byte, 0xFF, 1) * numpy.ones_like(self._shift)
+        self._digit_valid = numpy.where(is_byte, slot < accuracy_bytes[..., None], bit_slot < accuracy_bits[..., None])
+
+        local_parameters = [f"ObjectTracking/{name}/L{key}" for name in names for key in AXES]
+        remote_parameters = [
+            f"ObjectTracking/{name}/R{key}-Byte{i}" if i < max_bytes else f"ObjectTracking/{name}/R{key}-Bit{i - max_bytes}"
+            for t, name in enumerate(names)
+            for a, key in enumerate(AXES)
+            for i in range(max_bytes + max_bits)
+            if self._digit_valid[t, a, i]
+        ]
+        local_trackers = [name for name in names for _ in AXES]
+        remote_trackers = [
+            name
+            for t, name in enumerate(names)
+            for _ in range(int(self._digit_valid[t].sum()))
+        ]
+
+        # flat indices of the sent values into the local values and the digits of the remote values
+        local_keep = range(len(local_parameters))
+        remote_keep = range(len(remote_parameters))
+        if self.schema is not None:
+            local_keep = [i for i, parameter in enumerate(local_parameters) if parameter in self.schema]
+            remote_keep = [i for i, parameter in enumerate(remote_parameters) if parameter in self.schema]
+        self._local_index = numpy.array(local_keep, dtype=numpy.intp)
+        self._remote_index = numpy.flatnonzero(self._digit_valid)[numpy.array(remote_keep, dtype=numpy.intp)]
+        self._parameters = [local_parameters[i] for i in local_keep] + [remote_parameters[i] for i in remote_keep]
+        self.parameter_trackers = [local_trackers[i] for i in local_keep] + [remote_trackers[i] for i in remote_keep]
+        # (position, type) of parameters the avatar has with another type than the encoded float (local) or int (remote)
+        self._casts = []
+        if self.schema is not None:
+            for position, parameter in enumerate(self._parameters):
+                encoded_type = float if position < len(local_keep) else int
+                if self.schema[parameter] not in (None, encoded_type):
+                    self._casts.append((position, self.schema[parameter]))
+        self.names = names
+
+    def encode(self, values: numpy.ndarray, valid: numpy.ndarray) -> tuple[list, list]:
+        """
+        Maps, clips, quantizes and splits the pose values of all compiled trackers.
+        Parameters:
+            values (numpy.ndarray): (N, 6) array of px, py, pz, rx, ry, rz (rotation in degrees) in order of names
+            valid (numpy.ndarray): (N,) bool array, trackers without a valid pose are sent as default position
+        Returns:
+            tuple[list, list]: local float values and remote byte/bit values of the compiled parameters
+        """
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            value_local = numpy.where(
+                self._local_span != 0,
+                (values - self._local_min) / self._local_span,
+                values >= self._local_min,
+            )
+            value_remote = numpy.where(
+                self._remote_span != 0,
+                (values - self._remote_min) / self._remote_span,
+                values >= self._remote_min,
+            )
+        valid = valid[:, None]
+        value_local = numpy.where(valid, numpy.clip(value_local, 0, 1), 0.0)
+        value_remote = numpy.where(valid, numpy.clip(value_remote, 0, 1), 0.0) * self._scale
+        value_bin = numpy.rint(value_remote).astype(numpy.int64)
+
+        self.suppressed = 0
+        if self._held_local is not None:
+            # trackers without a valid pose always get the default position
+            hold_local = valid & (numpy.abs(value_local - self._held_local) <= self._local_deadband)
+            self.suppressed += int(numpy.count_nonzero(hold_local & (value_local != self._held_local)))
+            value_local = numpy.where(hold_local, self._held_local, value_local)
+
+            hold_remote = valid & (numpy.abs(value_remote - self._held_bin) < 0.5 + self.hysteresis)
+            changed = hold_remote & (value_bin != self._held_bin)
+            if changed.any():
+                digit_changed = self._digits(value_bin) != self._digits(self._held_bin)
+                self.suppressed += int(numpy.count_nonzero(digit_changed & changed[..., None] & self._digit_valid))
+            value_bin = numpy.where(hold_remote, self._held_bin, value_bin)
+        self._held_local = value_local
+        self._held_bin = value_bin
+
+        return value_local.ravel()[self._local_index].tolist(), self._digits(value_bin).ravel()[self._remote_index].tolist()
+
+    def _digits(self, value_bin: numpy.ndarray) -> numpy.ndarray:
+        return (value_bin[..., None] >> self._shift) & self._mask
+
+    def parameters(self, values: numpy.ndarray, valid: numpy.ndarray) -> zip:
+        """
+        Encodes the pose values and pairs them with their parameter names.
+        Parameters:
+            values (numpy.ndarray): (N, 6) array of px, py, pz, rx, ry, rz (rotation in degrees) in order of names
+            valid (numpy.ndarray): (N,) bool array, trackers without a valid pose are sent as default position
+        Returns:
+            zip: (parameter, value) pairs
+        """
+        value_local, value_remote = self.encode(values, valid)
+        encoded = value_local + value_remote
+        for position, type_ in self._casts:
+            encoded[position] = type_(encoded[position])
+        return zip(self._parameters, encoded)
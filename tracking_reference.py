@@ -0,0 +1,148 @@
+import logging
+import numpy
+from pose_math import flatten_to_yaw, rigid_inverse, yaw_rotation
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_METHODS = ("mean", "median")
+
+
+class TrackingReferenceEstimator(object):
+    """
+    Estimates the tracking reference (the origin all trackers are sent relative to) from the base station poses.
+
+    Base stations don't move, so the reference is only recomputed when a base station is added or moved
+    further than threshold (meters) / angle_threshold (degrees) since the last calibration. Tracking noise
+    below the thresholds doesn't shift the reference and no work is done for it.
+
+    The reference lies on the floor (y = 0). Its position is the mean or median of the base station
+    positions, base stations further than outlier_distance from the median position are left out.
+    With yaw, the reference is rotated like the base stations: along the line from the first to the
+    second base station (by serial number), or like the base station itself if there is only one.
+
+    Attributes
+    ----------
+    method : str
+        One of REFERENCE_METHODS
+    threshold : float
+        Distance in meters a base station has to move to recompute the reference
+    angle_threshold : float
+        Angle in degrees a base station has to turn to recompute the reference
+    outlier_distance : float
+        Distance in meters from the median position beyond which base stations are ignored, 0 to keep all
+    yaw : bool
+        True to rotate the reference like the base stations, False for the rotation of the tracking space
+    reference : numpy.ndarray
+        (4, 4) tracking reference, identity until there are base stations
+    inverse : numpy.ndarray
+        (4, 4) inverse of reference, inverse @ pose is the pose relative to the reference
+    recalibrations : int
+        Number of times the reference got recomputed
+    """
+
+    def __init__(self, method: str = "mean", threshold: float = 0.01, angle_threshold: float = 1.0, outlier_distance: float = 0.0, yaw: bool = False) -> None:
+        if method not in REFERENCE_METHODS:
+            raise Exception(f"Unknown tracking reference method {method}, expected one of {', '.join(REFERENCE_METHODS)}")
+        self.method = method
+        self.threshold = threshold
+        self.angle_threshold = angle_threshold
+        self.outlier_distance = outlier_distance
+        self.yaw = yaw
+        self.reference = numpy.eye(4)
+        self.inverse = numpy.eye(4)
+        self.recalibrations = 0
+        self._serials = ()
+        self._poses = numpy.zeros((0, 4, 4))
+
+    def update(self, references: dict) -> bool:
+        """
+        Recomputes the reference if a base station got added or moved past the thresholds.
+        Parameters:
+            references (dict): (4, 4) base station poses by serial number
+        Returns:
+            bool: True if the reference got recomputed
+        """
+        if len(references) == 0:
+            return False
+        serials = tuple(sorted(references.keys()))
+        poses = numpy.stack([references[serial] for serial in serials])
+        if serials == self._serials:
+            distance = numpy.linalg.norm(poses[:, 0:3, 3] - self._poses[:, 0:3, 3], axis=-1)
+            # cosine of the rotation angle between old and new orientation from the trace of old^T @ new
+            cos_angle = (numpy.einsum("nij,nij->n", self._poses[:, 0:3, 0:3], poses[:, 0:3, 0:3]) - 1) / 2
+            moved = (distance > self.threshold) | (cos_angle < numpy.cos(numpy.radians(self.angle_threshold)))
+            if not moved.any():
+                return False
+            angle = numpy.degrees(numpy.arccos(numpy.clip(cos_angle, -1, 1)))
+            for i in numpy.flatnonzero(moved):
+                logger.info(f"Base station {serials[i]} moved by {distance[i]:.3f}m / {angle[i]:.1f}°, recalibrating tracking reference")
+        else:
+            added = [serial for serial in serials if serial not in self._serials]
+            removed = [serial for serial in self._serials if serial not in serials]
+            if added:
+                logger.info(f"Base station{'s' if len(added) > 1 else ''} {', '.join(added)} found, calibrating tracking reference")
+            if removed:
+                logger.info(f"Base station{'s' if len(removed) > 1 else ''} {', '.join(removed)} removed, calibrating tracking reference")
+        self._serials = serials
+        self._poses = poses
+        self.reference = self.compute(serials, poses)
+        self.inverse = rigid_inverse(self.reference)
+        self.recalibrations += 1
+        return True
+
+    def compute(self, serials: tuple, poses: numpy.ndarray) -> numpy.ndarray:
+        """
+        Computes the reference from base station poses.
+        Parameters:
+            serials (tuple): Serial numbers of the base stations, sorted
+            poses (numpy.ndarray): (N, 4, 4) base station poses in order of serials
+        Returns:
+            numpy.ndarray: (4, 4) tracking reference
+        """
+        positions = poses[:, 0:3, 3]
+        keep = numpy.ones(len(serials), dtype=bool)
+        if self.outlier_distance > 0 and len(serials) > 2:
+            keep = numpy.linalg.norm(positions - numpy.median(positions, axis=0), axis=-1) <= self.outlier_distance
+            if not keep.any():
+                keep[:] = True
+            for i in numpy.flatnonzero(~keep):
+                logger.info(f"Base station {serials[i]} is more than {self.outlier_distance}m off, ignored for the tracking reference")
+        positions = positions[keep]
+
+        reference = numpy.eye(4)
+        reference[0:3, 3] = positions.mean(axis=0) if self.method == "mean" else numpy.median(positions, axis=0)
+        reference[1, 3] = 0
+        if self.yaw:
+            if len(positions) == 1:
+                reference[0:3, 0:3] = flatten_to_yaw(poses[keep][0, 0:3, 0:3])
+            else:
+                direction = positions[1] - positions[0]
+                reference[0:3, 0:3] = yaw_rotation(numpy.arctan2(direction[0], direction[2]))
+        return reference
+
+
+if __name__ == "__main__":
+    # self check: noise below the thresholds keeps the reference, a bumped base station is rejected as outlier,
+    # removed base stations are left out
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    def station(x: float, z: float) -> numpy.ndarray:
+        pose = numpy.eye(4)
+        pose[0:3, 3] = [x, 2.0, z]
+        return pose
+
+    stations = {"LHB-0": station(-2, -2), "LHB-1": station(2, 2), "LHB-2": station(2, -2), "LHB-3": station(-2, 2)}
+    estimator = TrackingReferenceEstimator("mean", outlier_distance=3.5, yaw=True)
+    assert estimator.update(stations), "base stations found without calibrating"
+    assert numpy.allclose(estimator.reference[0:3, 3], 0), "reference isn't in the middle of the base stations"
+    stations["LHB-1"] = station(2.005, 2)
+    assert not estimator.update(stations), "reference recomputed on noise"
+    stations["LHB-1"] = station(8, 8)
+    assert estimator.update(stations), "reference not recomputed after a base station moved"
+    # the other 3 base stations are left, mean (-2, -2), (2, -2), (-2, 2)
+    assert numpy.allclose(estimator.reference[0:3, 3], [-2 / 3, 0, -2 / 3]), "moved base station wasn't rejected"
+    assert numpy.allclose(estimator.inverse @ estimator.reference, numpy.eye(4)), "inverse doesn't match reference"
+    del stations["LHB-1"], stations["LHB-3"]
+    assert estimator.update(stations), "reference not recomputed after base stations got removed"
+    assert numpy.allclose(estimator.reference[0:3, 3], [0, 0, -2]), "removed base stations are still used"
+    print(f"ok, {estimator.recalibrations} calibrations")
@@ -0,0 +1,175 @@
+import struct
+import sys
+import time
+from threading import Lock
+import numpy
+
+DIRECTION_OUT = 0
+DIRECTION_IN = 1
+
+TYPE_FLOAT = 0
+TYPE_INT = 1
+TYPE_BOOL = 2
+TYPE_OTHER = 3
+
+# Dump file layout:
+#   FILE_HEADER
+#   address count * (ADDRESS_HEADER + utf-8 address), in order of address id
+#   record count * RECORD, oldest first
+FILE_MAGIC = b"OTTRAFF\x00"
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct("<8sIddII")  # magic, version, wall clock and perf_counter at dump time, address count, record count
+ADDRESS_HEADER = struct.Struct("<H")  # address length
+RECORD = struct.Struct("<dHBBd")  # perf_counter, address id, direction, type, value
+RECORD_DTYPE = numpy.dtype([
+    ("time", "<f8"),
+    ("address", "<u2"),
+    ("direction", "u1"),
+    ("type", "u1"),
+    ("value", "<f8"),
+])
+MAX_ADDRESSES = 0x10000
+
+
+class TrafficRecorder(object):
+    """
+    Keeps the last capacity sent and received OSC messages in a fixed size ring buffer.
+
+    Messages are packed into RECORD_DTYPE records, addresses are stored once and referenced by id.
+    Values that aren't numbers (e.g. avatar ids) are recorded as NaN.
+    """
+
+    def __init__(self, capacity: int = 65536) -> None:
+        self.capacity = capacity
+        # number of messages recorded so far, including overwritten ones
+        self.count = 0
+        self._buffer = bytearray(capacity * RECORD.size)
+        self._position = 0
+        self._addresses = []
+        self._address_ids = {}
+        self._lock = Lock()
+
+    def record(self, direction: int, address: str, value) -> None:
+        """
+        Records a message, safe to call from any thread.
+        Parameters:
+            direction (int): DIRECTION_OUT or DIRECTION_IN
+            address (str): OSC address
+            value (any): Value of the message
+        Returns:
+            None
+        """
+        if isinstance(value, bool):
+            value_type = TYPE_BOOL
+        elif isinstance(value, int):
+            value_type = TYPE_INT
+        elif isinstance(value, float):
+            value_type = TYPE_FLOAT
+        else:
+            value_type = TYPE_OTHER
+            value = numpy.nan
+        now = time.perf_counter()
+        with self._lock:
+            address_id = self._address_ids.get(address)
+            if address_id is None:
+                if len(self._addresses) >= MAX_ADDRESSES:
+                    return
+                address_id = self._address_ids[address] = len(self._addresses)
+                self._addresses.append(address)
+            RECORD.pack_into(self._buffer, self._position * RECORD.size, now, address_id, direction, value_type, value)
+            self._position = (self._position + 1) % self.capacity
+            self.count += 1
+
+    def to_bytes(self) -> bytes:
+        """
+        Serializes the recorded messages, oldest first.
+        Returns:
+            bytes: Dump file content
+        """
+        with self._lock:
+            offset = self._position * RECORD.size
+            if self.count >= self.capacity:
+                records = self._buffer[offset:] + self._buffer[:offset]
+            else:
+                records = self._buffer[:offset]
+            addresses = list(self._addresses)
+        parts = [FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, time.time(), time.perf_counter(), len(addresses), len(records) // RECORD.size)]
+        for address in addresses:
+            encoded = address.encode("utf-8")
+            parts.append(ADDRESS_HEADER.pack(len(encoded)) + encoded)
+        # joined in one go, the records are copied only once more
+        parts.append(records)
+        return b"".join(parts)
+
+    def dump(self, path: str) -> None:
+        """
+        Writes the recorded messages to a file.
+        Parameters:
+            path (str): Path of the dump file
+        Returns:
+            None
+        """
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+
+def load(path: str) -> tuple[list, numpy.ndarray]:
+    """
+    Reads a dump file written by TrafficRecorder.
+    Parameters:
+        path (str): Path of the dump file
+    Returns:
+        tuple[list, numpy.ndarray]: addresses by id and RECORD_DTYPE records with time in seconds since the epoch
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, wall_clock, clock, address_count, record_count = FILE_HEADER.unpack_from(data, 0)
+    if magic != FILE_MAGIC or version != FILE_VERSION:
+        raise Exception(f"{path} is not a traffic dump (version {FILE_VERSION})!")
+    offset = FILE_HEADER.size
+    addresses = []
+    for _ in range(address_count):
+        (length,) = ADDRESS_HEADER.unpack_from(data, offset)
+        offset += ADDRESS_HEADER.size
+        addresses.append(data[offset:offset + length].decode("utf-8"))
+        offset += length
+    records = numpy.frombuffer(data, dtype=RECORD_DTYPE, count=record_count, offset=offset).copy()
+    records["time"] += wall_clock - clock
+    return addresses, records
+
+
+def summarize(addresses: list, records: numpy.ndarray) -> str:
+    """
+    Summarizes update rates and gaps by address and direction.
+    Parameters:
+        addresses (list): Addresses by id
+        records (numpy.ndarray): RECORD_DTYPE records
+    Returns:
+        str: Report
+    """
+    if len(records) == 0:
+        return "No messages recorded"
+    start = records["time"][0]
+    end = records["time"][-1]
+    duration = max(end - start, 1e-9)
+    lines = [
+        f"{len(records)} messages from {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start))} over {duration:.2f}s",
+        f"{'dir':<3} {'messages':>8} {'rate':>9} {'gap p50':>9} {'gap p99':>9} {'gap max':>9} {'last value':>12}  address",
+    ]
+    for direction, name in [(DIRECTION_OUT, "out"), (DIRECTION_IN, "in")]:
+        selected = records[records["direction"] == direction]
+        for address_id in numpy.unique(selected["address"]):
+            messages = selected[selected["address"] == address_id]
+            gaps = numpy.diff(messages["time"]) * 1000
+            p50, p99, maximum = numpy.percentile(gaps, [50, 99, 100]) if len(gaps) else (numpy.nan,) * 3
+            lines.append(
+                f"{name:<3} {len(messages):>8} {len(messages) / duration:>7.1f}Hz {p50:>7.1f}ms {p99:>7.1f}ms {maximum:>7.1f}ms {messages['value'][-1]:>12.6g}  {addresses[address_id]}"
+            )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(f"Usage: python {sys.argv[0]} <traffic dump>")
+        sys.exit(1)
+    print(summarize(*load(sys.argv[1])))
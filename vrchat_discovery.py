@@ -0,0 +1,121 @@
+import logging
+import re
+import time
+from threading import Condition
+from tinyoscquery.query import OSCQueryBrowser, OSCQueryClient
+
+VRCHAT_CLIENT_REGEX = r"VRChat-Client-[A-F0-9]{6}"
+OSCJSON_TYPE = "_oscjson._tcp.local."
+
+logger = logging.getLogger(__name__)
+
+
+class VRChatDiscovery(object):
+    """
+    Finds VRChat clients with a long-lived OSCQueryBrowser.
+
+    Services are resolved as soon as they are announced, a restarted VRChat announces itself again
+    and replaces the previous client. With multiple VRChat clients the most recently announced one is used.
+
+    Attributes
+    ----------
+    browser : OSCQueryBrowser
+        Browser used for discovery
+    clients : dict
+        Service name -> (OSCQueryClient, OSCHostInfo, perf_counter when found) of the VRChat clients
+    started : float
+        perf_counter when the discovery started
+    """
+
+    def __init__(self, regex: str = VRCHAT_CLIENT_REGEX, browser: OSCQueryBrowser = None) -> None:
+        self.regex = re.compile(regex)
+        self.clients = {}
+        self.started = time.perf_counter()
+        self._condition = Condition()
+        self.browser = browser or OSCQueryBrowser()
+        self.browser.add_callback(self._on_service_change)
+
+    def _on_service_change(self, event: str, type_: str, name: str, info) -> None:
+        if type_ != OSCJSON_TYPE:
+            return
+        if event == "removed":
+            with self._condition:
+                if self.clients.pop(name, None) is not None:
+                    logger.info("VRChat Client %s is gone", name)
+                    self._condition.notify_all()
+            return
+        self.browser.submit(self._resolve, info)
+
+    def _resolve(self, info, retries: int = 8, interval: float = 0.05) -> None:
+        client = self.browser.get_client(info)
+        while True:
+            try:
+                host_info = client.get_host_info(refresh=True)
+            except Exception as e:
+                logger.debug("Querying host info of %s failed: %s", info.name, e)
+                host_info = None
+            # a service can be announced before its HTTP server answers, retry until it does or is gone
+            if host_info is not None or retries == 0 or self.browser.listener.oscjson_services.get(info.name) is not info:
+                break
+            time.sleep(interval)
+            interval *= 2
+            retries -= 1
+        if host_info is None or not self.regex.match(host_info.name):
+            return
+        with self._condition:
+            self.clients[info.name] = (client, host_info, time.perf_counter())
+            self._condition.notify_all()
+        logger.debug("Found VRChat Client %s after %.3fs", host_info.name, time.perf_counter() - self.started)
+
+    def wait(self, timeout: float = None) -> OSCQueryClient | None:
+        """
+        Waits for a VRChat client to be discovered.
+        Parameters:
+            timeout (float): Seconds to wait at most, None to wait forever
+        Returns:
+            OSCQueryClient | None: Client of the most recently announced VRChat client, None after the timeout
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.clients, timeout):
+                return None
+            if len(self.clients) > 1:
+                logger.warning("Found %d VRChat Clients (%s), using the latest", len(self.clients), ", ".join(hi.name for _, hi, _ in self.clients.values()))
+            return max(self.clients.values(), key=lambda entry: entry[2])[0]
+
+    def wait_ready(self, client: OSCQueryClient, timeout: float = None, interval: float = 0.05, max_interval: float = 1.0) -> bool:
+        """
+        Waits for a VRChat client to serve its endpoints, polling with an increasing interval.
+        Parameters:
+            client (OSCQueryClient): VRChat client
+            timeout (float): Seconds to wait at most, None to wait forever
+            interval (float): First poll interval in seconds
+            max_interval (float): Longest poll interval in seconds
+        Returns:
+            bool: True if ready, False after the timeout or if the client is gone
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while client.query_node("/avatar/change") is None:
+            with self._condition:
+                if client.service_info.name not in self.clients:
+                    return False
+            if deadline is not None and time.perf_counter() + interval > deadline:
+                return False
+            time.sleep(interval)
+            interval = min(interval * 2, max_interval)
+        return True
+
+    def wait_gone(self, client: OSCQueryClient, timeout: float = None) -> bool:
+        """
+        Waits for a VRChat client to be removed or replaced (e.g. after its service changed).
+        Parameters:
+            client (OSCQueryClient): VRChat client
+            timeout (float): Seconds to wait at most, None to wait forever
+        Returns:
+            bool: True if the client is gone, False after the timeout
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.clients.get(client.service_info.name, (None,))[0] is not client, timeout)
+
+    def close(self) -> None:
+        self.browser.remove_callback(self._on_service_change)
+        self.browser.close()